@@ -0,0 +1,292 @@
+"""Almacenamiento particionado de la base por prestador y periodo.
+
+La base compacta (con metricas derivadas) se guarda en particiones estilo
+hive, `shard=NN/anio=AAAA/parte-NNNN.parquet`, donde el shard se obtiene del
+ID del prestador. Un manifiesto pequeño guarda las metricas globales, los
+catalogos de prestadores y prestaciones y el shard de cada prestador, de
+modo que la app puede arrancar y filtrar sin leer toda la historia.
+
+Cada version de la base (segun su firma) tiene su propio directorio
+`v-<firma>`, asi las lecturas en curso sobre una version no se ven afectadas
+cuando se genera la siguiente.
+
+Las particiones se generan por bloques (procesamiento_bloques), con una
+memoria de trabajo maxima, asi que no hace falta que la base entre en memoria.
+
+Uso (regenera las particiones a partir de la base unificada):
+
+    python almacenamiento.py
+    python almacenamiento.py --memoria-max 256
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import zlib
+
+import pandas as pd
+
+from motor_auditoria import (
+    RUTA_BASE,
+    CLAVE_SERIE,
+    COLUMNAS_CATEGORICAS,
+    COLUMNAS_METADATOS,
+    COLUMNAS_ENTERAS,
+    compactar_base,
+    reporte_memoria
+)
+from procesamiento_bloques import (
+    MEMORIA_MAX_MB,
+    N_CUBETAS,
+    MemoriaInsuficiente,
+    preparar_lotes,
+    leer_lote,
+    esquema_global
+)
+
+DIR_PARTICIONES = 'base_particionada'
+ARCHIVO_MANIFIESTO = 'manifiesto.json'
+
+N_SHARDS = 16
+
+# Incrementar al cambiar el esquema de las particiones
+VERSION_PARTICIONES = 2
+
+_bloqueo_particionado = threading.Lock()
+
+# ============================================
+# MANIFIESTO
+# ============================================
+
+def shard_prestador(prestador, n_shards=N_SHARDS):
+    """Shard estable de un prestador"""
+    return zlib.crc32(str(prestador).encode('utf-8')) % n_shards
+
+def firma_archivo(ruta):
+    """Firma barata de un archivo (tamaño, fecha de modificacion en ns e inodo).
+
+    Con el inodo y los nanosegundos se detecta un reemplazo del mismo tamaño
+    hecho dentro del mismo segundo (por ejemplo con os.replace).
+    """
+    info = os.stat(ruta)
+    return f"{info.st_size}-{info.st_mtime_ns}-{info.st_ino}"
+
+def leer_manifiesto_base(dir_particiones=DIR_PARTICIONES):
+    """Lee el manifiesto de las particiones (None si no existe)"""
+    ruta = os.path.join(dir_particiones, ARCHIVO_MANIFIESTO)
+    if not os.path.exists(ruta):
+        return None
+    with open(ruta, encoding='utf-8') as f:
+        return json.load(f)
+
+def dir_version(firma, dir_particiones=DIR_PARTICIONES):
+    """Directorio de las particiones de una version de la base"""
+    return os.path.join(dir_particiones, f'v-{firma}')
+
+def particiones_vigentes(ruta_base=RUTA_BASE, dir_version_base=None):
+    """Indica si las particiones corresponden a la version actual de la base"""
+    firma = firma_archivo(ruta_base)
+    manifiesto = leer_manifiesto_base(dir_version_base or dir_version(firma))
+    return (
+        manifiesto is not None
+        and manifiesto.get('version_particiones') == VERSION_PARTICIONES
+        and manifiesto.get('firma_origen') == firma
+    )
+
+def limpiar_versiones(conservar, dir_particiones=DIR_PARTICIONES):
+    """Borra los directorios de versiones que no estan en conservar"""
+    if not os.path.isdir(dir_particiones):
+        return
+    conservar = {f'v-{firma}' for firma in conservar}
+    for nombre in os.listdir(dir_particiones):
+        if nombre.startswith('v-') and nombre not in conservar:
+            shutil.rmtree(os.path.join(dir_particiones, nombre), ignore_errors=True)
+
+# ============================================
+# ESCRITURA
+# ============================================
+
+def particionar_base(ruta_base=RUTA_BASE, dir_particiones=DIR_PARTICIONES, n_shards=N_SHARDS,
+                     memoria_max_mb=MEMORIA_MAX_MB):
+    """Genera las particiones y el manifiesto a partir de la base unificada.
+
+    La base se derrama por prestador en cubetas y se recorre por lotes que
+    respetan memoria_max_mb: cada lote se compacta con el esquema de toda la
+    base y agrega un archivo parte-NNNN.parquet a cada particion que toca.
+    Lanza MemoriaInsuficiente si un lote minimo no entra en esa memoria.
+
+    Se escriben en un directorio temporal que luego se renombra al directorio
+    de la version (dir_particiones/v-<firma>).
+    """
+    firma = firma_archivo(ruta_base)
+
+    destino = dir_version(firma, dir_particiones)
+    temporal = destino + '.tmp'
+    bloques = destino + '.bloques'
+    shutil.rmtree(temporal, ignore_errors=True)
+    shutil.rmtree(bloques, ignore_errors=True)
+    os.makedirs(temporal)
+    os.makedirs(bloques)
+
+    columnas, metadatos = None, {}
+    memoria_original, memoria_compacta = pd.Series(dtype=float), pd.Series(dtype=float)
+    categorias = {col: set() for col in COLUMNAS_CATEGORICAS}
+    try:
+        parcial, lotes, _ = preparar_lotes(ruta_base, memoria_max_mb, N_CUBETAS, bloques)
+        esquema = esquema_global(parcial)
+
+        for n_lote, lote in enumerate(lotes):
+            datos = leer_lote(lote, bloques)
+            memoria_original = memoria_original.add(datos.memory_usage(deep=True, index=False), fill_value=0)
+            datos, metadatos = compactar_base(datos, **esquema)
+            memoria_compacta = memoria_compacta.add(datos.memory_usage(deep=True, index=False), fill_value=0)
+            columnas = columnas or datos.columns.tolist()
+            for col in COLUMNAS_CATEGORICAS:
+                categorias[col].update(str(c) for c in datos[col].cat.categories)
+
+            shards = datos['ID'].astype(str).map(lambda p: shard_prestador(p, n_shards))
+            for (shard, anio), parte in datos.groupby([shards, datos['MesFecha'].dt.year], sort=True):
+                carpeta = os.path.join(temporal, f'shard={shard:02d}', f'anio={anio}')
+                os.makedirs(carpeta, exist_ok=True)
+                parte.to_parquet(os.path.join(carpeta, f'parte-{n_lote:04d}.parquet'), index=False)
+    except BaseException:
+        shutil.rmtree(temporal, ignore_errors=True)
+        raise
+    finally:
+        shutil.rmtree(bloques, ignore_errors=True)
+
+    meses = sorted(pd.Timestamp(m) for m in parcial['meses'])
+    prestadores = sorted(parcial['prestadores'])
+    manifiesto = {
+        'version_particiones': VERSION_PARTICIONES,
+        'firma_origen': firma,
+        'generado': pd.Timestamp.now().isoformat(timespec='seconds'),
+        'n_shards': n_shards,
+        'registros': int(parcial['registros']),
+        'fecha_min': meses[0].strftime('%Y-%m-%d'),
+        'fecha_max': meses[-1].strftime('%Y-%m-%d'),
+        'anios': sorted({m.year for m in meses}),
+        'columnas': columnas,
+        'prestadores': prestadores,
+        'shards': {p: shard_prestador(p, n_shards) for p in prestadores},
+        'categorias': {col: sorted(valores) for col, valores in categorias.items()},
+        'metadatos_carga': metadatos,
+        'reporte_memoria': reporte_memoria(memoria_original, memoria_compacta).to_dict()
+    }
+    with open(os.path.join(temporal, ARCHIVO_MANIFIESTO), 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, ensure_ascii=False)
+
+    shutil.rmtree(destino, ignore_errors=True)
+    os.replace(temporal, destino)
+    return manifiesto
+
+def asegurar_particiones(ruta_base=RUTA_BASE, dir_particiones=DIR_PARTICIONES):
+    """Genera las particiones de la version actual de la base si no existen.
+
+    Devuelve el manifiesto de esa version. Un solo hilo regenera a la vez.
+    """
+    with _bloqueo_particionado:
+        destino = dir_version(firma_archivo(ruta_base), dir_particiones)
+        if not particiones_vigentes(ruta_base, destino):
+            return particionar_base(ruta_base, dir_particiones)
+        return leer_manifiesto_base(destino)
+
+# ============================================
+# LECTURA
+# ============================================
+
+def cargar_particiones(prestadores=None, desde=None, hasta=None, columnas=None, dir_version_base=None):
+    """Lee solo las particiones necesarias para los prestadores y el periodo.
+
+    Sin prestadores se leen todos; desde/hasta acotan las particiones por año
+    y las filas por MesFecha. Con columnas se leen solo esas columnas (mas las
+    de orden). dir_version_base es el directorio de la version a leer (por
+    defecto, la de la base actual). El resultado conserva el esquema compacto
+    y el orden por serie y mes de leer_base.
+    """
+    dir_particiones = dir_version_base or dir_version(firma_archivo(RUTA_BASE))
+    manifiesto = leer_manifiesto_base(dir_particiones)
+
+    if columnas is not None:
+        orden = CLAVE_SERIE + ['MesFecha', 'Tipo Clase CM']
+        columnas = orden + [c for c in columnas if c not in orden]
+
+    if prestadores is None:
+        shards = range(manifiesto['n_shards'])
+    else:
+        prestadores = [str(p) for p in prestadores]
+        shards = sorted({manifiesto['shards'][p] for p in prestadores if p in manifiesto['shards']})
+
+    desde = pd.to_datetime(desde) if desde is not None else None
+    hasta = pd.to_datetime(hasta) if hasta is not None else None
+    anios = [
+        a for a in manifiesto['anios']
+        if (desde is None or a >= desde.year) and (hasta is None or a <= hasta.year)
+    ]
+
+    filtros = [('ID', 'in', prestadores)] if prestadores is not None else None
+    partes = []
+    for shard in shards:
+        for anio in anios:
+            carpeta = os.path.join(dir_particiones, f'shard={shard:02d}', f'anio={anio}')
+            if not os.path.isdir(carpeta):
+                continue
+            for archivo in sorted(os.listdir(carpeta)):
+                if archivo.endswith('.parquet'):
+                    partes.append(pd.read_parquet(os.path.join(carpeta, archivo), columns=columnas, filters=filtros))
+
+    if not partes:
+        return pd.DataFrame(columns=columnas or manifiesto['columnas'])
+
+    # Con filtro por prestador muchos archivos quedan vacios; se conserva uno por el esquema
+    partes = [parte for parte in partes if len(parte)] or partes[:1]
+
+    df = pd.concat(partes, ignore_index=True)
+
+    # Se unifican las categorias con el catalogo global del manifiesto
+    for col, categorias in manifiesto['categorias'].items():
+        if col not in df.columns:
+            continue
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].cat.set_categories(categorias)
+        else:
+            df[col] = pd.Categorical(df[col], categories=categorias)
+
+    # Cada archivo se compacto por separado: se reajusta el tipo de las
+    # columnas que concat pudo ensanchar
+    for col in [c for c in COLUMNAS_METADATOS if c in df.columns]:
+        df[col] = df[col].astype('category')
+    for col in [c for c in COLUMNAS_ENTERAS if c in df.columns]:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+
+    if desde is not None:
+        df = df[df['MesFecha'] >= desde]
+    if hasta is not None:
+        df = df[df['MesFecha'] <= hasta]
+
+    df = df.sort_values(CLAVE_SERIE + ['MesFecha', 'Tipo Clase CM'], kind='mergesort').reset_index(drop=True)
+    df.attrs['metadatos_carga'] = manifiesto.get('metadatos_carga', {})
+    return df
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera las particiones de la base unificada")
+    parser.add_argument('--base', default=RUTA_BASE, help="Ruta de la base unificada")
+    parser.add_argument('--salida', default=DIR_PARTICIONES, help="Directorio de particiones")
+    parser.add_argument('--shards', type=int, default=N_SHARDS, help="Cantidad de shards por prestador")
+    parser.add_argument('--memoria-max', type=float, default=MEMORIA_MAX_MB, help="Memoria maxima de trabajo (MB)")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    try:
+        manifiesto = particionar_base(args.base, args.salida, args.shards, args.memoria_max)
+    except MemoriaInsuficiente as e:
+        sys.exit(f"Error: {e}")
+    print(f"Registros: {manifiesto['registros']:,} | prestadores: {len(manifiesto['prestadores'])} | "
+          f"tiempo: {time.perf_counter() - inicio:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,26 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from datetime import datetime
-import plotly.graph_objects as go
-import plotly.express as px
-from plotly.subplots import make_subplots
+
+from motor_auditoria import (
+    buscar_historico,
+    auditar_factura,
+    crear_grafico_distribucion,
+    crear_boxplot_consulta,
+    crear_grafico_variaciones,
+    crear_grafico_comparacion_precios,
+    calcular_metricas_prestador,
+    construir_dashboard,
+    TAREAS_DASHBOARD
+)
+from materializar_dashboards import cargar_artefactos_prestador
+from almacenamiento import (
+    dir_version,
+    cargar_particiones
+)
+from recarga_datos import obtener_gestor
+from registro_auditorias import RegistroAuditorias
+from indice_variaciones import IndiceVariaciones
 
 # ============================================
 # CONFIGURACION
@@ -126,320 +143,220 @@ st.markdown("""
 # FUNCIONES DE CARGA
 # ============================================
 
-@st.cache_data
-def cargar_datos():
-    """Carga datos del sistema"""
-    try:
-        df = pd.read_csv('base_global_unificada.csv.gz', compression='gzip', encoding='utf-8')
-        df['MesFecha'] = pd.to_datetime(df['MesFecha'])
-        df['CM'] = pd.to_numeric(df['CM'], errors='coerce')
-        df['PU'] = pd.to_numeric(df['PU'], errors='coerce')
-        df['Q'] = pd.to_numeric(df['Q'], errors='coerce')
-        return df
-    except Exception as e:
-        st.error(f"Error cargando datos: {e}")
-        return None
+@st.cache_data(max_entries=64)
+def cargar_prestador(prestador, version, desde=None, hasta=None):
+    """Carga solo las particiones de un prestador (y periodo)"""
+    return cargar_particiones([prestador], desde, hasta, dir_version_base=dir_version(version))
+
+@st.cache_resource(max_entries=16)
+def obtener_indice_variaciones(prestador, version):
+    """Indice por rango de fechas de las variaciones de PU de un prestador"""
+    return IndiceVariaciones(cargar_prestador(prestador, version))
+
+@st.cache_resource
+def obtener_registro():
+    """Registro de auditorias compartido por todas las sesiones"""
+    return RegistroAuditorias()
 
 # ============================================
-# FUNCIONES DE ANALISIS
+# RESULTADOS DE LA SESION
 # ============================================
 
-def buscar_historico(base, prestador, prestacion):
-    """Busca historico de una prestacion"""
-    mask = base['ID'].astype(str).str.upper() == str(prestador).upper()
-    
-    if prestacion and 'Prestacion' in base.columns:
-        prestacion_clean = str(prestacion).upper().strip()
-        mask &= base['Prestacion'].astype(str).str.upper().str.contains(
-            prestacion_clean[:30], na=False, regex=False
-        )
-    
-    return base[mask].copy()
+# Los resultados se guardan en la sesion con las entradas y la version de
+# datos que los produjeron, de modo que tocar cualquier otro widget (filtros,
+# descargas) no los borra ni los recalcula
 
-def calcular_estadisticas(hist, fecha_auditoria):
-    """Calcula estadisticas del historico"""
-    d = hist[hist['MesFecha'] < pd.to_datetime(fecha_auditoria)].copy()
-    
-    if len(d) < 2:
-        return None
-    
-    d = d.dropna(subset=['CM'])
-    
-    if len(d) == 0:
-        return None
-    
-    return {
-        'promedio': float(d['CM'].mean()),
-        'mediana': float(d['CM'].median()),
-        'std': float(d['CM'].std()),
-        'min': float(d['CM'].min()),
-        'max': float(d['CM'].max()),
-        'q25': float(d['CM'].quantile(0.25)),
-        'q75': float(d['CM'].quantile(0.75)),
-        'q90': float(d['CM'].quantile(0.90)),
-        'q95': float(d['CM'].quantile(0.95)),
-        'n_registros': len(d),
-        'datos': d['CM'].values
-    }
+def resultado_sesion(nombre, clave):
+    """Resultado guardado en la sesion si se calculo con las mismas entradas (o None)"""
+    guardado = st.session_state.get(nombre)
+    if guardado is not None and guardado['clave'] == clave:
+        return guardado
+    return None
 
-def clasificar_anomalia(z_score):
-    """Clasifica el nivel de anomalia"""
-    if abs(z_score) < 1:
-        return "NORMAL", "alert-normal", "Dentro del rango esperado"
-    elif abs(z_score) < 2:
-        return "REVISAR", "alert-warning", "Desviacion moderada"
-    else:
-        if z_score > 0:
-            return "ALERTA ALTA", "alert-danger", "Sobrecosto significativo"
-        else:
-            return "INUSUAL BAJO", "alert-info", "Costo muy bajo"
+def guardar_resultado(nombre, clave, **valores):
+    st.session_state[nombre] = {'clave': clave, **valores}
+    return st.session_state[nombre]
+
+def derivado(guardado, nombre, calcular):
+    """Valor derivado de un resultado guardado (figuras, CSV, vistas filtradas), calculado una sola vez"""
+    if nombre not in guardado:
+        guardado[nombre] = calcular()
+    return guardado[nombre]
 
 # ============================================
-# FUNCIONES DE GRAFICOS
+# FUNCIONES DE INTERFAZ
 # ============================================
 
-def crear_grafico_evolucion_cm(df_prestador):
-    """Crea grafico de evolucion de CM por prestacion"""
-    
-    # Filtrar datos con CM valido
-    df_plot = df_prestador[df_prestador['CM'].notna()].copy()
-    df_plot = df_plot.sort_values('MesFecha')
-    
-    # Agrupar por prestacion y fecha
-    df_agg = df_plot.groupby(['MesFecha', 'Prestacion'])['CM'].sum().reset_index()
-    
-    # Top prestaciones por volumen total
-    top_prestaciones = df_plot.groupby('Prestacion')['CM'].sum().nlargest(10).index.tolist()
-    df_top = df_agg[df_agg['Prestacion'].isin(top_prestaciones)]
-    
-    fig = go.Figure()
-    
-    for prestacion in top_prestaciones:
-        data = df_top[df_top['Prestacion'] == prestacion]
-        fig.add_trace(go.Scatter(
-            x=data['MesFecha'],
-            y=data['CM'],
-            mode='lines+markers',
-            name=prestacion[:40],
-            hovertemplate='<b>%{fullData.name}</b><br>Fecha: %{x}<br>CM: $%{y:,.2f}<extra></extra>'
-        ))
-    
-    fig.update_layout(
-        title="Evolucion Temporal del Costo Medico (CM) - Top 10 Prestaciones",
-        xaxis_title="Mes",
-        yaxis_title="Costo Medico (CM)",
-        template="plotly_dark",
-        height=500,
-        hovermode='x unified',
-        legend=dict(
-            orientation="v",
-            yanchor="top",
-            y=1,
-            xanchor="left",
-            x=1.02
-        ),
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)'
-    )
-    
-    return fig
-
-def crear_grafico_variacion_pu(df_prestador):
-    """Crea grafico de variacion de precio unitario"""
-    
-    df_plot = df_prestador[df_prestador['PU'].notna()].copy()
-    df_plot = df_plot.sort_values('MesFecha')
-    
-    # Calcular variacion porcentual mensual
-    df_plot['PU_pct_change'] = df_plot.groupby('Prestacion')['PU'].pct_change() * 100
-    
-    # Top prestaciones
-    top_prestaciones = df_plot.groupby('Prestacion')['CM'].sum().nlargest(10).index.tolist()
-    df_top = df_plot[df_plot['Prestacion'].isin(top_prestaciones)]
-    
-    fig = make_subplots(
-        rows=2, cols=1,
-        subplot_titles=("Precio Unitario (PU)", "Variacion Mensual (%)"),
-        vertical_spacing=0.12,
-        row_heights=[0.6, 0.4]
-    )
-    
-    for prestacion in top_prestaciones:
-        data = df_top[df_top['Prestacion'] == prestacion]
-        
-        # Grafico de PU
-        fig.add_trace(
-            go.Scatter(
-                x=data['MesFecha'],
-                y=data['PU'],
-                mode='lines',
-                name=prestacion[:40],
-                showlegend=True,
-                hovertemplate='%{y:,.2f}'
-            ),
-            row=1, col=1
+def mostrar_seccion_dashboard(placeholder, seccion, resultado):
+    """Muestra una seccion ya construida del dashboard en su placeholder"""
+    
+    if seccion == 'resumen':
+        # Formatear columnas monetarias
+        placeholder.dataframe(
+            resultado.style.format({
+                'CM_Total': '${:,.2f}',
+                'CM_Promedio': '${:,.2f}',
+                'CM_Std': '${:,.2f}',
+                'CM_Min': '${:,.2f}',
+                'CM_Max': '${:,.2f}',
+                'PU_Promedio': '${:,.2f}',
+                'Q_Total': '{:,.0f}',
+                'Variacion_PU_%': '{:+.1f}%'
+            }),
+            use_container_width=True
         )
-        
-        # Grafico de variacion
-        fig.add_trace(
-            go.Bar(
-                x=data['MesFecha'],
-                y=data['PU_pct_change'],
-                name=prestacion[:40],
-                showlegend=False,
-                hovertemplate='%{y:+.1f}%'
-            ),
-            row=2, col=1
-        )
-    
-    fig.update_xaxes(title_text="Mes", row=2, col=1)
-    fig.update_yaxes(title_text="Precio Unitario ($)", row=1, col=1)
-    fig.update_yaxes(title_text="Variacion (%)", row=2, col=1)
-    
-    fig.update_layout(
-        title="Analisis de Variacion de Precios Unitarios",
-        template="plotly_dark",
-        height=700,
-        showlegend=True,
-        hovermode='x unified',
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)'
-    )
-    
-    return fig
+    elif seccion == 'insights':
+        with placeholder.container():
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                st.markdown("**MAYOR CRECIMIENTO DE CM:**")
+                for i, (prest, crec) in enumerate(resultado.head(5).items(), 1):
+                    st.markdown(f"{i}. {prest}: **+{crec:.1f}%**")
+            
+            with col2:
+                st.markdown("**MAYOR DECRECIMIENTO DE CM:**")
+                for i, (prest, crec) in enumerate(resultado.tail(5).items(), 1):
+                    st.markdown(f"{i}. {prest}: **{crec:.1f}%**")
+    else:
+        placeholder.plotly_chart(resultado, use_container_width=True)
 
-def crear_grafico_distribucion(stats, importe_cm, titulo):
-    """Crea grafico de distribucion"""
-    fig = go.Figure()
+def mostrar_dashboard(metricas, secciones, duplicados, similares):
+    """Muestra el dashboard de un prestador.
     
-    fig.add_trace(go.Histogram(
-        x=stats['datos'],
-        name='Distribucion Historica',
-        marker_color='rgba(99, 110, 250, 0.6)',
-        nbinsx=30
-    ))
+    secciones genera tuplas (seccion, resultado): cada seccion se muestra
+    apenas esta lista. Devuelve un diccionario con todas las secciones.
+    """
+    st.markdown("### METRICAS GENERALES DEL PRESTADOR")
     
-    fig.add_vline(
-        x=importe_cm,
-        line_dash="dash",
-        line_color="#E31E24",
-        line_width=3,
-        annotation_text=f"Consulta: ${importe_cm:,.0f}",
-        annotation_position="top"
-    )
+    col1, col2, col3, col4, col5 = st.columns(5)
     
-    fig.add_vline(
-        x=stats['promedio'],
-        line_dash="dot",
-        line_color="#4CAF50",
-        line_width=2,
-        annotation_text=f"Promedio: ${stats['promedio']:,.0f}",
-        annotation_position="bottom"
-    )
+    with col1:
+        st.metric("Prestaciones Unicas", metricas['prestaciones_unicas'])
+    with col2:
+        st.metric("Total Registros", metricas['total_registros'])
+    with col3:
+        st.metric("CM Total", f"${metricas['cm_total']:,.0f}")
+    with col4:
+        st.metric("CM Promedio", f"${metricas['cm_promedio']:,.0f}")
+    with col5:
+        st.metric("Meses Activos", metricas['meses_activos'])
     
-    fig.update_layout(
-        title=titulo,
-        xaxis_title="Importe (CM)",
-        yaxis_title="Frecuencia",
-        template="plotly_dark",
-        height=400,
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)'
-    )
+    st.markdown("---")
     
-    return fig
-
-def crear_grafico_boxplot(df_prestador):
-    """Crea boxplot comparativo de prestaciones"""
+    # Secciones del dashboard: se construyen en paralelo y se muestran a
+    # medida que cada una esta lista
+    placeholders = {}
     
-    df_plot = df_prestador[df_prestador['CM'].notna()].copy()
-    top_prestaciones = df_plot.groupby('Prestacion')['CM'].sum().nlargest(10).index.tolist()
-    df_top = df_plot[df_plot['Prestacion'].isin(top_prestaciones)]
+    st.markdown("### EVOLUCION TEMPORAL")
+    placeholders['evolucion'] = st.empty()
+    placeholders['variacion_pu'] = st.empty()
     
-    fig = go.Figure()
+    st.markdown("### HEATMAP DE ACTIVIDAD")
+    placeholders['heatmap'] = st.empty()
     
-    for prestacion in top_prestaciones:
-        data = df_top[df_top['Prestacion'] == prestacion]['CM']
-        fig.add_trace(go.Box(
-            y=data,
-            name=prestacion[:40],
-            boxmean='sd'
-        ))
+    st.markdown("### DISTRIBUCION DE COSTOS POR PRESTACION")
+    placeholders['boxplot'] = st.empty()
     
-    fig.update_layout(
-        title="Distribucion de Costos por Prestacion (Boxplot)",
-        yaxis_title="Costo Medico (CM)",
-        template="plotly_dark",
-        height=500,
-        showlegend=True,
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)'
-    )
+    st.markdown("### TABLA RESUMEN POR PRESTACION")
+    placeholders['resumen'] = st.empty()
     
-    return fig
-
-def crear_tabla_resumen(df_prestador):
-    """Crea tabla resumen de prestaciones"""
+    st.markdown("### INSIGHTS AUTOMATICOS")
+    placeholders['insights'] = st.empty()
     
-    df_plot = df_prestador[df_prestador['CM'].notna()].copy()
+    for placeholder in placeholders.values():
+        placeholder.info("Generando seccion...")
     
-    resumen = df_plot.groupby('Prestacion').agg({
-        'CM': ['count', 'sum', 'mean', 'std', 'min', 'max'],
-        'PU': 'mean',
-        'Q': 'sum'
-    }).round(2)
+    resultados = {}
+    for seccion, resultado in secciones:
+        mostrar_seccion_dashboard(placeholders[seccion], seccion, resultado)
+        resultados[seccion] = resultado
     
-    resumen.columns = ['N_Registros', 'CM_Total', 'CM_Promedio', 'CM_Std', 'CM_Min', 'CM_Max', 'PU_Promedio', 'Q_Total']
-    resumen = resumen.sort_values('CM_Total', ascending=False)
+    # Facturacion duplicada del prestador
+    st.markdown("### POSIBLES DUPLICADOS")
+    grupos_dup, registros_dup, tolerancia_cm_pct = duplicados
     
-    # Calcular variacion de PU
-    variacion_pu = df_plot.groupby('Prestacion').apply(
-        lambda x: ((x['PU'].iloc[-1] - x['PU'].iloc[0]) / x['PU'].iloc[0] * 100) if len(x) > 1 else 0
-    ).round(1)
-    
-    resumen['Variacion_PU_%'] = variacion_pu
-    
-    return resumen.head(20)
-
-def crear_heatmap_temporal(df_prestador):
-    """Crea heatmap de actividad temporal"""
-    
-    df_plot = df_prestador[df_prestador['CM'].notna()].copy()
-    df_plot['Año'] = df_plot['MesFecha'].dt.year
-    df_plot['Mes'] = df_plot['MesFecha'].dt.month
-    
-    # Top 10 prestaciones
-    top_prestaciones = df_plot.groupby('Prestacion')['CM'].sum().nlargest(10).index.tolist()
-    df_top = df_plot[df_plot['Prestacion'].isin(top_prestaciones)]
+    if grupos_dup.empty:
+        st.success("No se detectaron registros duplicados")
+    else:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Grupos Exactos", int((grupos_dup['Tipo_Duplicado'] == 'EXACTO').sum()))
+        with col2:
+            st.metric("Grupos Similares", int((grupos_dup['Tipo_Duplicado'] == 'SIMILAR').sum()))
+        with col3:
+            st.metric("Importe Excedente", f"${grupos_dup['Importe_Excedente'].sum():,.0f}")
+        
+        st.dataframe(
+            grupos_dup.sort_values('Importe_Excedente', ascending=False).style.format({
+                'MesFecha': lambda x: x.strftime('%Y-%m'),
+                'Q': '{:,.0f}',
+                'CM_Min': '${:,.2f}',
+                'CM_Max': '${:,.2f}',
+                'CM_Total': '${:,.2f}',
+                'Importe_Excedente': '${:,.2f}'
+            }),
+            use_container_width=True,
+            hide_index=True
+        )
+        with st.expander("VER REGISTROS DUPLICADOS"):
+            st.dataframe(registros_dup, use_container_width=True, hide_index=True)
+        st.caption(
+            f"EXACTO: mismo codigo, mes, cantidad e importe. SIMILAR: mismo codigo, mes y cantidad "
+            f"con importes que difieren menos del {tolerancia_cm_pct:g}%. El importe "
+            f"excedente es lo facturado por encima de un unico registro por grupo."
+        )
     
-    # Pivot para heatmap
-    pivot = df_top.pivot_table(
-        values='CM',
-        index='Prestacion',
-        columns='MesFecha',
-        aggfunc='sum',
-        fill_value=0
-    )
+    # Prestadores con perfil de facturacion parecido
+    st.markdown("### PRESTADORES SIMILARES")
+    perfil, vecinos = similares
     
-    fig = go.Figure(data=go.Heatmap(
-        z=pivot.values,
-        x=pivot.columns.strftime('%Y-%m'),
-        y=[p[:40] for p in pivot.index],
-        colorscale='Reds',
-        hovertemplate='Prestacion: %{y}<br>Mes: %{x}<br>CM: $%{z:,.0f}<extra></extra>'
-    ))
+    if perfil is None:
+        st.info("El prestador no tiene perfil de facturacion (sin codigos con CM o cantidad)")
+    else:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Grupo", f"{perfil['Grupo']} ({perfil['Tamano_Grupo']} prestadores)")
+        with col2:
+            st.metric("Similitud con el Grupo", f"{perfil['Similitud_Grupo']:.2f}")
+        with col3:
+            st.metric("Puntaje Atipico", f"{perfil['Puntaje_Atipico']:.1f}")
+        
+        if perfil['Atipico']:
+            st.warning("El perfil de facturacion del prestador se aparta del resto de su grupo")
+        
+        st.dataframe(
+            vecinos.style.format({'Similitud': '{:.2f}', 'CM_Total': '${:,.2f}'}),
+            use_container_width=True,
+            hide_index=True
+        )
+        st.caption(
+            "Similitud coseno entre perfiles: participacion de cada codigo en el CM y en la cantidad "
+            "del prestador, y nivel de PU frente a los demas prestadores del codigo."
+        )
     
-    fig.update_layout(
-        title="Heatmap de Actividad por Prestacion y Mes",
-        xaxis_title="Mes",
-        yaxis_title="Prestacion",
-        template="plotly_dark",
-        height=600,
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)'
-    )
+    return resultados
+
+def crear_vista_variaciones(df_var, tipo_variacion, prestador):
+    """Tabla filtrada y ordenada, graficos y CSV de un filtro de variaciones"""
+    if tipo_variacion == "Solo Aumentos":
+        df_var = df_var[df_var['Variacion_Pct'] > 0]
+    elif tipo_variacion == "Solo Decrementos":
+        df_var = df_var[df_var['Variacion_Pct'] < 0]
+    elif tipo_variacion == "Variacion >50%":
+        df_var = df_var[abs(df_var['Variacion_Pct']) > 50]
+    elif tipo_variacion == "Variacion >100%":
+        df_var = df_var[abs(df_var['Variacion_Pct']) > 100]
+    
+    # Ordenar por variación absoluta
+    df_var = df_var.sort_values('Variacion_Pct', ascending=False)
     
-    return fig
+    return {
+        'tabla': df_var,
+        'fig_var': crear_grafico_variaciones(df_var, prestador),
+        'fig_comp': crear_grafico_comparacion_precios(df_var),
+        'csv': df_var.to_csv(index=False)
+    }
 
 # ============================================
 # INTERFAZ PRINCIPAL
@@ -456,13 +373,21 @@ def main():
         </div>
     """, unsafe_allow_html=True)
     
-    # Cargar datos
-    datos = cargar_datos()
-    
-    if datos is None:
-        st.error("Error al cargar los datos")
+    # Version activa de la base (los datos de cada prestador se leen a demanda).
+    # Se toma una sola vez: toda esta ejecucion usa la misma version.
+    try:
+        gestor = obtener_gestor()
+    except Exception as e:
+        st.error(f"Error cargando datos: {e}")
         return
     
+    datos = gestor.activa
+    manifiesto = datos.manifiesto
+    version = datos.version
+    prestadores_unicos = manifiesto['prestadores']
+    fecha_min = pd.Timestamp(manifiesto['fecha_min'])
+    fecha_max = pd.Timestamp(manifiesto['fecha_max'])
+    
     # Sidebar
     with st.sidebar:
         st.markdown("### INFORMACION DEL SISTEMA")
@@ -470,12 +395,34 @@ def main():
         
         col1, col2 = st.columns(2)
         with col1:
-            st.metric("Registros", f"{len(datos):,}")
+            st.metric("Registros", f"{manifiesto['registros']:,}")
         with col2:
-            st.metric("Prestadores", f"{datos['ID'].nunique()}")
+            st.metric("Prestadores", f"{len(prestadores_unicos)}")
+        
+        st.markdown(f"**Version de datos:** {version}")
+        st.markdown(f"**Cargada:** {datos.cargada.strftime('%d/%m/%Y %H:%M')} ({datos.segundos_carga:.1f}s)")
+        st.markdown(f"**Rango temporal:** {fecha_min.strftime('%Y-%m')} a {fecha_max.strftime('%Y-%m')}")
+        
+        if gestor.recargando:
+            st.info("Cargando una nueva version de la base en segundo plano")
+        if gestor.error:
+            st.warning(f"Fallo la recarga de la base: {gestor.error}")
         
-        st.markdown(f"**Ultima actualizacion:** {datetime.now().strftime('%d/%m/%Y')}")
-        st.markdown(f"**Rango temporal:** {datos['MesFecha'].min().strftime('%Y-%m')} a {datos['MesFecha'].max().strftime('%Y-%m')}")
+        metadatos = manifiesto.get('metadatos_carga', {})
+        if metadatos:
+            with st.expander("METADATOS DE CARGA"):
+                st.dataframe(pd.DataFrame([metadatos]).T.rename(columns={0: 'Valor'}), use_container_width=True)
+        
+        reporte = manifiesto.get('reporte_memoria')
+        if reporte:
+            reporte = pd.DataFrame(reporte)
+            with st.expander("MEMORIA DE LA BASE"):
+                st.markdown(
+                    f"**{reporte.loc['TOTAL', 'Despues_MB']:,.1f} MB** "
+                    f"(sin compactar: {reporte.loc['TOTAL', 'Antes_MB']:,.1f} MB, "
+                    f"{reporte.loc['TOTAL', 'Reduccion_x']:.1f}x menos)"
+                )
+                st.dataframe(reporte, use_container_width=True)
         
         st.markdown("---")
         st.markdown("### EJEMPLOS PARA TESTEAR")
@@ -506,8 +453,7 @@ def main():
     with tab1:
         st.markdown("## DATOS DE LA FACTURA A AUDITAR")
         
-        prestadores_unicos = sorted(datos['ID'].astype(str).unique().tolist())
-        prestaciones_unicas = sorted(datos['Prestacion'].dropna().unique().tolist())
+        prestaciones_unicas = sorted(manifiesto['categorias']['Prestacion'])
         
         col1, col2 = st.columns(2)
         
@@ -521,7 +467,7 @@ def main():
             
             tipo_clase = st.selectbox(
                 "TIPO CLASE CM",
-                options=["Ambulatorio", "Internacion", "Otros"]
+                options=manifiesto['categorias']['Tipo Clase CM']
             )
             
             nomenclador = st.text_input(
@@ -557,118 +503,243 @@ def main():
             format="%.2f"
         )
         
+        clave_auditoria = (
+            prestador, prestacion, str(mes_liquidado), importe_cm, tipo_clase, int(cantidad), version
+        )
+        
         if st.button("REALIZAR AUDITORIA", use_container_width=True):
             
             with st.spinner("Procesando auditoria..."):
                 
-                hist = buscar_historico(datos, prestador, prestacion)
-                
-                if hist.empty:
-                    hist = datos[datos['ID'].astype(str).str.upper() == prestador.upper()]
+                registro = obtener_registro()
+                resultado = registro.buscar(
+                    prestador, prestacion, mes_liquidado, importe_cm, version,
+                    tipo_clase=tipo_clase, cantidad=int(cantidad)
+                )
+                desde_registro = resultado is not None
+                error = None
                 
-                if not hist.empty:
-                    stats = calcular_estadisticas(hist, mes_liquidado)
+                if resultado is None:
+                    df_prestador = cargar_prestador(prestador, version)
+                    hist = buscar_historico(df_prestador, prestador, prestacion)
                     
-                    if stats:
-                        z_score = (importe_cm - stats['promedio']) / stats['std'] if stats['std'] > 0 else 0
-                        dif_pct = ((importe_cm - stats['promedio']) / stats['promedio'] * 100) if stats['promedio'] > 0 else 0
-                        
-                        clasificacion, alerta_class, mensaje = clasificar_anomalia(z_score)
-                        
-                        st.markdown("---")
-                        st.markdown("## RESULTADO DE LA AUDITORIA")
-                        
-                        st.markdown(f"""
-                        <div class='alert-box {alerta_class}'>
-                            <div style='font-size: 1.5rem; font-weight: 700;'>{clasificacion}</div>
-                            <div style='font-size: 1rem;'>{mensaje}</div>
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                        # Metricas
-                        col1, col2, col3, col4 = st.columns(4)
-                        with col1:
-                            st.metric("Importe Facturado", f"${importe_cm:,.0f}")
-                        with col2:
-                            st.metric("Promedio Historico", f"${stats['promedio']:,.0f}")
-                        with col3:
-                            st.metric("Z-Score", f"{z_score:.2f}σ")
-                        with col4:
-                            st.metric("Diferencia", f"{dif_pct:+.1f}%")
-                        
-                        # Graficos
-                        st.markdown("### ANALISIS GRAFICO")
-                        
-                        col1, col2 = st.columns(2)
-                        
-                        with col1:
-                            fig_dist = crear_grafico_distribucion(stats, importe_cm, "Distribucion Historica")
-                            st.plotly_chart(fig_dist, use_container_width=True)
-                        
-                        with col2:
-                            # Crear boxplot simple de esta prestacion
-                            fig_box = go.Figure()
-                            fig_box.add_trace(go.Box(
-                                y=stats['datos'],
-                                name='CM',
-                                marker_color='#636EFA',
-                                boxmean='sd'
-                            ))
-                            fig_box.add_scatter(
-                                x=[0],
-                                y=[importe_cm],
-                                mode='markers',
-                                marker=dict(size=15, color='#E31E24', symbol='star'),
-                                name='Consulta'
-                            )
-                            fig_box.update_layout(
-                                title="Boxplot con Posicion de Consulta",
-                                yaxis_title="Costo Medico (CM)",
-                                template="plotly_dark",
-                                height=400,
-                                showlegend=True,
-                                paper_bgcolor='rgba(0,0,0,0)',
-                                plot_bgcolor='rgba(0,0,0,0)'
-                            )
-                            st.plotly_chart(fig_box, use_container_width=True)
-                        
-                        # Estadisticas detalladas
-                        with st.expander("VER ESTADISTICAS DETALLADAS"):
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                st.markdown(f"""
-                                | Metrica | Valor |
-                                |---------|-------|
-                                | Promedio | ${stats['promedio']:,.2f} |
-                                | Mediana | ${stats['mediana']:,.2f} |
-                                | Desv. Std | ${stats['std']:,.2f} |
-                                | N° Registros | {stats['n_registros']} |
-                                """)
-                            with col2:
-                                st.markdown(f"""
-                                | Metrica | Valor |
-                                |---------|-------|
-                                | Minimo | ${stats['min']:,.2f} |
-                                | Maximo | ${stats['max']:,.2f} |
-                                | Percentil 90 | ${stats['q90']:,.2f} |
-                                | Percentil 95 | ${stats['q95']:,.2f} |
-                                """)
-                        
-                        # Recomendaciones
-                        st.markdown("### RECOMENDACIONES")
-                        if clasificacion == "NORMAL":
-                            st.markdown("- Aprobar la factura\n- Proceder con el pago")
-                        elif clasificacion == "REVISAR":
-                            st.markdown("- Solicitar justificacion\n- Verificar complejidad\n- Comparar casos similares")
-                        elif clasificacion == "ALERTA ALTA":
-                            st.markdown(f"- RECHAZAR o SUSPENDER\n- Auditoria obligatoria\n- Excede promedio en {abs(dif_pct):.0f}%")
-                        else:
-                            st.markdown("- Verificar error de carga\n- Consultar area medica")
+                    if hist.empty:
+                        hist = df_prestador
                     
+                    if hist.empty:
+                        error = f"Sin datos del prestador {prestador}"
+                    else:
+                        puntaje_pu = datos.indice('puntaje_pu').puntuar(
+                            prestador, prestacion, tipo_clase, importe_cm, cantidad, mes_liquidado
+                        )
+                        esperado = datos.indice('estacional').esperado(prestador, prestacion, mes_liquidado)
+                        resultado = auditar_factura(hist, mes_liquidado, importe_cm, puntaje_pu, esperado)
+                        if resultado is None:
+                            error = "Historico insuficiente"
+                
+                if resultado is not None:
+                    registro.registrar(
+                        prestador, prestacion, mes_liquidado, importe_cm, version, resultado,
+                        tipo_clase=tipo_clase, nomenclador=nomenclador, cantidad=int(cantidad),
+                        desde_registro=desde_registro
+                    )
+                
+                guardar_resultado(
+                    'auditoria', clave_auditoria,
+                    resultado=resultado, error=error, desde_registro=desde_registro
+                )
+        
+        auditoria = resultado_sesion('auditoria', clave_auditoria)
+        if auditoria is not None:
+            resultado = auditoria['resultado']
+            if resultado is not None:
+                desde_registro = auditoria['desde_registro']
+                
+                stats = resultado['stats']
+                z_score = resultado['z_score']
+                dif_pct = resultado['dif_pct']
+                clasificacion = resultado['clasificacion']
+                alerta_class = resultado['alerta_class']
+                mensaje = resultado['mensaje']
+                
+                st.markdown("---")
+                st.markdown("## RESULTADO DE LA AUDITORIA")
+                
+                st.markdown(f"""
+                <div class='alert-box {alerta_class}'>
+                    <div style='font-size: 1.5rem; font-weight: 700;'>{clasificacion}</div>
+                    <div style='font-size: 1rem;'>{mensaje}</div>
+                </div>
+                """, unsafe_allow_html=True)
+                
+                # Metricas
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("Importe Facturado", f"${importe_cm:,.0f}")
+                with col2:
+                    st.metric("Promedio Historico", f"${stats['promedio']:,.0f}")
+                with col3:
+                    st.metric("Z-Score", f"{z_score:.2f}σ")
+                with col4:
+                    st.metric("Diferencia", f"{dif_pct:+.1f}%")
+                
+                # CM esperado del modelo estacional para el mes liquidado
+                estacional = resultado.get('estacional')
+                if estacional:
+                    st.markdown("### CM ESPERADO PARA EL MES LIQUIDADO")
+                    col1, col2, col3, col4 = st.columns(4)
+                    with col1:
+                        st.metric("CM Esperado", f"${estacional['cm_esperado']:,.0f}")
+                    with col2:
+                        st.metric("Efecto del Mes", f"${estacional['efecto_mes']:+,.0f}")
+                    with col3:
+                        st.metric("Z-Score Estacional", f"{estacional['z_score']:.2f}σ")
+                    with col4:
+                        st.metric("Diferencia", f"{estacional['dif_pct']:+.1f}%")
+                    nota_tendencia = ""
+                    mes_tendencia = estacional.get('mes_tendencia')
+                    if mes_tendencia and mes_tendencia != f"{mes_liquidado:%Y-%m}":
+                        nota_tendencia = f" La tendencia se toma en {mes_tendencia}, el mes con datos mas cercano."
+                    st.caption(
+                        f"Nivel + tendencia ({estacional['tendencia_anual']:+,.0f} $/año) + efecto del mes de "
+                        f"{mes_liquidado:%m/%Y}, ajustado sobre {estacional['n_registros']} registros de la serie."
+                        f"{nota_tendencia}"
+                    )
+                
+                # Puntaje del precio unitario (importe / cantidad)
+                puntaje_pu = resultado.get('precio_unitario')
+                if puntaje_pu:
+                    referencia = "del prestador" if puntaje_pu['referencia'] == 'prestador' else "de pares (todos los prestadores)"
+                    st.markdown("### PRECIO UNITARIO")
+                    col1, col2, col3, col4 = st.columns(4)
+                    with col1:
+                        st.metric("PU Facturado", f"${puntaje_pu['precio_unitario']:,.0f}")
+                    with col2:
+                        st.metric("PU Mediano Historico", f"${puntaje_pu['mediana']:,.0f}")
+                    with col3:
+                        st.metric("Z-Score PU", f"{puntaje_pu['z_score']:.2f}σ")
+                    with col4:
+                        st.metric("Percentil", f"{puntaje_pu['percentil']:.0f}")
+                    st.caption(
+                        f"Distribucion {referencia} para Cod {puntaje_pu['cod_prestacion']} / "
+                        f"{puntaje_pu['tipo_clase']} ({puntaje_pu['n_registros']} registros). "
+                        f"La clasificacion se basa en el precio unitario."
+                    )
+                
+                # Casos similares para facturas a revisar
+                if clasificacion == "REVISAR":
+                    st.markdown("### CASOS SIMILARES")
+                    similares = derivado(auditoria, 'similares', lambda: datos.indice('similitud').buscar(
+                        prestador, prestacion, tipo_clase, importe_cm, cantidad
+                    ))
+                    st.dataframe(
+                        similares.style.format({
+                            'MesFecha': lambda x: x.strftime('%Y-%m'),
+                            'Q': '{:,.0f}',
+                            'CM': '${:,.0f}',
+                            'PU': '${:,.0f}',
+                            'Percentil_Prestador': '{:.0%}',
+                            'Distancia': '{:.3f}'
+                        }),
+                        use_container_width=True,
+                        hide_index=True
+                    )
+                    st.caption("20 registros historicos mas cercanos (todos los prestadores) por codigo, tipo, PU, cantidad y nivel de precios del prestador")
+                
+                # Graficos
+                st.markdown("### ANALISIS GRAFICO")
+                
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    fig_dist = derivado(auditoria, 'fig_dist', lambda: crear_grafico_distribucion(
+                        stats, importe_cm, "Distribucion Historica"
+                    ))
+                    st.plotly_chart(fig_dist, use_container_width=True)
+                
+                with col2:
+                    fig_box = derivado(auditoria, 'fig_box', lambda: crear_boxplot_consulta(stats, importe_cm))
+                    st.plotly_chart(fig_box, use_container_width=True)
+                
+                # Estadisticas detalladas
+                with st.expander("VER ESTADISTICAS DETALLADAS"):
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.markdown(f"""
+                        | Metrica | Valor |
+                        |---------|-------|
+                        | Promedio | ${stats['promedio']:,.2f} |
+                        | Mediana | ${stats['mediana']:,.2f} |
+                        | Desv. Std | ${stats['std']:,.2f} |
+                        | N° Registros | {stats['n_registros']} |
+                        """)
+                    with col2:
+                        st.markdown(f"""
+                        | Metrica | Valor |
+                        |---------|-------|
+                        | Minimo | ${stats['min']:,.2f} |
+                        | Maximo | ${stats['max']:,.2f} |
+                        | Percentil 90 | ${stats['q90']:,.2f} |
+                        | Percentil 95 | ${stats['q95']:,.2f} |
+                        """)
+                
+                # Recomendaciones
+                st.markdown("### RECOMENDACIONES")
+                if clasificacion == "NORMAL":
+                    st.markdown("- Aprobar la factura\n- Proceder con el pago")
+                elif clasificacion == "REVISAR":
+                    st.markdown("- Solicitar justificacion\n- Verificar complejidad\n- Comparar casos similares")
+                elif clasificacion == "ALERTA ALTA":
+                    if puntaje_pu:
+                        dif_referencia = puntaje_pu['dif_pct']
+                    elif estacional:
+                        dif_referencia = estacional['dif_pct']
                     else:
-                        st.error("Historico insuficiente")
+                        dif_referencia = dif_pct
+                    st.markdown(f"- RECHAZAR o SUSPENDER\n- Auditoria obligatoria\n- Excede promedio en {abs(dif_referencia):.0f}%")
                 else:
-                    st.error(f"Sin datos del prestador {prestador}")
+                    st.markdown("- Verificar error de carga\n- Consultar area medica")
+                
+                if desde_registro:
+                    st.caption("Resultado recuperado del registro de auditorias (misma consulta y version de datos)")
+            else:
+                st.error(auditoria['error'])
+        
+        # Revision de decisiones registradas
+        with st.expander("DECISIONES REGISTRADAS"):
+            # El cuerpo del desplegable corre en cada interaccion: se consulta solo a pedido
+            if st.checkbox("CONSULTAR DECISIONES", key="registro_consultar"):
+                registro = obtener_registro()
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    filtro_clasificacion = st.selectbox(
+                        "CLASIFICACION",
+                        options=["ALERTA ALTA", "REVISAR", "INUSUAL BAJO", "NORMAL", "Todas"],
+                        key="registro_clasificacion"
+                    )
+                with col2:
+                    filtro_mes = st.selectbox(
+                        "MES",
+                        options=["Todos"] + registro.meses(),
+                        key="registro_mes"
+                    )
+                with col3:
+                    filtro_prestador = st.selectbox(
+                        "FILTRAR PRESTADOR",
+                        options=["Todos"] + prestadores_unicos,
+                        key="registro_prestador"
+                    )
+                
+                decisiones = registro.listar(
+                    clasificacion=None if filtro_clasificacion == "Todas" else filtro_clasificacion,
+                    mes=None if filtro_mes == "Todos" else filtro_mes,
+                    prestador=None if filtro_prestador == "Todos" else filtro_prestador
+                )
+                
+                if decisiones.empty:
+                    st.info("No hay decisiones registradas con esos filtros")
+                else:
+                    st.dataframe(decisiones, use_container_width=True, hide_index=True)
     
     # ============================================
     # TAB 2: DASHBOARD TEMPORAL
@@ -679,98 +750,115 @@ def main():
         
         prestador_dashboard = st.selectbox(
             "SELECCIONE PRESTADOR PARA ANALIZAR",
-            options=sorted(datos['ID'].astype(str).unique().tolist()),
+            options=prestadores_unicos,
             key="dashboard_prestador"
         )
         
+        clave_dashboard = (prestador_dashboard, version)
+        
         if st.button("GENERAR DASHBOARD", use_container_width=True):
             
             with st.spinner("Generando analisis temporal..."):
                 
-                df_prestador = datos[datos['ID'] == prestador_dashboard].copy()
+                df_prestador = cargar_prestador(prestador_dashboard, version)
                 
                 if len(df_prestador) == 0:
                     st.error(f"Sin datos del prestador {prestador_dashboard}")
                 else:
-                    # Metricas generales
-                    st.markdown("### METRICAS GENERALES DEL PRESTADOR")
-                    
-                    col1, col2, col3, col4, col5 = st.columns(5)
+                    # Artefactos materializados offline, si estan vigentes
+                    artefactos = cargar_artefactos_prestador(prestador_dashboard, df_prestador)
                     
-                    with col1:
-                        st.metric("Prestaciones Unicas", df_prestador['Prestacion'].nunique())
-                    with col2:
-                        st.metric("Total Registros", len(df_prestador))
-                    with col3:
-                        cm_total = df_prestador['CM'].sum()
-                        st.metric("CM Total", f"${cm_total:,.0f}")
-                    with col4:
-                        cm_promedio = df_prestador['CM'].mean()
-                        st.metric("CM Promedio", f"${cm_promedio:,.0f}")
-                    with col5:
-                        meses = df_prestador['MesFecha'].nunique()
-                        st.metric("Meses Activos", meses)
-                    
-                    st.markdown("---")
-                    
-                    # Graficos temporales
-                    st.markdown("### EVOLUCION TEMPORAL")
-                    
-                    fig_evol = crear_grafico_evolucion_cm(df_prestador)
-                    st.plotly_chart(fig_evol, use_container_width=True)
-                    
-                    fig_pu = crear_grafico_variacion_pu(df_prestador)
-                    st.plotly_chart(fig_pu, use_container_width=True)
-                    
-                    # Heatmap
-                    st.markdown("### HEATMAP DE ACTIVIDAD")
-                    fig_heat = crear_heatmap_temporal(df_prestador)
-                    st.plotly_chart(fig_heat, use_container_width=True)
-                    
-                    # Boxplot comparativo
-                    st.markdown("### DISTRIBUCION DE COSTOS POR PRESTACION")
-                    fig_box = crear_grafico_boxplot(df_prestador)
-                    st.plotly_chart(fig_box, use_container_width=True)
+                    if artefactos is not None:
+                        metricas = artefactos['metricas']
+                        secciones = ((seccion, artefactos[seccion]) for seccion in TAREAS_DASHBOARD)
+                    else:
+                        metricas = calcular_metricas_prestador(df_prestador)
+                        secciones = construir_dashboard(df_prestador)
                     
-                    # Tabla resumen
-                    st.markdown("### TABLA RESUMEN POR PRESTACION")
-                    resumen = crear_tabla_resumen(df_prestador)
+                    detector = datos.indice('duplicados')
+                    duplicados = detector.de_prestador(prestador_dashboard) + (detector.tolerancia_cm_pct,)
+                    similares = datos.indice('perfiles').de_prestador(prestador_dashboard)
                     
-                    # Formatear columnas monetarias
-                    st.dataframe(
-                        resumen.style.format({
-                            'CM_Total': '${:,.2f}',
-                            'CM_Promedio': '${:,.2f}',
-                            'CM_Std': '${:,.2f}',
-                            'CM_Min': '${:,.2f}',
-                            'CM_Max': '${:,.2f}',
-                            'PU_Promedio': '${:,.2f}',
-                            'Q_Total': '{:,.0f}',
-                            'Variacion_PU_%': '{:+.1f}%'
-                        }),
-                        use_container_width=True
+                    # Se guarda recien con todas las secciones construidas
+                    resultados = mostrar_dashboard(metricas, secciones, duplicados, similares)
+                    guardar_resultado(
+                        'dashboard', clave_dashboard,
+                        metricas=metricas, secciones=resultados, duplicados=duplicados, similares=similares
                     )
-                    
-                    # Insights automáticos
-                    st.markdown("### INSIGHTS AUTOMATICOS")
-                    
-                    # Prestacion con mayor crecimiento
-                    df_crecimiento = df_prestador.groupby('Prestacion').apply(
-                        lambda x: ((x['CM'].iloc[-1] - x['CM'].iloc[0]) / x['CM'].iloc[0] * 100) if len(x) > 1 else 0
-                    ).sort_values(ascending=False)
-                    
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        st.markdown("**MAYOR CRECIMIENTO DE CM:**")
-                        for i, (prest, crec) in enumerate(df_crecimiento.head(5).items(), 1):
-                            st.markdown(f"{i}. {prest}: **+{crec:.1f}%**")
-                    
-                    with col2:
-                        st.markdown("**MAYOR DECRECIMIENTO DE CM:**")
-                        for i, (prest, crec) in enumerate(df_crecimiento.tail(5).items(), 1):
-                            st.markdown(f"{i}. {prest}: **{crec:.1f}%**")
-    
+        else:
+            dashboard = resultado_sesion('dashboard', clave_dashboard)
+            if dashboard is not None:
+                mostrar_dashboard(
+                    dashboard['metricas'], dashboard['secciones'].items(), dashboard['duplicados'], dashboard['similares']
+                )
+        
+        # Reporte de duplicados de toda la base
+        with st.expander("REPORTE GLOBAL DE DUPLICADOS"):
+            if not datos.lista('duplicados'):
+                st.info("El reporte estara disponible cuando termine de construirse el indice de duplicados")
+            else:
+                detector = datos.indice('duplicados')
+                
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Grupos Detectados", len(detector.grupos))
+                with col2:
+                    st.metric("Prestadores Afectados", detector.grupos['ID'].nunique())
+                with col3:
+                    st.metric("Importe Excedente", f"${detector.grupos['Importe_Excedente'].sum():,.0f}")
+                
+                st.dataframe(
+                    detector.resumen_prestadores().style.format({'Importe_Excedente': '${:,.2f}'}),
+                    use_container_width=True
+                )
+                st.download_button(
+                    label="DESCARGAR CSV",
+                    data=detector.grupos.to_csv(index=False),
+                    file_name=f"duplicados_{version}.csv",
+                    mime="text/csv",
+                    use_container_width=True
+                )
+        
+        # Grupos de prestadores por perfil de facturacion
+        with st.expander("REPORTE DE GRUPOS Y PRESTADORES ATIPICOS"):
+            if not datos.lista('perfiles'):
+                st.info("El reporte estara disponible cuando termine de construirse el indice de perfiles")
+            else:
+                perfiles = datos.indice('perfiles')
+                
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Prestadores con Perfil", len(perfiles.tabla))
+                with col2:
+                    st.metric("Grupos", len(perfiles.centros))
+                with col3:
+                    st.metric("Atipicos en su Grupo", int(perfiles.tabla['Atipico'].sum()))
+                
+                st.markdown("**GRUPOS**")
+                st.dataframe(
+                    perfiles.resumen_grupos().style.format({'CM_Total': '${:,.0f}', 'Similitud_Media': '{:.2f}'}),
+                    use_container_width=True
+                )
+                
+                st.markdown("**PRESTADORES ATIPICOS**")
+                st.dataframe(
+                    perfiles.atipicos().style.format({
+                        'CM_Total': '${:,.2f}',
+                        'Similitud_Grupo': '{:.2f}',
+                        'Puntaje_Atipico': '{:.1f}',
+                        'Similitud_Vecino': '{:.2f}'
+                    }),
+                    use_container_width=True,
+                    hide_index=True
+                )
+                st.download_button(
+                    label="DESCARGAR CSV",
+                    data=perfiles.tabla.to_csv(index=False),
+                    file_name=f"perfiles_prestadores_{version}.csv",
+                    mime="text/csv",
+                    use_container_width=True
+                )
+
     # ============================================
     # TAB 3: ANALISIS DE VARIACIONES
     # ============================================
@@ -783,7 +871,7 @@ def main():
         with col1:
             prestador_var = st.selectbox(
                 "SELECCIONE PRESTADOR",
-                options=sorted(datos['ID'].astype(str).unique().tolist()),
+                options=prestadores_unicos,
                 key="var_prestador"
             )
         
@@ -797,279 +885,187 @@ def main():
             )
         
         if not usar_todo:
-            col1, col2 = st.columns(2)
-            with col1:
-                fecha_inicio = st.date_input(
-                    "FECHA INICIO",
-                    value=datos['MesFecha'].min(),
-                    min_value=datos['MesFecha'].min(),
-                    max_value=datos['MesFecha'].max()
-                )
-            with col2:
-                fecha_fin = st.date_input(
-                    "FECHA FIN",
-                    value=datos['MesFecha'].max(),
-                    min_value=datos['MesFecha'].min(),
-                    max_value=datos['MesFecha'].max()
-                )
+            # El periodo se consulta sobre el indice del prestador: mover el
+            # control actualiza la tabla sin volver a leer ni agrupar la base
+            meses_periodo = list(pd.period_range(fecha_min, fecha_max, freq='M').strftime('%Y-%m'))
+            mes_inicio, mes_fin = st.select_slider(
+                "PERIODO",
+                options=meses_periodo,
+                value=(meses_periodo[0], meses_periodo[-1]),
+                key="var_periodo"
+            )
+            fecha_inicio = pd.Period(mes_inicio, freq='M').start_time.date()
+            fecha_fin = pd.Period(mes_fin, freq='M').end_time.date()
         else:
-            fecha_inicio = datos['MesFecha'].min()
-            fecha_fin = datos['MesFecha'].max()
+            fecha_inicio = fecha_min
+            fecha_fin = fecha_max
+        
+        clave_variaciones = (prestador_var, version)
         
         if st.button("ANALIZAR VARIACIONES", use_container_width=True, key="btn_variaciones"):
             
             with st.spinner("Analizando variaciones de precios..."):
                 
-                # Filtrar datos del prestador
-                df_prest = datos[datos['ID'] == prestador_var].copy()
+                indice = None
+                df_var = None
+                error = None
                 
-                if len(df_prest) == 0:
-                    st.error(f"Sin datos del prestador {prestador_var}")
+                if prestador_var not in prestadores_unicos:
+                    error = f"Sin datos del prestador {prestador_var}"
                 else:
-                    # Filtrar por rango de fechas
-                    df_prest = df_prest[
-                        (df_prest['MesFecha'] >= pd.to_datetime(fecha_inicio)) &
-                        (df_prest['MesFecha'] <= pd.to_datetime(fecha_fin))
-                    ]
+                    indice = obtener_indice_variaciones(prestador_var, version)
                     
-                    if len(df_prest) == 0:
-                        st.error("Sin datos en el periodo seleccionado")
-                    else:
-                        # Calcular variaciones por prestación
-                        variaciones = []
-                        
-                        for prestacion in df_prest['Prestacion'].unique():
-                            df_p = df_prest[df_prest['Prestacion'] == prestacion].copy()
-                            df_p = df_p[df_p['PU'].notna()].sort_values('MesFecha')
-                            
-                            if len(df_p) >= 2:
-                                # Primer y último precio
-                                pu_inicial = df_p['PU'].iloc[0]
-                                pu_final = df_p['PU'].iloc[-1]
-                                fecha_inicial = df_p['MesFecha'].iloc[0]
-                                fecha_final = df_p['MesFecha'].iloc[-1]
-                                
-                                # CM inicial y final
-                                cm_inicial = df_p['CM'].iloc[0]
-                                cm_final = df_p['CM'].iloc[-1]
-                                
-                                # Calcular variación
-                                var_abs = pu_final - pu_inicial
-                                var_pct = (var_abs / pu_inicial * 100) if pu_inicial > 0 else 0
-                                
-                                # Volumen
-                                q_total = df_p['Q'].sum()
-                                n_registros = len(df_p)
-                                
-                                variaciones.append({
-                                    'Prestacion': prestacion,
-                                    'Fecha_Inicial': fecha_inicial,
-                                    'Fecha_Final': fecha_final,
-                                    'PU_Inicial': pu_inicial,
-                                    'PU_Final': pu_final,
-                                    'Variacion_Abs': var_abs,
-                                    'Variacion_Pct': var_pct,
-                                    'CM_Inicial': cm_inicial,
-                                    'CM_Final': cm_final,
-                                    'Q_Total': q_total,
-                                    'N_Registros': n_registros
-                                })
-                        
-                        if len(variaciones) == 0:
-                            st.error("No hay suficientes datos para calcular variaciones")
-                        else:
-                            df_var = pd.DataFrame(variaciones)
-                            
-                            # Aplicar filtros
-                            if tipo_variacion == "Solo Aumentos":
-                                df_var = df_var[df_var['Variacion_Pct'] > 0]
-                            elif tipo_variacion == "Solo Decrementos":
-                                df_var = df_var[df_var['Variacion_Pct'] < 0]
-                            elif tipo_variacion == "Variacion >50%":
-                                df_var = df_var[abs(df_var['Variacion_Pct']) > 50]
-                            elif tipo_variacion == "Variacion >100%":
-                                df_var = df_var[abs(df_var['Variacion_Pct']) > 100]
-                            
-                            # Ordenar por variación absoluta
-                            df_var = df_var.sort_values('Variacion_Pct', ascending=False)
-                            
-                            # Métricas generales
-                            st.markdown("### RESUMEN GENERAL")
-                            
-                            col1, col2, col3, col4, col5 = st.columns(5)
-                            
-                            with col1:
-                                st.metric("Prestaciones Analizadas", len(df_var))
-                            with col2:
-                                aumentos = len(df_var[df_var['Variacion_Pct'] > 0])
-                                st.metric("Aumentos", aumentos)
-                            with col3:
-                                decrementos = len(df_var[df_var['Variacion_Pct'] < 0])
-                                st.metric("Decrementos", decrementos)
-                            with col4:
-                                var_promedio = df_var['Variacion_Pct'].mean()
-                                st.metric("Variacion Promedio", f"{var_promedio:+.1f}%")
-                            with col5:
-                                var_maxima = df_var['Variacion_Pct'].max()
-                                st.metric("Variacion Maxima", f"{var_maxima:+.1f}%")
-                            
-                            st.markdown("---")
-                            
-                            # Gráfico de barras de variaciones
-                            st.markdown("### GRAFICO DE VARIACIONES")
-                            
-                            # Top 20 para visualización
-                            df_plot = df_var.head(20)
-                            
-                            fig_var = go.Figure()
-                            
-                            colors = ['#E31E24' if v > 0 else '#4CAF50' for v in df_plot['Variacion_Pct']]
-                            
-                            fig_var.add_trace(go.Bar(
-                                x=df_plot['Variacion_Pct'],
-                                y=[p[:50] for p in df_plot['Prestacion']],
-                                orientation='h',
-                                marker_color=colors,
-                                text=[f"{v:+.1f}%" for v in df_plot['Variacion_Pct']],
-                                textposition='auto',
-                                hovertemplate='<b>%{y}</b><br>Variacion: %{x:+.1f}%<extra></extra>'
-                            ))
-                            
-                            fig_var.update_layout(
-                                title=f"Top 20 Variaciones de Precio - {prestador_var}",
-                                xaxis_title="Variacion Porcentual (%)",
-                                yaxis_title="Prestacion",
-                                template="plotly_dark",
-                                height=max(600, len(df_plot) * 30),
-                                showlegend=False,
-                                paper_bgcolor='rgba(0,0,0,0)',
-                                plot_bgcolor='rgba(0,0,0,0)'
-                            )
-                            
-                            fig_var.update_yaxes(autorange="reversed")
-                            
-                            st.plotly_chart(fig_var, use_container_width=True)
-                            
-                            # Gráfico de comparación temporal
-                            st.markdown("### COMPARACION PRECIO INICIAL VS FINAL")
-                            
-                            fig_comp = go.Figure()
-                            
-                            df_plot_comp = df_var.head(15)
-                            
-                            fig_comp.add_trace(go.Bar(
-                                name='Precio Inicial',
-                                x=[p[:40] for p in df_plot_comp['Prestacion']],
-                                y=df_plot_comp['PU_Inicial'],
-                                marker_color='#636EFA'
-                            ))
-                            
-                            fig_comp.add_trace(go.Bar(
-                                name='Precio Final',
-                                x=[p[:40] for p in df_plot_comp['Prestacion']],
-                                y=df_plot_comp['PU_Final'],
-                                marker_color='#E31E24'
-                            ))
-                            
-                            fig_comp.update_layout(
-                                title=f"Comparacion de Precios - Top 15 Variaciones",
-                                xaxis_title="Prestacion",
-                                yaxis_title="Precio Unitario ($)",
-                                template="plotly_dark",
-                                height=500,
-                                barmode='group',
-                                paper_bgcolor='rgba(0,0,0,0)',
-                                plot_bgcolor='rgba(0,0,0,0)'
-                            )
-                            
-                            st.plotly_chart(fig_comp, use_container_width=True)
-                            
-                            # Tabla completa
-                            st.markdown("### TABLA DETALLADA DE VARIACIONES")
-                            
-                            # Preparar tabla para mostrar
-                            df_display = df_var.copy()
-                            df_display['Fecha_Inicial'] = df_display['Fecha_Inicial'].dt.strftime('%Y-%m')
-                            df_display['Fecha_Final'] = df_display['Fecha_Final'].dt.strftime('%Y-%m')
-                            
-                            # Mostrar con formato
-                            st.dataframe(
-                                df_display.style.format({
-                                    'PU_Inicial': '${:,.2f}',
-                                    'PU_Final': '${:,.2f}',
-                                    'Variacion_Abs': '${:+,.2f}',
-                                    'Variacion_Pct': '{:+.2f}%',
-                                    'CM_Inicial': '${:,.2f}',
-                                    'CM_Final': '${:,.2f}',
-                                    'Q_Total': '{:,.0f}',
-                                    'N_Registros': '{:.0f}'
-                                }).background_gradient(
-                                    subset=['Variacion_Pct'],
-                                    cmap='RdYlGn_r',
-                                    vmin=-100,
-                                    vmax=100
-                                ),
-                                use_container_width=True,
-                                height=400
-                            )
-                            
-                            # Botón de descarga
-                            csv = df_var.to_csv(index=False)
-                            st.download_button(
-                                label="DESCARGAR CSV",
-                                data=csv,
-                                file_name=f"variaciones_{prestador_var}_{fecha_inicio}_{fecha_fin}.csv",
-                                mime="text/csv",
-                                use_container_width=True
-                            )
-                            
-                            # Insights destacados
-                            st.markdown("### INSIGHTS DESTACADOS")
-                            
-                            col1, col2 = st.columns(2)
-                            
-                            with col1:
-                                st.markdown("**MAYORES AUMENTOS:**")
-                                top_aumentos = df_var[df_var['Variacion_Pct'] > 0].head(5)
-                                for i, row in enumerate(top_aumentos.itertuples(), 1):
-                                    st.markdown(f"{i}. **{row.Prestacion[:50]}**: +{row.Variacion_Pct:.1f}% (${row.PU_Inicial:,.0f} → ${row.PU_Final:,.0f})")
-                            
-                            with col2:
-                                st.markdown("**MAYORES DECREMENTOS:**")
-                                top_decrementos = df_var[df_var['Variacion_Pct'] < 0].tail(5)
-                                for i, row in enumerate(top_decrementos.itertuples(), 1):
-                                    st.markdown(f"{i}. **{row.Prestacion[:50]}**: {row.Variacion_Pct:.1f}% (${row.PU_Inicial:,.0f} → ${row.PU_Final:,.0f})")
-                            
-                            # Alertas automáticas
-                            st.markdown("---")
-                            st.markdown("### ALERTAS AUTOMATICAS")
-                            
-                            alertas = []
-                            
-                            # Aumentos extremos (>100%)
-                            extremos = df_var[df_var['Variacion_Pct'] > 100]
-                            if len(extremos) > 0:
-                                alertas.append(f"⚠️ **{len(extremos)} prestaciones** con aumentos superiores al 100%")
-                            
-                            # Decrementos sospechosos
-                            decrementos_grandes = df_var[df_var['Variacion_Pct'] < -50]
-                            if len(decrementos_grandes) > 0:
-                                alertas.append(f"🔵 **{len(decrementos_grandes)} prestaciones** con decrementos >50% (posibles errores)")
-                            
-                            # Sin cambios
-                            sin_cambios = df_var[abs(df_var['Variacion_Pct']) < 1]
-                            if len(sin_cambios) > 0:
-                                alertas.append(f"ℹ️ **{len(sin_cambios)} prestaciones** sin variación significativa (<1%)")
-                            
-                            # Variación promedio alta
-                            if var_promedio > 50:
-                                alertas.append(f"⚠️ Variación promedio del prestador es **{var_promedio:.1f}%** (muy alta)")
-                            
-                            if alertas:
-                                for alerta in alertas:
-                                    st.markdown(alerta)
-                            else:
-                                st.info("✅ No se detectaron anomalías significativas en las variaciones")
+                    # Tabla de todo el periodo (materializada si existe)
+                    artefactos = cargar_artefactos_prestador(
+                        prestador_var, cargar_prestador(prestador_var, version), secciones=['variaciones']
+                    )
+                    df_var = artefactos['variaciones'] if artefactos is not None else indice.consultar()
+                
+                guardar_resultado('variaciones', clave_variaciones, indice=indice, tabla=df_var, error=error, vistas={})
+        
+        variaciones = resultado_sesion('variaciones', clave_variaciones)
+        if variaciones is not None:
+            periodo = None if usar_todo else (fecha_inicio, fecha_fin)
+            if variaciones.get('periodo') != periodo:
+                # Al mover el periodo se descartan las vistas del periodo anterior
+                variaciones['periodo'] = periodo
+                variaciones['vistas'] = {}
+            
+            error = variaciones['error']
+            if error is None:
+                tabla = variaciones['tabla'] if usar_todo else derivado(
+                    variaciones['vistas'], 'tabla', lambda: variaciones['indice'].consultar(fecha_inicio, fecha_fin)
+                )
+                if len(tabla) == 0:
+                    error = "No hay suficientes datos para calcular variaciones"
+            
+            if error:
+                st.error(error)
+            else:
+                # Los filtros se aplican sobre la tabla guardada, sin recalcularla
+                vista = derivado(variaciones['vistas'], tipo_variacion, lambda: crear_vista_variaciones(
+                    tabla, tipo_variacion, prestador_var
+                ))
+                df_var = vista['tabla']
+                
+                # Métricas generales
+                st.markdown("### RESUMEN GENERAL")
+                
+                col1, col2, col3, col4, col5 = st.columns(5)
+                
+                with col1:
+                    st.metric("Prestaciones Analizadas", len(df_var))
+                with col2:
+                    aumentos = len(df_var[df_var['Variacion_Pct'] > 0])
+                    st.metric("Aumentos", aumentos)
+                with col3:
+                    decrementos = len(df_var[df_var['Variacion_Pct'] < 0])
+                    st.metric("Decrementos", decrementos)
+                with col4:
+                    var_promedio = df_var['Variacion_Pct'].mean()
+                    st.metric("Variacion Promedio", f"{var_promedio:+.1f}%")
+                with col5:
+                    var_maxima = df_var['Variacion_Pct'].max()
+                    st.metric("Variacion Maxima", f"{var_maxima:+.1f}%")
+                
+                st.markdown("---")
+                
+                # Gráfico de barras de variaciones
+                st.markdown("### GRAFICO DE VARIACIONES")
+                
+                # Top 20 para visualización
+                st.plotly_chart(vista['fig_var'], use_container_width=True)
+                
+                # Gráfico de comparación temporal
+                st.markdown("### COMPARACION PRECIO INICIAL VS FINAL")
+                
+                st.plotly_chart(vista['fig_comp'], use_container_width=True)
+                
+                # Tabla completa
+                st.markdown("### TABLA DETALLADA DE VARIACIONES")
+                
+                # Preparar tabla para mostrar
+                df_display = df_var.copy()
+                df_display['Fecha_Inicial'] = df_display['Fecha_Inicial'].dt.strftime('%Y-%m')
+                df_display['Fecha_Final'] = df_display['Fecha_Final'].dt.strftime('%Y-%m')
+                
+                # Mostrar con formato
+                st.dataframe(
+                    df_display.style.format({
+                        'PU_Inicial': '${:,.2f}',
+                        'PU_Final': '${:,.2f}',
+                        'Variacion_Abs': '${:+,.2f}',
+                        'Variacion_Pct': '{:+.2f}%',
+                        'CM_Inicial': '${:,.2f}',
+                        'CM_Final': '${:,.2f}',
+                        'Q_Total': '{:,.0f}',
+                        'N_Registros': '{:.0f}'
+                    }).background_gradient(
+                        subset=['Variacion_Pct'],
+                        cmap='RdYlGn_r',
+                        vmin=-100,
+                        vmax=100
+                    ),
+                    use_container_width=True,
+                    height=400
+                )
+                
+                # Botón de descarga (el CSV ya esta armado: descargar no recalcula)
+                st.download_button(
+                    label="DESCARGAR CSV",
+                    data=vista['csv'],
+                    file_name=f"variaciones_{prestador_var}_{fecha_inicio}_{fecha_fin}.csv",
+                    mime="text/csv",
+                    use_container_width=True
+                )
+                
+                # Insights destacados
+                st.markdown("### INSIGHTS DESTACADOS")
+                
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    st.markdown("**MAYORES AUMENTOS:**")
+                    top_aumentos = df_var[df_var['Variacion_Pct'] > 0].head(5)
+                    for i, row in enumerate(top_aumentos.itertuples(), 1):
+                        st.markdown(f"{i}. **{row.Prestacion[:50]}**: +{row.Variacion_Pct:.1f}% (${row.PU_Inicial:,.0f} → ${row.PU_Final:,.0f})")
+                
+                with col2:
+                    st.markdown("**MAYORES DECREMENTOS:**")
+                    top_decrementos = df_var[df_var['Variacion_Pct'] < 0].tail(5)
+                    for i, row in enumerate(top_decrementos.itertuples(), 1):
+                        st.markdown(f"{i}. **{row.Prestacion[:50]}**: {row.Variacion_Pct:.1f}% (${row.PU_Inicial:,.0f} → ${row.PU_Final:,.0f})")
+                
+                # Alertas automáticas
+                st.markdown("---")
+                st.markdown("### ALERTAS AUTOMATICAS")
+                
+                alertas = []
+                
+                # Aumentos extremos (>100%)
+                extremos = df_var[df_var['Variacion_Pct'] > 100]
+                if len(extremos) > 0:
+                    alertas.append(f"⚠️ **{len(extremos)} prestaciones** con aumentos superiores al 100%")
+                
+                # Decrementos sospechosos
+                decrementos_grandes = df_var[df_var['Variacion_Pct'] < -50]
+                if len(decrementos_grandes) > 0:
+                    alertas.append(f"🔵 **{len(decrementos_grandes)} prestaciones** con decrementos >50% (posibles errores)")
+                
+                # Sin cambios
+                sin_cambios = df_var[abs(df_var['Variacion_Pct']) < 1]
+                if len(sin_cambios) > 0:
+                    alertas.append(f"ℹ️ **{len(sin_cambios)} prestaciones** sin variación significativa (<1%)")
+                
+                # Variación promedio alta
+                if var_promedio > 50:
+                    alertas.append(f"⚠️ Variación promedio del prestador es **{var_promedio:.1f}%** (muy alta)")
+                
+                if alertas:
+                    for alerta in alertas:
+                        st.markdown(alerta)
+                else:
+                    st.info("✅ No se detectaron anomalías significativas en las variaciones")
     
     # Footer
     st.markdown("""
@@ -0,0 +1,262 @@
+"""Deteccion de facturacion duplicada.
+
+La base unifica varias cargas (Fuente, FechaCarga), de modo que una misma
+prestacion de un prestador puede quedar facturada dos veces en el mismo mes.
+Se buscan dos tipos de duplicados sobre toda la base en una sola pasada
+vectorizada:
+
+- EXACTO: mismo prestador, Cod prestacion, mes, cantidad e importe (en
+  centavos), aunque difieran el Tipo Clase CM, la descripcion o la carga.
+- SIMILAR: mismo prestador, codigo, mes y cantidad, con importes que
+  difieren menos de TOLERANCIA_CM_PCT entre registros consecutivos.
+
+Cada registro pertenece a lo sumo a un grupo: un grupo exacto que forma
+parte de una cadena similar (100, 100 y 100,5) se reporta solo dentro de
+esa cadena, asi el importe excedente de cada registro se cuenta una vez.
+
+Cada registro se resume en un hash de 64 bits de su clave normalizada. Los
+grupos se arman ordenando por hash (y por la clave, para separar colisiones)
+y cortando segmentos donde cambia la clave.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from motor_auditoria import RUTA_BASE
+from segmentos import Segmentos, suma, minimo, maximo, primero
+from almacenamiento import asegurar_particiones, cargar_particiones, dir_version
+
+COLUMNAS_DUPLICADOS = ['ID', 'Prestacion', 'Cod prestacion', 'Tipo Clase CM', 'MesFecha', 'Q', 'CM']
+
+# Columnas que identifican la carga de cada registro (si no son constantes)
+COLUMNAS_ORIGEN = ['Fuente', 'FechaCarga']
+
+# Diferencia maxima de importe entre registros consecutivos de un grupo similar
+TOLERANCIA_CM_PCT = 1.0
+
+EXACTO = 'EXACTO'
+SIMILAR = 'SIMILAR'
+
+def columnas_deteccion(columnas_disponibles):
+    """Columnas a leer para la deteccion (las de origen solo si estan en la base)"""
+    return COLUMNAS_DUPLICADOS + [c for c in COLUMNAS_ORIGEN if c in columnas_disponibles]
+
+# ============================================
+# NORMALIZACION
+# ============================================
+
+def _codigos_texto(serie, normalizar):
+    """Codigo entero de cada fila segun su texto normalizado (-1 si es nulo)"""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        # Se normalizan solo las categorias, no cada fila
+        codigos_categoria, _ = pd.factorize(normalizar(pd.Series(serie.cat.categories.astype(str))))
+        codigos = serie.cat.codes.to_numpy()
+        return np.where(codigos >= 0, codigos_categoria[np.maximum(codigos, 0)], -1)
+    texto = normalizar(serie.astype(str)).where(serie.notna())
+    return pd.factorize(texto)[0]
+
+def _normalizar_id(texto):
+    return texto.str.strip().str.upper()
+
+def _normalizar_codigo(texto):
+    # Los codigos leidos como numero pueden traer '.0' y los de texto ceros a izquierda
+    return texto.str.strip().str.replace(r'\.0$', '', regex=True).str.lstrip('0')
+
+def normalizar_claves(df):
+    """Claves enteras normalizadas de los registros con importe y cantidad.
+
+    Devuelve (posiciones, claves): posiciones de las filas validas en df y
+    un DataFrame con ID, Cod, mes, cantidad (en milesimas) e importe (en
+    centavos) como enteros.
+    """
+    claves = pd.DataFrame({
+        'id': _codigos_texto(df['ID'], _normalizar_id),
+        'cod': _codigos_texto(df['Cod prestacion'], _normalizar_codigo),
+        'mes': (df['MesFecha'].dt.year * 12 + df['MesFecha'].dt.month).to_numpy(),
+        'q': np.round(df['Q'].to_numpy(dtype=float) * 1000),
+        'cm': np.round(df['CM'].to_numpy(dtype=float) * 100)
+    })
+
+    validos = (
+        (claves['id'] >= 0) & (claves['cod'] >= 0)
+        & claves['q'].notna() & claves['cm'].notna() & (claves['cm'] != 0)
+    ).to_numpy()
+    claves = claves[validos].astype(np.int64).reset_index(drop=True)
+    return np.flatnonzero(validos), claves
+
+def hash_claves(claves, columnas):
+    """Hash de 64 bits de cada fila de las columnas clave"""
+    return pd.util.hash_pandas_object(claves[columnas], index=False).to_numpy()
+
+# ============================================
+# DETECCION
+# ============================================
+
+def _grupos_exactos(claves):
+    """Segmentos de registros con la misma clave completa"""
+    columnas = ['id', 'cod', 'mes', 'q', 'cm']
+    hashes = hash_claves(claves, columnas)
+    orden = np.lexsort([claves[c].to_numpy() for c in reversed(columnas)] + [hashes])
+    segmentos = Segmentos.desde_claves(hashes[orden], *[claves[c].to_numpy()[orden] for c in columnas])
+    return orden, segmentos, hashes[orden]
+
+def _grupos_similares(claves, tolerancia_cm_pct):
+    """Segmentos de registros de la misma clave sin importe con importes encadenados"""
+    columnas = ['id', 'cod', 'mes', 'q']
+    hashes = hash_claves(claves, columnas)
+    orden = np.lexsort([claves['cm'].to_numpy()] + [claves[c].to_numpy() for c in reversed(columnas)] + [hashes])
+
+    cm = claves['cm'].to_numpy()[orden]
+    misma_clave = np.ones(len(cm), dtype=bool)
+    misma_clave[Segmentos.desde_claves(hashes[orden], *[claves[c].to_numpy()[orden] for c in columnas]).inicios] = False
+    tolerancia = np.maximum(np.abs(cm[1:]), np.abs(cm[:-1])) * tolerancia_cm_pct / 100
+    enlazado = np.zeros(len(cm), dtype=bool)
+    enlazado[1:] = misma_clave[1:] & (np.abs(cm[1:] - cm[:-1]) <= tolerancia)
+
+    segmentos = Segmentos(np.flatnonzero(~enlazado), len(cm))
+    return orden, segmentos, hashes[orden]
+
+class DetectorDuplicados:
+    """Duplicados exactos y similares de toda la base.
+
+    grupos tiene una fila por grupo detectado y registros una fila por cada
+    registro involucrado, con el numero de grupo.
+    """
+
+    def __init__(self, df, tolerancia_cm_pct=TOLERANCIA_CM_PCT):
+        self.tolerancia_cm_pct = tolerancia_cm_pct
+        posiciones, claves = normalizar_claves(df)
+        datos = df.iloc[posiciones].reset_index(drop=True)
+
+        # Los metadatos constantes se separaron de la base al compactarla
+        for col, valor in df.attrs.get('metadatos_carga', {}).items():
+            if col in COLUMNAS_ORIGEN and col not in datos.columns:
+                datos[col] = valor
+        origen = [c for c in COLUMNAS_ORIGEN if c in datos.columns]
+        carga = datos.groupby(origen, observed=True, sort=False).ngroup().to_numpy() if origen else np.zeros(len(datos), dtype=np.int64)
+
+        exactos = _grupos_exactos(claves)
+        similares = _grupos_similares(claves, tolerancia_cm_pct)
+
+        # Cadenas similares con mas de un importe (las de un unico importe son exactas)
+        orden, segmentos, _ = similares
+        cm = datos['CM'].to_numpy(dtype=float)[orden]
+        seleccion_similares = (segmentos.largos >= 2) & (minimo(segmentos, cm) < maximo(segmentos, cm))
+        en_similar = np.zeros(len(datos), dtype=bool)
+        en_similar[orden[segmentos.difundir(seleccion_similares)]] = True
+
+        # Los grupos exactos dentro de una cadena similar quedan solo en la cadena
+        orden, segmentos, _ = exactos
+        seleccion_exactos = (segmentos.largos >= 2) & ~primero(segmentos, en_similar[orden])
+
+        tablas_grupos, tablas_registros, posiciones_registros = [], [], []
+        numero = 0
+        for tipo, (orden, segmentos, hashes), seleccion in [
+            (EXACTO, exactos, seleccion_exactos),
+            (SIMILAR, similares, seleccion_similares)
+        ]:
+            if not seleccion.any():
+                continue
+            cm = datos['CM'].to_numpy(dtype=float)[orden]
+
+            n_grupos = int(seleccion.sum())
+            filas = segmentos.difundir(seleccion)
+            grupo = numero + np.cumsum(seleccion)[segmentos.ids[filas]] - 1
+
+            posiciones_registros.append(orden[filas])
+            registros = datos.iloc[orden[filas]].reset_index(drop=True)
+            registros.insert(0, 'Grupo', grupo)
+            registros.insert(0, 'Tipo_Duplicado', tipo)
+            tablas_registros.append(registros)
+
+            cargas = pd.DataFrame({'grupo': grupo, 'carga': carga[orden[filas]]}).drop_duplicates()
+            cm_total = suma(segmentos, cm)[seleccion]
+            cm_max = maximo(segmentos, cm)[seleccion]
+            inicios = orden[segmentos.inicios[seleccion]]
+            tablas_grupos.append(pd.DataFrame({
+                'Tipo_Duplicado': tipo,
+                'Grupo': np.arange(numero, numero + n_grupos),
+                'Clave': [f'{h:016x}' for h in primero(segmentos, hashes)[seleccion]],
+                'ID': datos['ID'].iloc[inicios].to_numpy(),
+                'Cod prestacion': datos['Cod prestacion'].iloc[inicios].to_numpy(),
+                'Prestacion': datos['Prestacion'].iloc[inicios].to_numpy(),
+                'MesFecha': datos['MesFecha'].iloc[inicios].to_numpy(),
+                'Q': datos['Q'].iloc[inicios].to_numpy(),
+                'N_Registros': segmentos.largos[seleccion],
+                'Cargas_Distintas': np.bincount(cargas['grupo'] - numero, minlength=n_grupos),
+                'CM_Min': minimo(segmentos, cm)[seleccion],
+                'CM_Max': cm_max,
+                'CM_Total': cm_total,
+                'Importe_Excedente': cm_total - cm_max
+            }))
+            numero += n_grupos
+
+        if posiciones_registros:
+            posiciones_registros = np.concatenate(posiciones_registros)
+            if len(np.unique(posiciones_registros)) < len(posiciones_registros):
+                raise RuntimeError("Hay registros de la base asignados a mas de un grupo de duplicados")
+
+        if tablas_grupos:
+            self.grupos = pd.concat(tablas_grupos, ignore_index=True)
+            self.registros = pd.concat(tablas_registros, ignore_index=True)
+        else:
+            self.grupos = pd.DataFrame(columns=[
+                'Tipo_Duplicado', 'Grupo', 'Clave', 'ID', 'Cod prestacion', 'Prestacion', 'MesFecha', 'Q',
+                'N_Registros', 'Cargas_Distintas', 'CM_Min', 'CM_Max', 'CM_Total', 'Importe_Excedente'
+            ])
+            self.registros = pd.DataFrame(columns=['Tipo_Duplicado', 'Grupo'] + list(datos.columns))
+
+        for tabla in [self.grupos, self.registros]:
+            tabla['ID'] = tabla['ID'].astype(str)
+
+    def de_prestador(self, prestador):
+        """Grupos y registros duplicados de un prestador"""
+        grupos = self.grupos[self.grupos['ID'] == str(prestador)]
+        registros = self.registros[self.registros['Grupo'].isin(grupos['Grupo'])]
+        return grupos.reset_index(drop=True), registros.reset_index(drop=True)
+
+    def resumen_prestadores(self):
+        """Grupos e importe excedente por prestador, de mayor a menor importe"""
+        resumen = self.grupos.pivot_table(
+            index='ID', columns='Tipo_Duplicado', values='Grupo', aggfunc='count', fill_value=0
+        ).reindex(columns=[EXACTO, SIMILAR], fill_value=0)
+        resumen.columns = ['Grupos_Exactos', 'Grupos_Similares']
+        resumen['Registros'] = self.registros.groupby('ID')['Grupo'].size()
+        resumen['Importe_Excedente'] = self.grupos.groupby('ID')['Importe_Excedente'].sum()
+        return resumen.sort_values('Importe_Excedente', ascending=False)
+
+# ============================================
+# REPORTE GLOBAL
+# ============================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Reporte global de facturacion duplicada")
+    parser.add_argument('--base', default=RUTA_BASE, help="Ruta de la base unificada")
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA_CM_PCT,
+                        help="Diferencia maxima de importe (%%) para duplicados similares")
+    parser.add_argument('--salida', default='duplicados', help="Prefijo de los CSV de grupos y registros")
+    args = parser.parse_args()
+
+    manifiesto = asegurar_particiones(args.base)
+    df = cargar_particiones(
+        columnas=columnas_deteccion(manifiesto['columnas']),
+        dir_version_base=dir_version(manifiesto['firma_origen'])
+    )
+
+    inicio = time.perf_counter()
+    detector = DetectorDuplicados(df, args.tolerancia)
+    segundos = time.perf_counter() - inicio
+
+    detector.grupos.to_csv(f'{args.salida}_grupos.csv', index=False)
+    detector.registros.to_csv(f'{args.salida}_registros.csv', index=False)
+
+    por_tipo = detector.grupos.groupby('Tipo_Duplicado')
+    print(f"Registros: {len(df):,} | grupos: {por_tipo.size().to_dict()} | "
+          f"importe excedente: ${detector.grupos['Importe_Excedente'].sum():,.2f} | deteccion: {segundos:.1f}s")
+    print(detector.resumen_prestadores().head(10).to_string())
+
+if __name__ == "__main__":
+    main()
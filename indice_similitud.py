@@ -0,0 +1,162 @@
+"""Indice de casos similares para la auditoria de facturas.
+
+Cada registro historico con precio unitario valido se representa como un
+vector de rasgos: precio unitario y cantidad (en escala logaritmica), el
+percentil de precios del prestador y el Tipo Clase CM. Las busquedas k-NN
+se restringen primero al bloque de registros del mismo Cod prestacion
+(ordenados por codigo, con offsets); si el bloque no alcanza se recorre toda
+la matriz por bloques, penalizando los codigos distintos.
+"""
+
+import unicodedata
+
+import numpy as np
+
+COLUMNAS_CASO = ['ID', 'Prestacion', 'Cod prestacion', 'Tipo Clase CM', 'MesFecha', 'Q', 'CM', 'PU']
+
+# Peso de cada rasgo en la distancia (rasgos numericos estandarizados)
+PESOS_RASGOS = {
+    'pu': 2.0,
+    'q': 1.0,
+    'percentil_prestador': 1.0,
+    'tipo': 1.0
+}
+
+# Distancia extra para casos de otro Cod prestacion
+PENALIDAD_CODIGO = 10.0
+
+TAMANO_BLOQUE = 32768
+
+def _normalizar(texto):
+    texto = unicodedata.normalize('NFKD', str(texto))
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower().strip()
+
+class IndiceSimilitud:
+    """Indice k-NN sobre los registros historicos de todos los prestadores"""
+
+    def __init__(self, df):
+        validos = df['PU'].gt(0) & df['Q'].gt(0) & df['Cod prestacion'].notna()
+        casos = df.loc[validos, COLUMNAS_CASO].copy()
+        casos['Cod prestacion'] = casos['Cod prestacion'].astype(str)
+
+        # Percentil de precios del prestador: mediana de su PU relativo a la
+        # mediana de cada codigo, rankeada entre todos los prestadores
+        pu_relativo = casos['PU'] / casos.groupby('Cod prestacion')['PU'].transform('median')
+        mediana_prestador = pu_relativo.groupby(casos['ID'].astype(str)).median()
+        self.percentil_prestador = mediana_prestador.rank(pct=True)
+        casos['Percentil_Prestador'] = casos['ID'].astype(str).map(self.percentil_prestador).to_numpy()
+
+        # Orden por codigo con offsets de cada bloque
+        casos = casos.sort_values('Cod prestacion', kind='mergesort').reset_index(drop=True)
+        codigos = casos['Cod prestacion'].to_numpy()
+        self.codigos, self.inicios = np.unique(codigos, return_index=True)
+        self.finales = np.append(self.inicios[1:], len(casos))
+        self.codigo_fila = np.searchsorted(self.codigos, codigos)
+
+        # Codigo mas frecuente de cada prestacion
+        self.codigo_prestacion = (
+            casos.groupby(['Prestacion', 'Cod prestacion'], observed=True).size()
+            .sort_values(ascending=False, kind='mergesort')
+            .reset_index()
+            .drop_duplicates('Prestacion')
+            .set_index('Prestacion')['Cod prestacion']
+            .to_dict()
+        )
+
+        self.tipos = [str(t) for t in df['Tipo Clase CM'].cat.categories]
+        self._tipos_normalizados = [_normalizar(t) for t in self.tipos]
+
+        numericos = np.column_stack([
+            np.log(casos['PU'].to_numpy(dtype=float)),
+            np.log(casos['Q'].to_numpy(dtype=float)),
+            casos['Percentil_Prestador'].to_numpy(dtype=float)
+        ])
+        self.media = numericos.mean(axis=0)
+        self.escala = numericos.std(axis=0)
+        self.escala[self.escala == 0] = 1
+
+        self.rasgos = np.hstack([
+            self._escalar(numericos),
+            self._codificar_tipos(casos['Tipo Clase CM'].cat.codes.to_numpy())
+        ]).astype(np.float32)
+
+        self.casos = casos
+
+    def _escalar(self, numericos):
+        pesos = np.array([PESOS_RASGOS['pu'], PESOS_RASGOS['q'], PESOS_RASGOS['percentil_prestador']])
+        return (numericos - self.media) / self.escala * pesos
+
+    def _codificar_tipos(self, codigos_tipo):
+        # One-hot con peso tal que dos tipos distintos suman PESOS_RASGOS['tipo'] de distancia
+        codigos_tipo = np.atleast_1d(codigos_tipo)
+        matriz = np.zeros((len(codigos_tipo), len(self.tipos)))
+        conocidos = codigos_tipo >= 0
+        matriz[np.flatnonzero(conocidos), codigos_tipo[conocidos]] = np.sqrt(PESOS_RASGOS['tipo'] / 2)
+        return matriz
+
+    def codigo_tipo(self, tipo_clase):
+        """Codigo de categoria de un Tipo Clase CM (tolera acentos y nombres abreviados)"""
+        buscado = _normalizar(tipo_clase)
+        for i, tipo in enumerate(self._tipos_normalizados):
+            if tipo == buscado or tipo.startswith(buscado):
+                return i
+        return -1
+
+    def vector_consulta(self, prestador, tipo_clase, importe, cantidad):
+        """Vector de rasgos de una factura a auditar"""
+        cantidad = max(float(cantidad), 1.0)
+        numericos = np.array([[
+            np.log(max(float(importe), 1.0) / cantidad),
+            np.log(cantidad),
+            self.percentil_prestador.get(str(prestador), 0.5)
+        ]])
+        return np.hstack([
+            self._escalar(numericos),
+            self._codificar_tipos(np.array([self.codigo_tipo(tipo_clase)]))
+        ]).astype(np.float32)[0]
+
+    def _vecinos_bloque(self, vector, inicio, fin, k):
+        distancias = np.sqrt(((self.rasgos[inicio:fin] - vector) ** 2).sum(axis=1))
+        if fin - inicio > k:
+            seleccion = np.argpartition(distancias, k)[:k]
+        else:
+            seleccion = np.arange(fin - inicio)
+        return seleccion + inicio, distancias[seleccion]
+
+    def _vecinos_global(self, vector, codigo, k):
+        mejores_idx = np.empty(0, dtype=np.int64)
+        mejores_dist = np.empty(0, dtype=np.float32)
+        for inicio in range(0, len(self.rasgos), TAMANO_BLOQUE):
+            fin = min(inicio + TAMANO_BLOQUE, len(self.rasgos))
+            distancias = np.sqrt(((self.rasgos[inicio:fin] - vector) ** 2).sum(axis=1))
+            distancias += PENALIDAD_CODIGO * (self.codigo_fila[inicio:fin] != codigo)
+
+            candidatos_idx = np.concatenate([mejores_idx, np.arange(inicio, fin)])
+            candidatos_dist = np.concatenate([mejores_dist, distancias])
+            if len(candidatos_dist) > k:
+                seleccion = np.argpartition(candidatos_dist, k)[:k]
+                candidatos_idx, candidatos_dist = candidatos_idx[seleccion], candidatos_dist[seleccion]
+            mejores_idx, mejores_dist = candidatos_idx, candidatos_dist
+        return mejores_idx, mejores_dist
+
+    def buscar(self, prestador, prestacion, tipo_clase, importe, cantidad=1, k=20):
+        """Devuelve los k registros historicos mas similares a una factura"""
+        vector = self.vector_consulta(prestador, tipo_clase, importe, cantidad)
+
+        cod = self.codigo_prestacion.get(prestacion)
+        posicion = np.searchsorted(self.codigos, cod) if cod is not None else len(self.codigos)
+        if posicion < len(self.codigos) and self.codigos[posicion] == cod:
+            inicio, fin = self.inicios[posicion], self.finales[posicion]
+        else:
+            posicion, inicio, fin = -1, 0, 0
+
+        if fin - inicio >= k:
+            indices, distancias = self._vecinos_bloque(vector, inicio, fin, k)
+        else:
+            indices, distancias = self._vecinos_global(vector, posicion, k)
+
+        orden = np.argsort(distancias, kind='stable')
+        resultado = self.casos.iloc[indices[orden]].copy()
+        resultado['Mismo_Codigo'] = self.codigo_fila[indices[orden]] == posicion
+        resultado['Distancia'] = np.round(distancias[orden] - PENALIDAD_CODIGO * ~resultado['Mismo_Codigo'].to_numpy(), 3)
+        return resultado.reset_index(drop=True)
@@ -0,0 +1,98 @@
+"""Indice de consultas por rango de fechas para el analisis de variaciones.
+
+Los registros con PU valido de un prestador se guardan ordenados por
+prestacion y mes, con una clave combinada creciente (prestacion * paso +
+mes) y sumas acumuladas de Q. Para cualquier ventana [desde, hasta] los
+limites de cada prestacion salen de dos searchsorted sobre la clave, y con
+ellos el primer y ultimo PU/CM, el Q total y la cantidad de registros, sin
+volver a filtrar ni agrupar el DataFrame.
+"""
+
+import numpy as np
+import pandas as pd
+
+COLUMNAS_VARIACIONES = [
+    'Prestacion', 'Fecha_Inicial', 'Fecha_Final', 'PU_Inicial', 'PU_Final',
+    'Variacion_Abs', 'Variacion_Pct', 'CM_Inicial', 'CM_Final', 'Q_Total', 'N_Registros'
+]
+
+def _mes_absoluto(fechas):
+    fechas = pd.DatetimeIndex(fechas)
+    return np.asarray(fechas.year * 12 + fechas.month - 1, dtype=np.int64)
+
+class IndiceVariaciones:
+    """Series de PU de un prestador con busqueda por ventana de meses.
+
+    Requiere que df_prest conserve el orden por serie y mes de la base
+    cargada (como calcular_tabla_variaciones).
+    """
+
+    def __init__(self, df_prest):
+        validos = df_prest[df_prest['PU'].notna() & df_prest['Prestacion'].notna()]
+        serie = pd.factorize(validos['Prestacion'])[0].astype(np.int64)
+        cambio = np.ones(len(serie), dtype=bool)
+        cambio[1:] = serie[1:] != serie[:-1]
+        inicios = np.flatnonzero(cambio)
+
+        self.prestaciones = validos['Prestacion'].iloc[inicios].reset_index(drop=True)
+        self.fechas = validos['MesFecha'].to_numpy()
+        self.pu = validos['PU'].to_numpy(dtype=float)
+        self.cm = validos['CM'].to_numpy(dtype=float)
+        self.tipo_q = validos['Q'].dtype
+        # Sumas acumuladas con un cero inicial: Q total de [i, j) = acumulado[j] - acumulado[i]
+        self.q_acumulado = np.concatenate([[0.0], np.cumsum(np.nan_to_num(validos['Q'].to_numpy(dtype=float)))])
+
+        # Clave combinada creciente: cada prestacion ocupa un tramo de paso meses
+        mes = _mes_absoluto(self.fechas)
+        self.mes_min = int(mes.min()) if len(mes) else 0
+        self.paso = int(mes.max()) - self.mes_min + 2 if len(mes) else 1
+        self.claves = (np.cumsum(cambio) - 1) * self.paso + (mes - self.mes_min)
+
+    def __len__(self):
+        return len(self.prestaciones)
+
+    def limites(self, desde=None, hasta=None):
+        """Primera y ultima+1 posicion de cada prestacion dentro de la ventana"""
+        base = np.arange(len(self), dtype=np.int64) * self.paso
+        inicio, fin = 0, self.paso - 2
+        if desde is not None:
+            desde = pd.Timestamp(desde)
+            # MesFecha es el primer dia del mes: un desde a mitad de mes excluye ese mes
+            inicio = _mes_absoluto([desde])[0] - self.mes_min + int(desde > desde.to_period('M').to_timestamp())
+        if hasta is not None:
+            fin = _mes_absoluto([pd.Timestamp(hasta)])[0] - self.mes_min
+
+        # Las ventanas se recortan al rango del indice para no invadir otra prestacion
+        inicio = min(max(inicio, 0), self.paso - 1)
+        fin = min(max(fin, -1), self.paso - 2)
+
+        izq = np.searchsorted(self.claves, base + inicio, side='left')
+        der = np.searchsorted(self.claves, base + fin, side='right')
+        return izq, np.maximum(der, izq)
+
+    def consultar(self, desde=None, hasta=None, min_registros=2):
+        """Tabla de variaciones de PU de cada prestacion en la ventana [desde, hasta]"""
+        izq, der = self.limites(desde, hasta)
+        n = der - izq
+        seleccion = n >= min_registros
+        izq, der, n = izq[seleccion], der[seleccion], n[seleccion]
+
+        df_var = pd.DataFrame({
+            'Prestacion': self.prestaciones[seleccion].reset_index(drop=True),
+            'Fecha_Inicial': self.fechas[izq],
+            'Fecha_Final': self.fechas[der - 1],
+            'PU_Inicial': self.pu[izq],
+            'PU_Final': self.pu[der - 1],
+            'CM_Inicial': self.cm[izq],
+            'CM_Final': self.cm[der - 1],
+            'Q_Total': (self.q_acumulado[der] - self.q_acumulado[izq]).astype(self.tipo_q),
+            'N_Registros': n
+        })
+
+        df_var['Variacion_Abs'] = df_var['PU_Final'] - df_var['PU_Inicial']
+        df_var['Variacion_Pct'] = np.where(
+            df_var['PU_Inicial'] > 0,
+            df_var['Variacion_Abs'] / df_var['PU_Inicial'].where(df_var['PU_Inicial'] > 0) * 100,
+            0.0
+        )
+        return df_var[COLUMNAS_VARIACIONES]
@@ -0,0 +1,31 @@
+"""Arranque de la app con la base y los indices precalentados.
+
+Crea el gestor de datos (particiones de la version actual de la base e
+indices derivados) antes de levantar el servidor de Streamlit en el mismo
+proceso, de modo que la primera sesion no paga la carga en frio. Los
+argumentos se pasan a `streamlit run` tal cual:
+
+    python iniciar_app.py --server.port=8501 --server.headless=true
+"""
+
+import os
+import sys
+import time
+
+RUTA_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app_auditoria_comparativa.py')
+
+def main():
+    inicio = time.perf_counter()
+
+    from recarga_datos import obtener_gestor
+    gestor = obtener_gestor(construir_indices=True)
+
+    print(f"Datos precalentados en {time.perf_counter() - inicio:.1f}s "
+          f"(version {gestor.activa.version})", flush=True)
+
+    from streamlit.web import cli
+    sys.argv = ['streamlit', 'run', RUTA_APP] + sys.argv[1:]
+    sys.exit(cli.main())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Materializacion offline de los dashboards por prestador.
+
+Precalcula y guarda en disco los artefactos del DASHBOARD TEMPORAL de cada
+prestador (metricas generales, tabla resumen, tabla de variaciones, insights
+y figuras serializadas). Solo se recalculan los prestadores cuyas filas
+cambiaron desde la ultima corrida, segun un hash de contenido por prestador.
+
+Uso (por ejemplo desde cron, despues de cada ingesta):
+
+    python materializar_dashboards.py --workers 4
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import pandas as pd
+
+from motor_auditoria import (
+    RUTA_BASE,
+    leer_base,
+    calcular_metricas_prestador,
+    calcular_tabla_variaciones,
+    construir_dashboard
+)
+
+DIR_ARTEFACTOS = 'artefactos_dashboard'
+ARCHIVO_MANIFIESTO = 'manifiesto.json'
+
+# Incrementar al cambiar el formato o el calculo de los artefactos
+VERSION_ARTEFACTOS = 1
+
+# Columnas de origen que determinan el contenido de un prestador
+COLUMNAS_HASH = ['MesFecha', 'Q', 'CM', 'PU', 'Tipo Clase CM', 'Cod prestacion', 'Prestacion']
+
+SECCIONES_FIGURA = ['evolucion', 'variacion_pu', 'heatmap', 'boxplot']
+
+# ============================================
+# HASH Y MANIFIESTO
+# ============================================
+
+def hash_prestador(df_prestador):
+    """Calcula el hash de contenido de las filas de un prestador"""
+    filas = df_prestador[COLUMNAS_HASH].sort_values(['MesFecha', 'Prestacion', 'Tipo Clase CM'], kind='mergesort')
+    valores = pd.util.hash_pandas_object(filas, index=False).to_numpy()
+    h = hashlib.sha1(valores.tobytes())
+    h.update(str(VERSION_ARTEFACTOS).encode())
+    return h.hexdigest()
+
+def leer_manifiesto(dir_artefactos=DIR_ARTEFACTOS):
+    """Lee el manifiesto de artefactos (vacio si no existe)"""
+    ruta = os.path.join(dir_artefactos, ARCHIVO_MANIFIESTO)
+    if not os.path.exists(ruta):
+        return {'version_artefactos': VERSION_ARTEFACTOS, 'prestadores': {}}
+    with open(ruta, encoding='utf-8') as f:
+        manifiesto = json.load(f)
+    if manifiesto.get('version_artefactos') != VERSION_ARTEFACTOS:
+        return {'version_artefactos': VERSION_ARTEFACTOS, 'prestadores': {}}
+    return manifiesto
+
+def escribir_manifiesto(manifiesto, dir_artefactos=DIR_ARTEFACTOS):
+    """Escribe el manifiesto de forma atomica"""
+    ruta = os.path.join(dir_artefactos, ARCHIVO_MANIFIESTO)
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, indent=2, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+# ============================================
+# ESCRITURA Y LECTURA DE ARTEFACTOS
+# ============================================
+
+def materializar_prestador(prestador, df_prestador, hash_contenido, dir_artefactos=DIR_ARTEFACTOS):
+    """Calcula y escribe los artefactos del dashboard de un prestador"""
+    destino = os.path.join(dir_artefactos, prestador)
+    temporal = destino + '.tmp'
+    shutil.rmtree(temporal, ignore_errors=True)
+    os.makedirs(temporal)
+
+    metricas = calcular_metricas_prestador(df_prestador)
+    with open(os.path.join(temporal, 'metricas.json'), 'w', encoding='utf-8') as f:
+        json.dump(metricas, f)
+
+    calcular_tabla_variaciones(df_prestador).to_parquet(os.path.join(temporal, 'variaciones.parquet'))
+
+    for seccion, resultado in construir_dashboard(df_prestador, max_workers=1):
+        if seccion == 'resumen':
+            resultado.to_parquet(os.path.join(temporal, 'resumen.parquet'))
+        elif seccion == 'insights':
+            resultado.rename('Crecimiento_CM_%').to_frame().to_parquet(os.path.join(temporal, 'insights.parquet'))
+        else:
+            with open(os.path.join(temporal, f'{seccion}.json'), 'w', encoding='utf-8') as f:
+                f.write(resultado.to_json())
+
+    shutil.rmtree(destino, ignore_errors=True)
+    os.replace(temporal, destino)
+    return prestador, hash_contenido
+
+def _leer_json(ruta):
+    with open(ruta, encoding='utf-8') as f:
+        return json.load(f)
+
+def _leer_figura(ruta):
+    import plotly.io as pio
+    with open(ruta, encoding='utf-8') as f:
+        return pio.from_json(f.read())
+
+LECTORES_ARTEFACTOS = {
+    'metricas': lambda origen: _leer_json(os.path.join(origen, 'metricas.json')),
+    'variaciones': lambda origen: pd.read_parquet(os.path.join(origen, 'variaciones.parquet')),
+    'resumen': lambda origen: pd.read_parquet(os.path.join(origen, 'resumen.parquet')),
+    'insights': lambda origen: pd.read_parquet(os.path.join(origen, 'insights.parquet'))['Crecimiento_CM_%'],
+    **{
+        seccion: (lambda origen, seccion=seccion: _leer_figura(os.path.join(origen, f'{seccion}.json')))
+        for seccion in SECCIONES_FIGURA
+    }
+}
+
+def cargar_artefactos_prestador(prestador, df_prestador, secciones=None, dir_artefactos=DIR_ARTEFACTOS):
+    """Carga los artefactos de un prestador si estan vigentes para df_prestador.
+
+    Devuelve None si no existen o si las filas del prestador cambiaron
+    desde la materializacion. Con secciones se limita la lectura a esos
+    artefactos.
+    """
+    entrada = leer_manifiesto(dir_artefactos)['prestadores'].get(prestador)
+    if entrada is None or entrada['hash'] != hash_prestador(df_prestador):
+        return None
+
+    origen = os.path.join(dir_artefactos, prestador)
+    try:
+        return {
+            seccion: LECTORES_ARTEFACTOS[seccion](origen)
+            for seccion in (secciones or LECTORES_ARTEFACTOS)
+        }
+    except (OSError, ValueError):
+        return None
+
+# ============================================
+# PROCESO BATCH
+# ============================================
+
+def materializar_todos(ruta_base=RUTA_BASE, dir_artefactos=DIR_ARTEFACTOS, workers=None, forzar=False):
+    """Materializa los artefactos de todos los prestadores que cambiaron"""
+    os.makedirs(dir_artefactos, exist_ok=True)
+    datos = leer_base(ruta_base)
+    manifiesto = leer_manifiesto(dir_artefactos)
+    previos = manifiesto['prestadores']
+
+    pendientes = []
+    vigentes = {}
+    for prestador, df_prestador in datos.groupby('ID', sort=True, observed=True):
+        hash_contenido = hash_prestador(df_prestador)
+        entrada = previos.get(prestador)
+        if not forzar and entrada is not None and entrada['hash'] == hash_contenido:
+            vigentes[prestador] = entrada
+        else:
+            pendientes.append((prestador, df_prestador, hash_contenido))
+
+    # Prestadores que ya no estan en la base
+    for prestador in set(previos) - set(datos['ID'].unique()):
+        shutil.rmtree(os.path.join(dir_artefactos, prestador), ignore_errors=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futuros = [
+            executor.submit(materializar_prestador, prestador, df_prestador, hash_contenido, dir_artefactos)
+            for prestador, df_prestador, hash_contenido in pendientes
+        ]
+        for futuro in as_completed(futuros):
+            prestador, hash_contenido = futuro.result()
+            vigentes[prestador] = {
+                'hash': hash_contenido,
+                'generado': datetime.now().isoformat(timespec='seconds')
+            }
+
+    manifiesto['prestadores'] = dict(sorted(vigentes.items()))
+    escribir_manifiesto(manifiesto, dir_artefactos)
+
+    return len(pendientes), len(vigentes) - len(pendientes)
+
+def main():
+    parser = argparse.ArgumentParser(description="Materializa los dashboards de todos los prestadores")
+    parser.add_argument('--base', default=RUTA_BASE, help="Ruta de la base unificada")
+    parser.add_argument('--salida', default=DIR_ARTEFACTOS, help="Directorio de artefactos")
+    parser.add_argument('--workers', type=int, default=None, help="Procesos en paralelo (por defecto, CPUs disponibles)")
+    parser.add_argument('--forzar', action='store_true', help="Recalcula todos los prestadores")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    recalculados, sin_cambios = materializar_todos(args.base, args.salida, args.workers, args.forzar)
+    print(f"Prestadores recalculados: {recalculados} | sin cambios: {sin_cambios} | "
+          f"tiempo: {time.perf_counter() - inicio:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Medicion del arranque en frio de la app.
+
+Mide, para cada modo de arranque, el tiempo desde que se lanza el proceso
+hasta que el servidor responde, hasta que la primera sesion recibe la pagina
+interactiva completa (fin de la primera ejecucion del script) y hasta que
+termina su primera auditoria. Con --presupuesto termina con error si algun
+modo excede ese tiempo desde el lanzamiento hasta la primera pagina
+interactiva.
+
+Uso:
+
+    python medir_arranque.py --modos streamlit lanzador --presupuesto 8
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import urllib.request
+
+from prueba_carga import iniciar_servidor, SesionStreamlit, flujo_auditoria
+
+MODOS = {
+    'streamlit': False,
+    'lanzador': True
+}
+
+def esperar_salud(puerto, inicio, timeout):
+    """Segundos desde inicio hasta que el servidor responde"""
+    while time.perf_counter() - inicio < timeout:
+        try:
+            with urllib.request.urlopen(f'http://localhost:{puerto}/_stcore/health', timeout=1) as r:
+                if r.status == 200:
+                    return time.perf_counter() - inicio
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"El servidor no respondio en {timeout}s")
+
+async def primera_sesion(puerto, inicio, timeout):
+    """Latencias de la primera pagina y de la primera auditoria, y segundos
+    desde inicio hasta la primera pagina interactiva"""
+    sesion = SesionStreamlit(f'http://localhost:{puerto}', timeout)
+    await sesion.conectar()
+    try:
+        pagina = await sesion.ejecutar()
+        hasta_pagina = time.perf_counter() - inicio
+        auditoria = await flujo_auditoria(sesion, random.Random(0))
+    finally:
+        sesion.cerrar()
+    return pagina, hasta_pagina, auditoria, sesion.errores
+
+def medir_modo(modo, puerto, timeout):
+    """Arranca la app en un modo y mide el arranque en frio"""
+    inicio = time.perf_counter()
+    servidor = iniciar_servidor(puerto, timeout, lanzador=MODOS[modo])
+    try:
+        servidor_listo = esperar_salud(puerto, inicio, timeout)
+        pagina, hasta_pagina, auditoria, errores = asyncio.run(primera_sesion(puerto, inicio, timeout))
+        total = time.perf_counter() - inicio
+    finally:
+        servidor.terminate()
+        servidor.wait()
+
+    return {
+        'modo': modo,
+        'servidor_listo_s': servidor_listo,
+        'primera_pagina_s': pagina,
+        'hasta_primera_pagina_s': hasta_pagina,
+        'primera_auditoria_s': auditoria,
+        'total_s': total,
+        'errores': errores
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide el arranque en frio de la app")
+    parser.add_argument('--modos', nargs='+', choices=list(MODOS), default=list(MODOS))
+    parser.add_argument('--puerto', type=int, default=8598)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--presupuesto', type=float, help="Segundos maximos desde el lanzamiento hasta la primera pagina interactiva")
+    parser.add_argument('--salida', help="Archivo JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    resultados = [medir_modo(modo, args.puerto, args.timeout) for modo in args.modos]
+
+    print(f"{'Modo':<10} {'Servidor':>9} {'1ra pagina':>11} {'Hasta pagina':>13} {'1ra auditoria':>14} "
+          f"{'Total':>7} {'Presupuesto':>12}")
+    excedido = False
+    for r in resultados:
+        estado = ''
+        if args.presupuesto is not None:
+            ok = r['hasta_primera_pagina_s'] <= args.presupuesto and r['errores'] == 0
+            excedido |= not ok
+            estado = 'OK' if ok else 'EXCEDIDO'
+        print(f"{r['modo']:<10} {r['servidor_listo_s']:>8.2f}s {r['primera_pagina_s']:>10.2f}s "
+              f"{r['hasta_primera_pagina_s']:>12.2f}s {r['primera_auditoria_s']:>13.2f}s "
+              f"{r['total_s']:>6.2f}s {estado:>12}")
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump({'presupuesto_s': args.presupuesto, 'resultados': resultados}, f, indent=2)
+
+    if excedido:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
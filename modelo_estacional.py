@@ -0,0 +1,225 @@
+"""Modelo estacional de CM esperado por serie (ID, Prestacion).
+
+Cada serie se modela como nivel + tendencia lineal + efecto del mes del año:
+
+    CM = a + b * t + s[mes]
+
+con t en años desde ORIGEN_TENDENCIA. Los efectos mensuales se estiman con
+penalizacion ridge (se achican hacia cero cuando el mes tiene pocos
+registros), lo que ademas resuelve la colinealidad entre el nivel y los
+doce efectos. El desvio residual usa los grados de libertad efectivos del
+ajuste ridge y la tendencia no se extrapola fuera del periodo ajustado.
+
+Todas las series se ajustan a la vez: las ecuaciones normales de cada serie
+se arman con sumas por (serie, mes) via bincount y se resuelven como un
+lote de sistemas de 14x14. El modelo se guarda en el directorio de cada
+version de la base; al construir una version nueva se parte del modelo de
+la version anterior y solo se reajustan las series cuyos datos cambiaron.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from segmentos import agrupar, minimo, maximo
+
+COLUMNAS_MODELO = ['ID', 'Prestacion', 'MesFecha', 'Tipo Clase CM', 'CM']
+
+ARCHIVO_MODELO = 'modelo_estacional.parquet'
+
+ORIGEN_TENDENCIA = pd.Timestamp('2020-01-01')
+
+# Penalizacion de los efectos mensuales, en registros: un mes con
+# LAMBDA_ESTACIONAL registros conserva la mitad de su efecto observado
+LAMBDA_ESTACIONAL = 2.0
+# Penalizacion minima de la tendencia (solo evita sistemas singulares)
+LAMBDA_TENDENCIA = 1e-3
+
+# Historia minima: meses calendario distintos con CM
+MIN_MESES_MODELO = 12
+
+COLUMNAS_EFECTOS = [f'S_{m:02d}' for m in range(1, 13)]
+
+def _tiempo(fechas):
+    """Años desde ORIGEN_TENDENCIA y mes del año (0-11)"""
+    fechas = pd.to_datetime(pd.Series(fechas))
+    meses = (fechas.dt.year - ORIGEN_TENDENCIA.year) * 12 + fechas.dt.month - ORIGEN_TENDENCIA.month
+    return (meses / 12).to_numpy(dtype=float), (fechas.dt.month - 1).to_numpy()
+
+def _series(df):
+    """Registros con CM ordenados por serie, con los segmentos de cada serie"""
+    validos = df[df['CM'].notna() & df['MesFecha'].notna()]
+    return agrupar(validos, ['ID', 'Prestacion'])
+
+def huellas_series(df):
+    """Huella de 64 bits de los registros de cada serie (independiente del orden)"""
+    d, series = _series(df)
+    hashes = pd.util.hash_pandas_object(
+        d[['MesFecha', 'Tipo Clase CM', 'CM']].astype({'Tipo Clase CM': str}), index=False
+    ).to_numpy()
+    return pd.DataFrame({
+        'ID': d['ID'].iloc[series.inicios].astype(str).to_numpy(),
+        'Prestacion': d['Prestacion'].iloc[series.inicios].astype(str).to_numpy(),
+        # La suma con desborde de uint64 no depende del orden de los registros
+        'Huella': np.add.reduceat(hashes, series.inicios) if len(series) else np.empty(0, dtype=np.uint64)
+    })
+
+def ajustar_series(df, lambda_estacional=LAMBDA_ESTACIONAL):
+    """Ajusta el modelo de todas las series de df en un solo lote.
+
+    Devuelve una fila por serie con al menos MIN_MESES_MODELO meses: nivel,
+    tendencia anual, los doce efectos mensuales, desvio residual, cantidad
+    de registros y el rango de t ajustado.
+    """
+    d, series = _series(df)
+    n_series = len(series)
+    ids = series.ids
+    t, mes = _tiempo(d['MesFecha'])
+    y = d['CM'].to_numpy(dtype=float)
+
+    # Sumas por (serie, mes del año)
+    celda = ids * 12 + mes
+    def por_celda(pesos):
+        return np.bincount(celda, weights=pesos, minlength=n_series * 12).reshape(n_series, 12)
+    c = por_celda(None)
+    st_ = por_celda(t)
+    stt = por_celda(t * t)
+    sy = por_celda(y)
+    sty = por_celda(t * y)
+
+    # Ecuaciones normales: columnas [nivel, tendencia, 12 efectos mensuales]
+    xtx = np.zeros((n_series, 14, 14))
+    xtx[:, 0, 0] = c.sum(axis=1)
+    xtx[:, 0, 1] = xtx[:, 1, 0] = st_.sum(axis=1)
+    xtx[:, 1, 1] = stt.sum(axis=1) + LAMBDA_TENDENCIA
+    xtx[:, 0, 2:] = xtx[:, 2:, 0] = c
+    xtx[:, 1, 2:] = xtx[:, 2:, 1] = st_
+    meses_idx = np.arange(2, 14)
+    xtx[:, meses_idx, meses_idx] = c + lambda_estacional
+    penalizacion = np.zeros(14)
+    penalizacion[1] = LAMBDA_TENDENCIA
+    penalizacion[2:] = lambda_estacional
+
+    xty = np.concatenate([sy.sum(axis=1, keepdims=True), sty.sum(axis=1, keepdims=True), sy], axis=1)
+
+    # Meses calendario distintos de cada serie
+    meses_serie = pd.DataFrame({'serie': ids, 'mes': np.round(t * 12).astype(np.int64)}).drop_duplicates()
+    n_meses = np.bincount(meses_serie['serie'], minlength=n_series)
+    ajustables = n_meses >= MIN_MESES_MODELO
+
+    coef = np.full((n_series, 14), np.nan)
+    grados_modelo = np.full(n_series, np.nan)
+    if ajustables.any():
+        coef[ajustables] = np.linalg.solve(xtx[ajustables], xty[ajustables][..., None])[..., 0]
+        # Grados de libertad efectivos: traza de la matriz sombrero
+        # X (X'X + P)^-1 X' = traza de (X'X + P)^-1 X'X
+        sin_penalizar = xtx[ajustables] - np.diag(penalizacion)
+        grados_modelo[ajustables] = np.trace(np.linalg.solve(xtx[ajustables], sin_penalizar), axis1=1, axis2=2)
+
+    # Desvio residual con los grados de libertad efectivos
+    prediccion = coef[ids, 0] + coef[ids, 1] * t + coef[ids, 2 + mes]
+    rss = np.bincount(ids, weights=(y - prediccion) ** 2, minlength=n_series)
+    n = series.largos
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma = np.sqrt(rss / np.maximum(n - grados_modelo, 1))
+
+    modelo = pd.DataFrame({
+        'ID': d['ID'].iloc[series.inicios].astype(str).to_numpy(),
+        'Prestacion': d['Prestacion'].iloc[series.inicios].astype(str).to_numpy(),
+        'Nivel': coef[:, 0],
+        'Tendencia_Anual': coef[:, 1]
+    })
+    for i, col in enumerate(COLUMNAS_EFECTOS):
+        modelo[col] = coef[:, 2 + i]
+    modelo['Sigma'] = sigma
+    modelo['N_Registros'] = n
+    modelo['N_Meses'] = n_meses
+    modelo['T_Min'] = minimo(series, t)
+    modelo['T_Max'] = maximo(series, t)
+
+    return modelo[ajustables].reset_index(drop=True)
+
+class ModeloEstacional:
+    """Coeficientes por serie con busqueda por (prestador, prestacion)"""
+
+    def __init__(self, tabla, series_reajustadas=None):
+        self.tabla = tabla.reset_index(drop=True)
+        self.series_reajustadas = len(tabla) if series_reajustadas is None else series_reajustadas
+        self._filas = {clave: i for i, clave in enumerate(zip(self.tabla['ID'], self.tabla['Prestacion']))}
+
+    @classmethod
+    def ajustar(cls, df, previo=None):
+        """Ajusta el modelo de df reutilizando las series sin cambios de previo"""
+        huellas = huellas_series(df)
+        pendientes = df
+        reutilizables = None
+
+        if previo is not None:
+            reutilizables = previo.tabla.merge(huellas, on=['ID', 'Prestacion', 'Huella'])
+            # Solo se reajustan las series nuevas o con datos distintos
+            claves_df = pd.MultiIndex.from_arrays([df['ID'].astype(str), df['Prestacion'].astype(str)])
+            pendientes = df[~claves_df.isin(pd.MultiIndex.from_frame(reutilizables[['ID', 'Prestacion']]))]
+
+        nuevas = ajustar_series(pendientes).merge(huellas, on=['ID', 'Prestacion'])
+        tabla = pd.concat([reutilizables, nuevas], ignore_index=True) if reutilizables is not None else nuevas
+        return cls(tabla.sort_values(['ID', 'Prestacion'], kind='mergesort'), series_reajustadas=len(nuevas))
+
+    def guardar(self, directorio):
+        temporal = os.path.join(directorio, ARCHIVO_MODELO + '.tmp')
+        self.tabla.to_parquet(temporal, index=False)
+        os.replace(temporal, os.path.join(directorio, ARCHIVO_MODELO))
+
+    @classmethod
+    def cargar(cls, directorio):
+        """Modelo guardado en el directorio de una version (None si no existe)"""
+        ruta = os.path.join(directorio, ARCHIVO_MODELO)
+        if not os.path.exists(ruta):
+            return None
+        tabla = pd.read_parquet(ruta)
+        # Los modelos guardados antes de registrar el rango de t se reajustan
+        if not {'T_Min', 'T_Max'} <= set(tabla.columns):
+            return None
+        return cls(tabla, series_reajustadas=0)
+
+    def esperado(self, prestador, prestacion, fecha):
+        """CM esperado de una serie para el mes de fecha (None si la serie no tiene modelo).
+
+        Fuera del periodo ajustado la tendencia se mantiene en su valor del
+        primer o ultimo mes con datos; el efecto del mes se aplica igual.
+        """
+        i = self._filas.get((str(prestador), str(prestacion)))
+        if i is None:
+            return None
+
+        fila = self.tabla.iloc[i]
+        t, mes = _tiempo([fecha])
+        t = min(max(t[0], fila['T_Min']), fila['T_Max'])
+        efecto = float(fila[COLUMNAS_EFECTOS[mes[0]]])
+        return {
+            'cm_esperado': float(fila['Nivel'] + fila['Tendencia_Anual'] * t + efecto),
+            'efecto_mes': efecto,
+            'tendencia_anual': float(fila['Tendencia_Anual']),
+            # Mes en que se evaluo la tendencia (distinto de fecha si quedo fuera del periodo)
+            'mes_tendencia': (ORIGEN_TENDENCIA + pd.DateOffset(months=int(round(t * 12)))).strftime('%Y-%m'),
+            'sigma': float(fila['Sigma']),
+            'n_registros': int(fila['N_Registros'])
+        }
+
+def modelo_de_version(directorio, cargar_datos, dir_anterior=None):
+    """Modelo de una version de la base, guardado en su directorio.
+
+    Si la version no tiene modelo se ajusta a partir del de la version
+    anterior en dir_anterior, si lo tiene (reajustando solo las series que
+    cambiaron). cargar_datos() devuelve los registros de la version con
+    COLUMNAS_MODELO.
+    """
+    modelo = ModeloEstacional.cargar(directorio)
+    if modelo is not None:
+        return modelo
+
+    previo = ModeloEstacional.cargar(dir_anterior) if dir_anterior is not None else None
+
+    modelo = ModeloEstacional.ajustar(cargar_datos(), previo)
+    modelo.guardar(directorio)
+    return modelo
@@ -0,0 +1,795 @@
+"""Motor de analisis de la auditoria prestacional.
+
+Funciones de carga, metricas, analisis y graficos sin dependencias de la
+interfaz, de modo que puedan usarse tanto desde la app de Streamlit como
+desde procesos batch.
+"""
+
+import pandas as pd
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from segmentos import (
+    Segmentos,
+    agrupar,
+    conteo,
+    suma,
+    media,
+    desvio,
+    minimo,
+    maximo,
+    primero,
+    ultimo,
+    primero_valido,
+    ultimo_valido,
+    variacion_pct,
+    cuantil,
+    mediana
+)
+
+# plotly se importa dentro de cada funcion de graficos: es la dependencia mas
+# pesada del arranque y solo se necesita al dibujar
+
+RUTA_BASE = 'base_global_unificada.csv.gz'
+
+# ============================================
+# FUNCIONES DE CARGA
+# ============================================
+
+# Columnas de texto: se fuerzan a str para que la lectura completa y la
+# lectura por bloques infieran los mismos tipos
+DTYPES_CSV = {'ID': str, 'Prestacion': str, 'Tipo Clase CM': str, 'Cod prestacion': str}
+
+def tipar_base(df):
+    """Convierte fechas e importes leidos del CSV"""
+    df['MesFecha'] = pd.to_datetime(df['MesFecha'])
+    df['CM'] = pd.to_numeric(df['CM'], errors='coerce')
+    df['PU'] = pd.to_numeric(df['PU'], errors='coerce')
+    df['Q'] = pd.to_numeric(df['Q'], errors='coerce')
+    return df
+
+def leer_base(ruta=RUTA_BASE):
+    """Lee la base unificada y agrega las metricas derivadas"""
+    df = pd.read_csv(ruta, compression='gzip', encoding='utf-8', dtype=DTYPES_CSV)
+    df = tipar_base(df)
+    df = agregar_metricas_derivadas(df)
+    
+    memoria_original = df.memory_usage(deep=True, index=False)
+    df, metadatos = compactar_base(df)
+    
+    df.attrs['metadatos_carga'] = metadatos
+    df.attrs['reporte_memoria'] = reporte_memoria(
+        memoria_original, df.memory_usage(deep=True, index=False)
+    ).to_dict()
+    return df
+
+# ============================================
+# ESQUEMA COMPACTO
+# ============================================
+
+# Textos repetidos en toda la base: se codifican como categorias
+COLUMNAS_CATEGORICAS = ['ID', 'Prestacion', 'Tipo Clase CM', 'Cod prestacion']
+
+# Metadatos de la carga: si son constantes se mueven a una tabla aparte
+COLUMNAS_METADATOS = ['Fuente', 'FechaCarga', 'FechaProcesamiento']
+
+COLUMNAS_ENTERAS = ['Año', 'Mes', 'Trimestre']
+
+# Variaciones porcentuales: la precision de float32 es suficiente
+COLUMNAS_PORCENTUALES = ['PU_Var_MoM_%', 'PU_Var_YoY_%', 'CM_Crecimiento_Acum_%']
+
+def cantidades_enteras(q):
+    """Indica si todas las cantidades son enteras representables en float32"""
+    q = q.dropna()
+    return bool(((q == q.round()) & (q.abs() < 2 ** 24)).all())
+
+def compactar_base(df, metadatos_constantes=None, q_entera=None):
+    """Reduce la memoria de la base sin perder informacion.
+    
+    Codifica los textos como categorias, reduce enteros y cantidades, y
+    separa los metadatos de carga constantes. Los importes (CM, PU) se
+    mantienen en float64 porque float32 no conserva los centavos.
+    
+    Si df es solo una parte de la base, metadatos_constantes (columnas
+    constantes en toda la base) y q_entera (si todas las cantidades son
+    enteras) fijan las decisiones que dependen de la base completa, para
+    que todas las partes tengan el mismo esquema. Por defecto se deciden
+    sobre df.
+    
+    Devuelve la base compacta y un diccionario con los metadatos separados.
+    """
+    df = df.copy()
+    
+    metadatos = {}
+    for col in COLUMNAS_METADATOS:
+        if col not in df.columns:
+            continue
+        if metadatos_constantes is None:
+            constante = df[col].nunique(dropna=False) <= 1
+        else:
+            constante = col in metadatos_constantes
+        if constante:
+            metadatos[col] = df[col].iloc[0] if len(df) else None
+            df = df.drop(columns=col)
+    
+    for col in COLUMNAS_CATEGORICAS + [c for c in COLUMNAS_METADATOS if c in df.columns]:
+        df[col] = df[col].astype('category')
+    
+    for col in COLUMNAS_ENTERAS:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    
+    # Las cantidades son enteras: float32 las representa exactamente hasta 2**24
+    if q_entera is None:
+        q_entera = cantidades_enteras(df['Q'])
+    if q_entera:
+        df['Q'] = df['Q'].astype('float32')
+    
+    for col in COLUMNAS_PORCENTUALES:
+        df[col] = df[col].astype('float32')
+    
+    return df, metadatos
+
+def reporte_memoria(memoria_original, memoria_compacta):
+    """Compara la memoria por columna antes y despues de compactar (en MB).
+    
+    Recibe el memory_usage(deep=True) por columna de la base sin compactar
+    y compacta; las columnas movidas a la tabla de metadatos quedan con 0 MB
+    despues.
+    """
+    reporte = pd.DataFrame({
+        'Antes_MB': memoria_original / 1024 ** 2,
+        'Despues_MB': memoria_compacta / 1024 ** 2
+    }).fillna(0)
+    reporte.loc['TOTAL'] = reporte.sum()
+    reporte['Reduccion_x'] = reporte['Antes_MB'] / reporte['Despues_MB']
+    return reporte.round(2)
+
+# ============================================
+# METRICAS DERIVADAS
+# ============================================
+
+# Una serie es la historia mensual de una prestacion de un prestador
+CLAVE_SERIE = ['ID', 'Prestacion']
+
+def _suma_ventana(claves, serie, valores, desde, hasta):
+    """Suma valores cuyas claves (ordenadas) caen en el intervalo (desde, hasta].
+    
+    La suma acumulada se reinicia en cada serie: el resultado de una serie no
+    depende del redondeo de las filas de otras series (ni de como se parta la base).
+    """
+    acumulado = np.concatenate([[0.0], pd.Series(valores).groupby(serie, sort=False).cumsum().to_numpy()])
+    serie_previa = np.concatenate([[-1], serie])
+    izq = np.searchsorted(claves, desde, side='right')
+    der = np.searchsorted(claves, hasta, side='right')
+    # Si la fila anterior a la ventana es de otra serie, su acumulado no se resta
+    antes = np.where(serie_previa[izq] == serie_previa[der], acumulado[izq], 0.0)
+    return np.where(der > izq, acumulado[der] - antes, 0.0)
+
+def agregar_metricas_derivadas(df):
+    """Agrega metricas derivadas por serie (ID, Prestacion) ordenada por mes.
+    
+    Se calculan una sola vez por version de datos, sobre toda la base:
+    - PU_Var_MoM_%: variacion del PU respecto del registro valido anterior
+    - PU_Var_YoY_%: variacion del PU respecto del mismo mes del año anterior
+    - PU_Media_3M / PU_Media_12M: promedio movil del PU (3 y 12 meses)
+    - CM_Crecimiento_Acum_%: crecimiento del CM respecto del primer CM valido
+    """
+    df = df.sort_values(
+        CLAVE_SERIE + ['MesFecha', 'Tipo Clase CM'], kind='mergesort'
+    ).reset_index(drop=True)
+    
+    serie = df.groupby(CLAVE_SERIE, sort=False, dropna=False).ngroup().to_numpy()
+    series = Segmentos.desde_claves(serie)
+    mes = (df['MesFecha'].dt.year * 12 + df['MesFecha'].dt.month).to_numpy()
+    mes = mes - mes.min()
+    
+    # Clave combinada creciente: las ventanas de hasta 13 meses no cruzan series
+    paso = int(mes.max()) + 14
+    claves = serie.astype(np.int64) * paso + mes
+    
+    pu = df['PU']
+    pu_valido = pu.notna().to_numpy()
+    pu_valores = np.where(pu_valido, pu.to_numpy(), 0.0)
+    pu_conteo = pu_valido.astype(float)
+    
+    # Variacion mensual
+    df['PU_Var_MoM_%'] = np.nan
+    df.loc[pu_valido, 'PU_Var_MoM_%'] = variacion_pct(
+        Segmentos.desde_claves(serie[pu_valido]), pu_valores[pu_valido]
+    )
+    
+    # Variacion interanual (contra el promedio del mismo mes del año anterior)
+    suma_anterior = _suma_ventana(claves, serie, pu_valores, claves - 13, claves - 12)
+    conteo_anterior = _suma_ventana(claves, serie, pu_conteo, claves - 13, claves - 12)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pu_anterior = np.where(conteo_anterior > 0, suma_anterior / conteo_anterior, np.nan)
+        df['PU_Var_YoY_%'] = (pu.to_numpy() / pu_anterior - 1) * 100
+    
+    # Promedios moviles
+    for ventana in [3, 12]:
+        suma_movil = _suma_ventana(claves, serie, pu_valores, claves - ventana, claves)
+        conteo_movil = _suma_ventana(claves, serie, pu_conteo, claves - ventana, claves)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            df[f'PU_Media_{ventana}M'] = np.where(conteo_movil > 0, suma_movil / conteo_movil, np.nan)
+    
+    # Crecimiento acumulado del CM
+    cm_inicial = series.difundir(primero_valido(series, df['CM']))
+    df['CM_Crecimiento_Acum_%'] = (df['CM'] - cm_inicial) / cm_inicial * 100
+    
+    return df
+
+# ============================================
+# FUNCIONES DE ANALISIS
+# ============================================
+
+def buscar_historico(base, prestador, prestacion):
+    """Busca historico de una prestacion"""
+    mask = base['ID'].astype(str).str.upper() == str(prestador).upper()
+    
+    if prestacion and 'Prestacion' in base.columns:
+        prestacion_clean = str(prestacion).upper().strip()
+        mask &= base['Prestacion'].astype(str).str.upper().str.contains(
+            prestacion_clean[:30], na=False, regex=False
+        )
+    
+    return base[mask].copy()
+
+def calcular_estadisticas(hist, fecha_auditoria):
+    """Calcula estadisticas del historico"""
+    d = hist[hist['MesFecha'] < pd.to_datetime(fecha_auditoria)].copy()
+    
+    if len(d) < 2:
+        return None
+    
+    d = d.dropna(subset=['CM'])
+    
+    if len(d) == 0:
+        return None
+    
+    return {
+        'promedio': float(d['CM'].mean()),
+        'mediana': float(d['CM'].median()),
+        'std': float(d['CM'].std()),
+        'min': float(d['CM'].min()),
+        'max': float(d['CM'].max()),
+        'q25': float(d['CM'].quantile(0.25)),
+        'q75': float(d['CM'].quantile(0.75)),
+        'q90': float(d['CM'].quantile(0.90)),
+        'q95': float(d['CM'].quantile(0.95)),
+        'n_registros': len(d),
+        'datos': d['CM'].values
+    }
+
+def clasificar_anomalia(z_score):
+    """Clasifica el nivel de anomalia"""
+    if abs(z_score) < 1:
+        return "NORMAL", "alert-normal", "Dentro del rango esperado"
+    elif abs(z_score) < 2:
+        return "REVISAR", "alert-warning", "Desviacion moderada"
+    else:
+        if z_score > 0:
+            return "ALERTA ALTA", "alert-danger", "Sobrecosto significativo"
+        else:
+            return "INUSUAL BAJO", "alert-info", "Costo muy bajo"
+
+# Desvio minimo contra el CM esperado, en % del mayor entre el esperado y el
+# importe: una serie de CM constante (desvio residual 0, por ejemplo siempre
+# en 0) no clasifica cualquier importe como NORMAL
+SIGMA_MINIMA_PCT = 5.0
+
+def comparar_esperado(esperado, importe_cm):
+    """Compara un importe con el CM esperado del modelo estacional"""
+    if esperado is None:
+        return None
+    
+    cm_esperado = esperado['cm_esperado']
+    sigma = max(esperado['sigma'], max(abs(cm_esperado), abs(importe_cm)) * SIGMA_MINIMA_PCT / 100)
+    z_score = (importe_cm - cm_esperado) / sigma if sigma > 0 else 0
+    dif_pct = (importe_cm - cm_esperado) / cm_esperado * 100 if cm_esperado > 0 else 0
+    
+    return {**esperado, 'z_score': float(z_score), 'dif_pct': float(dif_pct)}
+
+def auditar_factura(hist, fecha_auditoria, importe_cm, puntaje_pu=None, esperado=None):
+    """Audita un importe contra el historico.
+    
+    Con puntaje_pu (puntaje del precio unitario) la clasificacion se basa en
+    el precio unitario en lugar del importe total. Si no hay puntaje pero si
+    esperado (CM esperado del modelo estacional para el mes auditado), se
+    basa en la diferencia con ese esperado. Devuelve None si el historico es
+    insuficiente.
+    """
+    stats = calcular_estadisticas(hist, fecha_auditoria)
+    
+    if not stats:
+        return None
+    
+    z_score = (importe_cm - stats['promedio']) / stats['std'] if stats['std'] > 0 else 0
+    dif_pct = ((importe_cm - stats['promedio']) / stats['promedio'] * 100) if stats['promedio'] > 0 else 0
+    estacional = comparar_esperado(esperado, importe_cm)
+    
+    if puntaje_pu is not None:
+        clasificacion, alerta_class, mensaje = clasificar_anomalia(puntaje_pu['z_score'])
+    elif estacional is not None:
+        clasificacion, alerta_class, mensaje = clasificar_anomalia(estacional['z_score'])
+    else:
+        clasificacion, alerta_class, mensaje = clasificar_anomalia(z_score)
+    
+    return {
+        'stats': stats,
+        'z_score': float(z_score),
+        'dif_pct': float(dif_pct),
+        'precio_unitario': puntaje_pu,
+        'estacional': estacional,
+        'clasificacion': clasificacion,
+        'alerta_class': alerta_class,
+        'mensaje': mensaje
+    }
+
+def calcular_lineas_base(df, fecha_auditoria=None):
+    """Lineas base de CM por serie (prestador y prestacion).
+    
+    Equivale a calcular_estadisticas sobre cada serie (sin 'datos'). Con
+    fecha_auditoria solo se usa la historia anterior a esa fecha.
+    """
+    d = df if fecha_auditoria is None else df[df['MesFecha'] < pd.to_datetime(fecha_auditoria)]
+    
+    d, series = agrupar(d, CLAVE_SERIE)
+    
+    # Mismo criterio que calcular_estadisticas: al menos 2 registros de historia
+    validos = d['CM'].notna().to_numpy() & (series.difundir(series.largos) >= 2)
+    d = d[validos]
+    series = series.filtrar(validos)
+    cm = d['CM'].to_numpy(dtype=float)
+    
+    lineas = pd.DataFrame({
+        'promedio': media(series, cm),
+        'mediana': mediana(series, cm),
+        'std': desvio(series, cm),
+        'min': minimo(series, cm),
+        'max': maximo(series, cm),
+        'q25': cuantil(series, cm, 0.25),
+        'q75': cuantil(series, cm, 0.75),
+        'q90': cuantil(series, cm, 0.90),
+        'q95': cuantil(series, cm, 0.95),
+        'n_registros': conteo(series)
+    }, index=pd.MultiIndex.from_frame(d[CLAVE_SERIE].iloc[series.inicios]))
+    
+    return lineas
+
+# ============================================
+# FUNCIONES DE GRAFICOS
+# ============================================
+
+def crear_grafico_evolucion_cm(df_prestador):
+    """Crea grafico de evolucion de CM por prestacion"""
+    import plotly.graph_objects as go
+    
+    # Filtrar datos con CM valido
+    df_plot = df_prestador[df_prestador['CM'].notna()].copy()
+    df_plot = df_plot.sort_values('MesFecha')
+    
+    # Agrupar por prestacion y fecha
+    df_agg = df_plot.groupby(['MesFecha', 'Prestacion'], observed=True)['CM'].sum().reset_index()
+    
+    # Top prestaciones por volumen total
+    top_prestaciones = df_plot.groupby('Prestacion', observed=True)['CM'].sum().nlargest(10).index.tolist()
+    df_top = df_agg[df_agg['Prestacion'].isin(top_prestaciones)]
+    
+    fig = go.Figure()
+    
+    for prestacion in top_prestaciones:
+        data = df_top[df_top['Prestacion'] == prestacion]
+        fig.add_trace(go.Scatter(
+            x=data['MesFecha'],
+            y=data['CM'],
+            mode='lines+markers',
+            name=prestacion[:40],
+            hovertemplate='<b>%{fullData.name}</b><br>Fecha: %{x}<br>CM: $%{y:,.2f}<extra></extra>'
+        ))
+    
+    fig.update_layout(
+        title="Evolucion Temporal del Costo Medico (CM) - Top 10 Prestaciones",
+        xaxis_title="Mes",
+        yaxis_title="Costo Medico (CM)",
+        template="plotly_dark",
+        height=500,
+        hovermode='x unified',
+        legend=dict(
+            orientation="v",
+            yanchor="top",
+            y=1,
+            xanchor="left",
+            x=1.02
+        ),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)'
+    )
+    
+    return fig
+
+def crear_grafico_variacion_pu(df_prestador):
+    """Crea grafico de variacion de precio unitario"""
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    
+    df_plot = df_prestador[df_prestador['PU'].notna()].copy()
+    df_plot = df_plot.sort_values('MesFecha')
+    
+    # Top prestaciones
+    top_prestaciones = df_plot.groupby('Prestacion', observed=True)['CM'].sum().nlargest(10).index.tolist()
+    df_top = df_plot[df_plot['Prestacion'].isin(top_prestaciones)]
+    
+    fig = make_subplots(
+        rows=2, cols=1,
+        subplot_titles=("Precio Unitario (PU)", "Variacion Mensual (%)"),
+        vertical_spacing=0.12,
+        row_heights=[0.6, 0.4]
+    )
+    
+    for prestacion in top_prestaciones:
+        data = df_top[df_top['Prestacion'] == prestacion]
+        
+        # Grafico de PU
+        fig.add_trace(
+            go.Scatter(
+                x=data['MesFecha'],
+                y=data['PU'],
+                mode='lines',
+                name=prestacion[:40],
+                showlegend=True,
+                hovertemplate='%{y:,.2f}'
+            ),
+            row=1, col=1
+        )
+        
+        # Grafico de variacion
+        fig.add_trace(
+            go.Bar(
+                x=data['MesFecha'],
+                y=data['PU_Var_MoM_%'],
+                name=prestacion[:40],
+                showlegend=False,
+                hovertemplate='%{y:+.1f}%'
+            ),
+            row=2, col=1
+        )
+    
+    fig.update_xaxes(title_text="Mes", row=2, col=1)
+    fig.update_yaxes(title_text="Precio Unitario ($)", row=1, col=1)
+    fig.update_yaxes(title_text="Variacion (%)", row=2, col=1)
+    
+    fig.update_layout(
+        title="Analisis de Variacion de Precios Unitarios",
+        template="plotly_dark",
+        height=700,
+        showlegend=True,
+        hovermode='x unified',
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)'
+    )
+    
+    return fig
+
+def crear_grafico_distribucion(stats, importe_cm, titulo):
+    """Crea grafico de distribucion"""
+    import plotly.graph_objects as go
+    fig = go.Figure()
+    
+    fig.add_trace(go.Histogram(
+        x=stats['datos'],
+        name='Distribucion Historica',
+        marker_color='rgba(99, 110, 250, 0.6)',
+        nbinsx=30
+    ))
+    
+    fig.add_vline(
+        x=importe_cm,
+        line_dash="dash",
+        line_color="#E31E24",
+        line_width=3,
+        annotation_text=f"Consulta: ${importe_cm:,.0f}",
+        annotation_position="top"
+    )
+    
+    fig.add_vline(
+        x=stats['promedio'],
+        line_dash="dot",
+        line_color="#4CAF50",
+        line_width=2,
+        annotation_text=f"Promedio: ${stats['promedio']:,.0f}",
+        annotation_position="bottom"
+    )
+    
+    fig.update_layout(
+        title=titulo,
+        xaxis_title="Importe (CM)",
+        yaxis_title="Frecuencia",
+        template="plotly_dark",
+        height=400,
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)'
+    )
+    
+    return fig
+
+def crear_boxplot_consulta(stats, importe_cm):
+    """Crea boxplot del historico con la posicion del importe consultado"""
+    import plotly.graph_objects as go
+    
+    fig = go.Figure()
+    fig.add_trace(go.Box(
+        y=stats['datos'],
+        name='CM',
+        marker_color='#636EFA',
+        boxmean='sd'
+    ))
+    fig.add_scatter(
+        x=[0],
+        y=[importe_cm],
+        mode='markers',
+        marker=dict(size=15, color='#E31E24', symbol='star'),
+        name='Consulta'
+    )
+    fig.update_layout(
+        title="Boxplot con Posicion de Consulta",
+        yaxis_title="Costo Medico (CM)",
+        template="plotly_dark",
+        height=400,
+        showlegend=True,
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)'
+    )
+    
+    return fig
+
+def crear_grafico_boxplot(df_prestador):
+    """Crea boxplot comparativo de prestaciones"""
+    import plotly.graph_objects as go
+    
+    df_plot = df_prestador[df_prestador['CM'].notna()].copy()
+    top_prestaciones = df_plot.groupby('Prestacion', observed=True)['CM'].sum().nlargest(10).index.tolist()
+    df_top = df_plot[df_plot['Prestacion'].isin(top_prestaciones)]
+    
+    fig = go.Figure()
+    
+    for prestacion in top_prestaciones:
+        data = df_top[df_top['Prestacion'] == prestacion]['CM']
+        fig.add_trace(go.Box(
+            y=data,
+            name=prestacion[:40],
+            boxmean='sd'
+        ))
+    
+    fig.update_layout(
+        title="Distribucion de Costos por Prestacion (Boxplot)",
+        yaxis_title="Costo Medico (CM)",
+        template="plotly_dark",
+        height=500,
+        showlegend=True,
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)'
+    )
+    
+    return fig
+
+def crear_tabla_resumen(df_prestador):
+    """Crea tabla resumen de prestaciones"""
+    
+    df_plot, prestaciones = agrupar(df_prestador[df_prestador['CM'].notna()], ['Prestacion'])
+    cm = df_plot['CM'].to_numpy(dtype=float)
+    pu = df_plot['PU'].to_numpy(dtype=float)
+    
+    resumen = pd.DataFrame({
+        'N_Registros': conteo(prestaciones, cm),
+        'CM_Total': suma(prestaciones, cm),
+        'CM_Promedio': media(prestaciones, cm),
+        'CM_Std': desvio(prestaciones, cm),
+        'CM_Min': minimo(prestaciones, cm),
+        'CM_Max': maximo(prestaciones, cm),
+        'PU_Promedio': media(prestaciones, pu),
+        'Q_Total': suma(prestaciones, df_plot['Q']).astype(df_plot['Q'].dtype)
+    }, index=pd.Index(df_plot['Prestacion'].iloc[prestaciones.inicios], name='Prestacion')).round(2)
+    
+    # Variacion de PU entre el primer y el ultimo registro de cada prestacion
+    pu_inicial = primero(prestaciones, pu)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variacion_pu = (ultimo(prestaciones, pu) - pu_inicial) / pu_inicial * 100
+    resumen['Variacion_PU_%'] = np.where(prestaciones.largos > 1, variacion_pu, 0).round(1)
+    
+    resumen = resumen.sort_values('CM_Total', ascending=False)
+    
+    return resumen.head(20)
+
+def crear_heatmap_temporal(df_prestador):
+    """Crea heatmap de actividad temporal"""
+    import plotly.graph_objects as go
+    
+    df_plot = df_prestador[df_prestador['CM'].notna()].copy()
+    df_plot['Año'] = df_plot['MesFecha'].dt.year
+    df_plot['Mes'] = df_plot['MesFecha'].dt.month
+    
+    # Top 10 prestaciones
+    top_prestaciones = df_plot.groupby('Prestacion', observed=True)['CM'].sum().nlargest(10).index.tolist()
+    df_top = df_plot[df_plot['Prestacion'].isin(top_prestaciones)]
+    
+    # Pivot para heatmap
+    pivot = df_top.pivot_table(
+        values='CM',
+        index='Prestacion',
+        columns='MesFecha',
+        aggfunc='sum',
+        fill_value=0,
+        observed=True
+    )
+    
+    fig = go.Figure(data=go.Heatmap(
+        z=pivot.values,
+        x=pivot.columns.strftime('%Y-%m'),
+        y=[p[:40] for p in pivot.index],
+        colorscale='Reds',
+        hovertemplate='Prestacion: %{y}<br>Mes: %{x}<br>CM: $%{z:,.0f}<extra></extra>'
+    ))
+    
+    fig.update_layout(
+        title="Heatmap de Actividad por Prestacion y Mes",
+        xaxis_title="Mes",
+        yaxis_title="Prestacion",
+        template="plotly_dark",
+        height=600,
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)'
+    )
+    
+    return fig
+
+def crear_grafico_variaciones(df_var, prestador):
+    """Crea grafico de barras con las 20 mayores variaciones de PU"""
+    import plotly.graph_objects as go
+    
+    df_plot = df_var.head(20)
+    
+    fig = go.Figure()
+    
+    colors = ['#E31E24' if v > 0 else '#4CAF50' for v in df_plot['Variacion_Pct']]
+    
+    fig.add_trace(go.Bar(
+        x=df_plot['Variacion_Pct'],
+        y=[p[:50] for p in df_plot['Prestacion']],
+        orientation='h',
+        marker_color=colors,
+        text=[f"{v:+.1f}%" for v in df_plot['Variacion_Pct']],
+        textposition='auto',
+        hovertemplate='<b>%{y}</b><br>Variacion: %{x:+.1f}%<extra></extra>'
+    ))
+    
+    fig.update_layout(
+        title=f"Top 20 Variaciones de Precio - {prestador}",
+        xaxis_title="Variacion Porcentual (%)",
+        yaxis_title="Prestacion",
+        template="plotly_dark",
+        height=max(600, len(df_plot) * 30),
+        showlegend=False,
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)'
+    )
+    
+    fig.update_yaxes(autorange="reversed")
+    
+    return fig
+
+def crear_grafico_comparacion_precios(df_var):
+    """Crea grafico de PU inicial vs final de las 15 mayores variaciones"""
+    import plotly.graph_objects as go
+    
+    fig = go.Figure()
+    
+    df_plot = df_var.head(15)
+    
+    fig.add_trace(go.Bar(
+        name='Precio Inicial',
+        x=[p[:40] for p in df_plot['Prestacion']],
+        y=df_plot['PU_Inicial'],
+        marker_color='#636EFA'
+    ))
+    
+    fig.add_trace(go.Bar(
+        name='Precio Final',
+        x=[p[:40] for p in df_plot['Prestacion']],
+        y=df_plot['PU_Final'],
+        marker_color='#E31E24'
+    ))
+    
+    fig.update_layout(
+        title=f"Comparacion de Precios - Top 15 Variaciones",
+        xaxis_title="Prestacion",
+        yaxis_title="Precio Unitario ($)",
+        template="plotly_dark",
+        height=500,
+        barmode='group',
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)'
+    )
+    
+    return fig
+
+def calcular_metricas_prestador(df_prestador):
+    """Calcula las metricas generales del prestador"""
+    return {
+        'prestaciones_unicas': int(df_prestador['Prestacion'].nunique()),
+        'total_registros': int(len(df_prestador)),
+        'cm_total': float(df_prestador['CM'].sum()),
+        'cm_promedio': float(df_prestador['CM'].mean()),
+        'meses_activos': int(df_prestador['MesFecha'].nunique())
+    }
+
+def calcular_crecimiento_cm(df_prestador):
+    """Crecimiento de CM (primer vs ultimo registro valido) por prestacion"""
+    
+    df_plot, prestaciones = agrupar(df_prestador, ['Prestacion'])
+    crecimiento = df_plot['CM_Crecimiento_Acum_%']
+    
+    return pd.Series(
+        ultimo_valido(prestaciones, crecimiento).astype(crecimiento.dtype),
+        index=pd.Index(df_plot['Prestacion'].iloc[prestaciones.inicios], name='Prestacion'),
+        name='CM_Crecimiento_Acum_%'
+    ).dropna().sort_values(ascending=False)
+
+def calcular_tabla_variaciones(df_prest):
+    """Calcula la variacion de PU (primer vs ultimo registro valido) por prestacion.
+    
+    Requiere que df_prest conserve el orden por serie y mes de la base cargada.
+    """
+    validos = df_prest[df_prest['PU'].notna() & df_prest['Prestacion'].notna()]
+    prestaciones = Segmentos.desde_claves(pd.factorize(validos['Prestacion'])[0])
+    
+    df_var = pd.DataFrame({
+        'Fecha_Inicial': primero(prestaciones, validos['MesFecha']),
+        'Fecha_Final': ultimo(prestaciones, validos['MesFecha']),
+        'PU_Inicial': primero(prestaciones, validos['PU']),
+        'PU_Final': ultimo(prestaciones, validos['PU']),
+        'CM_Inicial': primero(prestaciones, validos['CM']),
+        'CM_Final': ultimo(prestaciones, validos['CM']),
+        'Q_Total': suma(prestaciones, validos['Q']).astype(validos['Q'].dtype),
+        'N_Registros': conteo(prestaciones)
+    }, index=pd.Index(validos['Prestacion'].iloc[prestaciones.inicios], name='Prestacion'))
+    df_var = df_var[df_var['N_Registros'] >= 2]
+    
+    df_var['Variacion_Abs'] = df_var['PU_Final'] - df_var['PU_Inicial']
+    df_var['Variacion_Pct'] = np.where(
+        df_var['PU_Inicial'] > 0,
+        df_var['Variacion_Abs'] / df_var['PU_Inicial'].where(df_var['PU_Inicial'] > 0) * 100,
+        0.0
+    )
+    
+    df_var = df_var.rename_axis('Prestacion').reset_index()
+    return df_var[[
+        'Prestacion', 'Fecha_Inicial', 'Fecha_Final', 'PU_Inicial', 'PU_Final',
+        'Variacion_Abs', 'Variacion_Pct', 'CM_Inicial', 'CM_Final', 'Q_Total', 'N_Registros'
+    ]]
+
+# ============================================
+# CONSTRUCCION PARALELA DEL DASHBOARD
+# ============================================
+
+TAREAS_DASHBOARD = {
+    'evolucion': crear_grafico_evolucion_cm,
+    'variacion_pu': crear_grafico_variacion_pu,
+    'heatmap': crear_heatmap_temporal,
+    'boxplot': crear_grafico_boxplot,
+    'resumen': crear_tabla_resumen,
+    'insights': calcular_crecimiento_cm
+}
+
+def construir_dashboard(df_prestador, max_workers=len(TAREAS_DASHBOARD)):
+    """Construye las secciones del dashboard en paralelo.
+    
+    Genera tuplas (seccion, resultado) en el orden en que se completan,
+    de modo que cada seccion pueda mostrarse apenas esta lista.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futuros = {
+            executor.submit(tarea, df_prestador): seccion
+            for seccion, tarea in TAREAS_DASHBOARD.items()
+        }
+        for futuro in as_completed(futuros):
+            yield futuros[futuro], futuro.result()
@@ -0,0 +1,352 @@
+"""Perfiles de facturacion de prestadores: similitud, grupos y atipicos.
+
+Cada prestador se describe con una fila dispersa sobre los Cod prestacion
+que factura, con tres valores por codigo: su parte del CM total del
+prestador, su parte de la cantidad (Q) y el nivel de PU relativo a la
+mediana de los prestadores del mismo codigo (en log). La matriz se guarda
+en formato CSR (offsets por fila, columnas y valores) con las filas
+normalizadas, de modo que el producto escalar entre dos filas es su
+similitud coseno.
+
+Sobre la matriz se calcula una vez por version de la base:
+- la similitud entre todos los prestadores, por bloques de columnas en
+  paralelo (producto disperso por denso);
+- grupos de prestadores con k-means esferico (varios inicios en paralelo);
+- la atipicidad de cada prestador dentro de su grupo.
+
+Las consultas del dashboard son lecturas de estas tablas.
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from motor_auditoria import RUTA_BASE
+from almacenamiento import asegurar_particiones, cargar_particiones, dir_version
+
+COLUMNAS_PERFIL = ['ID', 'Cod prestacion', 'Q', 'CM', 'PU']
+
+# Peso de cada componente del perfil en la similitud
+PESOS_PERFIL = {'cm': 1.0, 'q': 1.0, 'pu': 0.5}
+COMPONENTES = list(PESOS_PERFIL)
+
+# Cota del log del PU relativo, para que un codigo con precio extremo no domine la fila
+LIMITE_PU_RELATIVO = 3.0
+
+N_GRUPOS = 12
+N_INICIOS = 8
+MAX_ITERACIONES = 100
+SEMILLA = 0
+
+N_VECINOS = 10
+
+# Desvios robustos (MAD) por debajo de la similitud mediana del grupo
+UMBRAL_ATIPICO = 3.0
+
+TAMANO_BLOQUE = 64
+TRABAJADORES = os.cpu_count() or 1
+
+# ============================================
+# MATRIZ DISPERSA
+# ============================================
+
+class MatrizDispersa:
+    """Matriz CSR: offsets de cada fila en indices/valores"""
+
+    def __init__(self, indptr, indices, valores, n_columnas):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.valores = np.asarray(valores, dtype=float)
+        self.n_columnas = int(n_columnas)
+
+    @classmethod
+    def desde_coordenadas(cls, filas, columnas, valores, n_filas, n_columnas):
+        """Matriz a partir de coordenadas ordenadas por fila (se descartan los ceros)"""
+        no_nulos = valores != 0
+        filas = np.asarray(filas)[no_nulos]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(filas, minlength=n_filas))])
+        return cls(indptr, np.asarray(columnas)[no_nulos], np.asarray(valores)[no_nulos], n_columnas)
+
+    @property
+    def n_filas(self):
+        return len(self.indptr) - 1
+
+    @property
+    def filas(self):
+        """Fila de cada valor no nulo"""
+        return np.repeat(np.arange(self.n_filas), np.diff(self.indptr))
+
+    def normalizar(self):
+        """Copia con cada fila de norma 1 (las filas nulas quedan nulas)"""
+        normas = np.sqrt(np.bincount(self.filas, weights=self.valores ** 2, minlength=self.n_filas))
+        return MatrizDispersa(self.indptr, self.indices, self.valores / normas[self.filas], self.n_columnas)
+
+    def densa(self, filas):
+        """Bloque denso de las filas indicadas"""
+        filas = np.asarray(filas)
+        largos = np.diff(self.indptr)[filas]
+        posiciones = np.repeat(self.indptr[filas] - np.cumsum(largos) + largos, largos) + np.arange(largos.sum())
+        bloque = np.zeros((len(filas), self.n_columnas))
+        bloque[np.repeat(np.arange(len(filas)), largos), self.indices[posiciones]] = self.valores[posiciones]
+        return bloque
+
+    def producto(self, densa):
+        """Producto por una matriz densa de n_columnas filas"""
+        resultado = np.zeros((self.n_filas, densa.shape[1]))
+        no_vacias = np.diff(self.indptr) > 0
+        if no_vacias.any():
+            aportes = self.valores[:, None] * densa[self.indices]
+            resultado[no_vacias] = np.add.reduceat(aportes, self.indptr[:-1][no_vacias], axis=0)
+        return resultado
+
+    def sumar_por_grupo(self, grupo, n_grupos):
+        """Suma de las filas de cada grupo, como matriz densa"""
+        sumas = np.zeros((n_grupos, self.n_columnas))
+        np.add.at(sumas, (grupo[self.filas], self.indices), self.valores)
+        return sumas
+
+# ============================================
+# PERFILES
+# ============================================
+
+def construir_perfiles(df):
+    """Matriz de perfiles normalizada y el resumen por prestador.
+
+    Las columnas de la matriz son codigo * 3 + componente (ver COMPONENTES).
+    Solo tienen fila los prestadores con algun CM o Q positivo.
+    """
+    validos = df[df['ID'].notna() & df['Cod prestacion'].notna()]
+    celdas = pd.DataFrame({
+        'ID': validos['ID'],
+        'Cod': validos['Cod prestacion'],
+        # Las notas de credito no forman parte del perfil de facturacion
+        'CM': validos['CM'].clip(lower=0),
+        'Q': validos['Q'].astype(float).clip(lower=0),
+        'PU': validos['PU'].where(validos['PU'] > 0)
+    }).groupby(['ID', 'Cod'], observed=True).agg(
+        CM=('CM', 'sum'), Q=('Q', 'sum'), PU=('PU', 'median')
+    ).reset_index()
+    celdas['ID'] = celdas['ID'].astype(str)
+    celdas['Cod'] = celdas['Cod'].astype(str)
+
+    total_cm = celdas.groupby('ID')['CM'].transform('sum')
+    total_q = celdas.groupby('ID')['Q'].transform('sum')
+    celdas = celdas[(total_cm > 0) | (total_q > 0)].sort_values(['ID', 'Cod'], kind='mergesort').reset_index(drop=True)
+
+    prestadores, fila = np.unique(celdas['ID'].to_numpy(), return_inverse=True)
+    codigos, columna = np.unique(celdas['Cod'].to_numpy(), return_inverse=True)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        componentes = {
+            'cm': (celdas['CM'] / celdas.groupby('ID')['CM'].transform('sum')).fillna(0).to_numpy(),
+            'q': (celdas['Q'] / celdas.groupby('ID')['Q'].transform('sum')).fillna(0).to_numpy(),
+            'pu': np.log(celdas['PU'] / celdas.groupby('Cod')['PU'].transform('median'))
+                  .clip(-LIMITE_PU_RELATIVO, LIMITE_PU_RELATIVO).fillna(0).to_numpy()
+        }
+
+    # Cada componente se normaliza por separado y se pondera, de modo que la
+    # similitud es el promedio ponderado de las similitudes de cada componente
+    valores = np.zeros((len(celdas), len(COMPONENTES)))
+    for c, nombre in enumerate(COMPONENTES):
+        norma = np.sqrt(np.bincount(fila, weights=componentes[nombre] ** 2, minlength=len(prestadores)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            valores[:, c] = np.nan_to_num(componentes[nombre] / norma[fila]) * np.sqrt(PESOS_PERFIL[nombre])
+
+    perfiles = MatrizDispersa.desde_coordenadas(
+        np.repeat(fila, len(COMPONENTES)),
+        (columna[:, None] * len(COMPONENTES) + np.arange(len(COMPONENTES))).ravel(),
+        valores.ravel(),
+        len(prestadores),
+        len(codigos) * len(COMPONENTES)
+    ).normalizar()
+
+    # Codigo con mayor CM de cada prestador (o mayor Q si no tiene CM)
+    orden = np.lexsort((-componentes['q'], -componentes['cm'], fila))
+    principal = orden[np.searchsorted(fila[orden], np.arange(len(prestadores)))]
+
+    resumen = pd.DataFrame({
+        'ID': prestadores,
+        'N_Codigos': np.bincount(fila, minlength=len(prestadores)),
+        'CM_Total': np.bincount(fila, weights=celdas['CM'], minlength=len(prestadores)),
+        'Cod_Principal': codigos[columna[principal]]
+    })
+    return perfiles, codigos, resumen
+
+def matriz_similitud(perfiles, trabajadores=TRABAJADORES, tamano_bloque=TAMANO_BLOQUE):
+    """Similitud coseno entre todas las filas, por bloques de columnas en paralelo"""
+    n = perfiles.n_filas
+    similitud = np.zeros((n, n))
+
+    def calcular_bloque(inicio):
+        filas = np.arange(inicio, min(inicio + tamano_bloque, n))
+        similitud[:, filas] = perfiles.producto(perfiles.densa(filas).T)
+
+    with ThreadPoolExecutor(max_workers=trabajadores) as executor:
+        list(executor.map(calcular_bloque, range(0, n, tamano_bloque)))
+    return np.clip(similitud, -1.0, 1.0)
+
+# ============================================
+# GRUPOS
+# ============================================
+
+def _kmeans_esferico(perfiles, n_grupos, semilla):
+    """Una corrida de k-means con similitud coseno e inicio k-means++"""
+    rng = np.random.default_rng(semilla)
+    n = perfiles.n_filas
+
+    elegidos = [int(rng.integers(n))]
+    distancia = 1 - perfiles.producto(perfiles.densa(elegidos).T)[:, 0]
+    for _ in range(1, n_grupos):
+        pesos = np.clip(distancia, 0, None)
+        elegido = int(rng.choice(n, p=pesos / pesos.sum())) if pesos.sum() > 0 else int(rng.integers(n))
+        elegidos.append(elegido)
+        distancia = np.minimum(distancia, 1 - perfiles.producto(perfiles.densa([elegido]).T)[:, 0])
+
+    centros = perfiles.densa(elegidos)
+    grupo = None
+    for _ in range(MAX_ITERACIONES):
+        similitud = perfiles.producto(centros.T)
+        nuevo = similitud.argmax(axis=1)
+        if grupo is not None and (nuevo == grupo).all():
+            break
+        grupo = nuevo
+
+        sumas = perfiles.sumar_por_grupo(grupo, n_grupos)
+        normas = np.linalg.norm(sumas, axis=1)
+        # Un grupo que quedo vacio conserva su centro anterior
+        ocupados = normas > 0
+        centros[ocupados] = sumas[ocupados] / normas[ocupados, None]
+
+    cohesion = similitud[np.arange(n), grupo].sum()
+    return cohesion, grupo, centros
+
+def agrupar_perfiles(perfiles, n_grupos=N_GRUPOS, n_inicios=N_INICIOS, trabajadores=TRABAJADORES):
+    """Grupos de prestadores (numerados por tamaño decreciente) y sus centros.
+
+    Se corren n_inicios inicializaciones en paralelo y se queda la de mayor
+    similitud total de cada prestador con su centro.
+    """
+    n_grupos = min(n_grupos, perfiles.n_filas)
+    with ThreadPoolExecutor(max_workers=trabajadores) as executor:
+        corridas = list(executor.map(
+            lambda semilla: _kmeans_esferico(perfiles, n_grupos, semilla),
+            range(SEMILLA, SEMILLA + n_inicios)
+        ))
+    _, grupo, centros = max(corridas, key=lambda corrida: corrida[0])
+
+    orden = np.argsort(-np.bincount(grupo, minlength=n_grupos), kind='stable')
+    numero = np.empty(n_grupos, dtype=np.int64)
+    numero[orden] = np.arange(n_grupos)
+    return numero[grupo], centros[orden]
+
+def puntaje_atipico(grupo, similitud_grupo):
+    """Desvios robustos de cada prestador por debajo de la similitud mediana de su grupo"""
+    tabla = pd.DataFrame({'grupo': grupo, 'similitud': similitud_grupo})
+    mediana = tabla.groupby('grupo')['similitud'].transform('median')
+    mad = (tabla['similitud'] - mediana).abs().groupby(tabla['grupo']).transform('median') * 1.4826
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(mad > 0, (mediana - tabla['similitud']) / mad, 0.0)
+
+# ============================================
+# INDICE
+# ============================================
+
+class PerfilesPrestadores:
+    """Similitud entre prestadores, grupos y atipicos de una version de la base.
+
+    tabla tiene una fila por prestador con perfil: grupo, similitud con el
+    centro del grupo, puntaje de atipicidad y su vecino mas similar.
+    """
+
+    def __init__(self, df, n_grupos=N_GRUPOS, trabajadores=TRABAJADORES):
+        self.perfiles, self.codigos, resumen = construir_perfiles(df)
+        self.prestadores = resumen['ID'].to_numpy()
+        self._filas = {p: i for i, p in enumerate(self.prestadores)}
+
+        self.similitud = matriz_similitud(self.perfiles, trabajadores)
+        grupo, self.centros = agrupar_perfiles(self.perfiles, n_grupos, trabajadores=trabajadores)
+
+        # Vecinos precalculados: las consultas solo leen estas filas
+        sin_propio = self.similitud.copy()
+        np.fill_diagonal(sin_propio, -np.inf)
+        self.vecinos = np.argsort(-sin_propio, axis=1, kind='stable')[:, :N_VECINOS]
+
+        n = len(self.prestadores)
+        similitud_grupo = self.perfiles.producto(self.centros.T)[np.arange(n), grupo]
+        tabla = resumen.assign(
+            Grupo=grupo + 1,
+            Tamano_Grupo=np.bincount(grupo, minlength=len(self.centros))[grupo],
+            Similitud_Grupo=similitud_grupo,
+            Puntaje_Atipico=puntaje_atipico(grupo, similitud_grupo)
+        )
+        tabla['Atipico'] = tabla['Puntaje_Atipico'] >= UMBRAL_ATIPICO
+        if n > 1:
+            tabla['Vecino_Mas_Similar'] = self.prestadores[self.vecinos[:, 0]]
+            tabla['Similitud_Vecino'] = self.similitud[np.arange(n), self.vecinos[:, 0]]
+        self.tabla = tabla
+
+    def _codigos_fila(self, i):
+        return set(self.perfiles.indices[self.perfiles.indptr[i]:self.perfiles.indptr[i + 1]] // len(COMPONENTES))
+
+    def de_prestador(self, prestador, n=N_VECINOS):
+        """Fila del prestador en tabla y sus n prestadores mas similares (None si no tiene perfil)"""
+        i = self._filas.get(str(prestador))
+        if i is None:
+            return None, None
+
+        vecinos = self.vecinos[i, :n]
+        propios = self._codigos_fila(i)
+        similares = self.tabla.iloc[vecinos][['ID', 'Grupo', 'N_Codigos', 'CM_Total', 'Cod_Principal']].copy()
+        similares.insert(1, 'Similitud', self.similitud[i, vecinos])
+        similares.insert(4, 'Codigos_Comunes', [len(propios & self._codigos_fila(j)) for j in vecinos])
+        return self.tabla.iloc[i], similares.reset_index(drop=True)
+
+    def atipicos(self):
+        """Prestadores atipicos en su grupo, del mas al menos atipico"""
+        return self.tabla[self.tabla['Atipico']].sort_values('Puntaje_Atipico', ascending=False)
+
+    def resumen_grupos(self, n_codigos=3):
+        """Tamaño, CM, cohesion y codigos principales (por peso en el centro) de cada grupo"""
+        resumen = self.tabla.groupby('Grupo').agg(
+            Prestadores=('ID', 'size'),
+            CM_Total=('CM_Total', 'sum'),
+            Similitud_Media=('Similitud_Grupo', 'mean'),
+            Atipicos=('Atipico', 'sum')
+        )
+        peso_cm = self.centros[:, COMPONENTES.index('cm')::len(COMPONENTES)]
+        principales = np.argsort(-peso_cm, axis=1, kind='stable')[:, :n_codigos]
+        resumen['Codigos_Principales'] = [', '.join(self.codigos[fila]) for fila in principales[resumen.index - 1]]
+        return resumen
+
+# ============================================
+# REPORTE GLOBAL
+# ============================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Grupos de prestadores por perfil de facturacion y atipicos")
+    parser.add_argument('--base', default=RUTA_BASE, help="Ruta de la base unificada")
+    parser.add_argument('--grupos', type=int, default=N_GRUPOS, help="Cantidad de grupos")
+    parser.add_argument('--salida', default='perfiles_prestadores.csv', help="CSV con el grupo de cada prestador")
+    args = parser.parse_args()
+
+    manifiesto = asegurar_particiones(args.base)
+    df = cargar_particiones(columnas=COLUMNAS_PERFIL, dir_version_base=dir_version(manifiesto['firma_origen']))
+
+    inicio = time.perf_counter()
+    perfiles = PerfilesPrestadores(df, args.grupos)
+    segundos = time.perf_counter() - inicio
+
+    perfiles.tabla.to_csv(args.salida, index=False)
+
+    print(f"Prestadores: {len(perfiles.prestadores)} | codigos: {len(perfiles.codigos)} | "
+          f"valores no nulos: {len(perfiles.perfiles.valores):,} | atipicos: {int(perfiles.tabla['Atipico'].sum())} | "
+          f"calculo: {segundos:.1f}s")
+    print(perfiles.resumen_grupos().to_string())
+    print(perfiles.atipicos().head(10).to_string())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""Procesamiento por bloques para bases que no entran en memoria.
+
+Calcula los resultados pesados de la app (tabla resumen por prestador, tabla
+de variaciones, metricas globales del sidebar y lineas base de anomalias)
+sin cargar la base completa:
+
+1. La base se lee por bloques de filas. Cada bloque suma sus parciales a las
+   metricas globales y se derrama a disco en cubetas por prestador.
+2. Las cubetas se agrupan en lotes que respetan la memoria maxima y cada lote
+   se procesa con las mismas funciones que el camino en memoria.
+
+Como un prestador queda completo dentro de una cubeta, los resultados por
+prestador y por serie coinciden exactamente con los del camino en memoria.
+
+Uso:
+
+    python procesamiento_bloques.py --memoria-max 512 --salida resultados_bloques
+    python procesamiento_bloques.py --memoria-max 256 --verificar
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from motor_auditoria import (
+    RUTA_BASE,
+    DTYPES_CSV,
+    COLUMNAS_METADATOS,
+    leer_base,
+    tipar_base,
+    agregar_metricas_derivadas,
+    compactar_base,
+    cantidades_enteras,
+    crear_tabla_resumen,
+    calcular_tabla_variaciones,
+    calcular_lineas_base
+)
+
+MEMORIA_MAX_MB = 512
+N_CUBETAS = 64
+DIR_TEMPORAL = 'bloques.tmp'
+
+# Copias intermedias de un lote mientras se procesa (lectura, orden,
+# metricas derivadas y agregaciones)
+FACTOR_TRABAJO = 6
+
+# Columna auxiliar con la posicion de cada fila en la base original
+COLUMNA_FILA = '_fila'
+
+# ============================================
+# METRICAS GLOBALES (PARCIALES COMBINABLES)
+# ============================================
+
+def metricas_globales_vacias():
+    return {
+        'registros': 0,
+        'prestadores': set(),
+        'prestaciones': set(),
+        'meses': set(),
+        'metadatos': {col: set() for col in COLUMNAS_METADATOS},
+        'q_entera': True
+    }
+
+def acumular_metricas_globales(parcial, bloque):
+    """Suma un bloque de filas a las metricas globales parciales"""
+    parcial['registros'] += len(bloque)
+    parcial['prestadores'].update(bloque['ID'].dropna().astype(str).unique())
+    parcial['prestaciones'].update(bloque['Prestacion'].dropna().astype(str).unique())
+    parcial['meses'].update(bloque['MesFecha'].dropna().unique())
+    for col in COLUMNAS_METADATOS:
+        if col in bloque.columns:
+            parcial['metadatos'][col].update(bloque[col].dropna().unique())
+            if bloque[col].isna().any():
+                parcial['metadatos'][col].add(None)
+    parcial['q_entera'] = parcial['q_entera'] and cantidades_enteras(bloque['Q'])
+    return parcial
+
+def combinar_metricas_globales(a, b):
+    """Combina dos parciales de metricas globales"""
+    return {
+        'registros': a['registros'] + b['registros'],
+        'prestadores': a['prestadores'] | b['prestadores'],
+        'prestaciones': a['prestaciones'] | b['prestaciones'],
+        'meses': a['meses'] | b['meses'],
+        'metadatos': {col: a['metadatos'][col] | b['metadatos'][col] for col in COLUMNAS_METADATOS},
+        'q_entera': a['q_entera'] and b['q_entera']
+    }
+
+def finalizar_metricas_globales(parcial):
+    """Metricas del sidebar a partir de los parciales acumulados"""
+    meses = sorted(pd.Timestamp(m) for m in parcial['meses'])
+    return {
+        'registros': parcial['registros'],
+        'prestadores': len(parcial['prestadores']),
+        'prestaciones': len(parcial['prestaciones']),
+        'meses': len(meses),
+        'fecha_min': meses[0].strftime('%Y-%m-%d') if meses else None,
+        'fecha_max': meses[-1].strftime('%Y-%m-%d') if meses else None,
+        'metadatos_carga': {
+            col: next(iter(valores))
+            for col, valores in parcial['metadatos'].items()
+            if len(valores) == 1
+        }
+    }
+
+def esquema_global(parcial):
+    """Decisiones de compactar_base que dependen de toda la base"""
+    return {
+        'metadatos_constantes': [col for col, valores in parcial['metadatos'].items() if len(valores) == 1],
+        'q_entera': parcial['q_entera']
+    }
+
+def calcular_metricas_globales(df):
+    """Metricas globales sobre una base completa en memoria.
+
+    Los metadatos constantes que compactar_base separo se toman de df.attrs.
+    """
+    metricas = finalizar_metricas_globales(acumular_metricas_globales(metricas_globales_vacias(), df))
+    metricas['metadatos_carga'].update(df.attrs.get('metadatos_carga', {}))
+    return metricas
+
+# ============================================
+# TABLAS POR PRESTADOR
+# ============================================
+
+def _a_texto(df):
+    # Las categorias dependen de las filas cargadas: se comparan como texto
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str)
+    return df
+
+def calcular_tablas(df):
+    """Tabla resumen, tabla de variaciones y lineas base de prestadores completos.
+
+    df debe contener todas las filas de cada prestador incluido, en el orden
+    de leer_base.
+    """
+    resumenes, variaciones = [], []
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for prestador, df_prestador in df.groupby('ID', sort=True, observed=True):
+            resumen = crear_tabla_resumen(df_prestador).reset_index()
+            resumen.insert(0, 'ID', str(prestador))
+            resumenes.append(_a_texto(resumen))
+
+            variacion = calcular_tabla_variaciones(df_prestador)
+            variacion.insert(0, 'ID', str(prestador))
+            variaciones.append(_a_texto(variacion))
+
+    lineas_base = _a_texto(calcular_lineas_base(df).reset_index())
+
+    return {
+        'resumen': pd.concat(resumenes, ignore_index=True) if resumenes else pd.DataFrame(),
+        'variaciones': pd.concat(variaciones, ignore_index=True) if variaciones else pd.DataFrame(),
+        'lineas_base': lineas_base
+    }
+
+def _unir_tablas(partes):
+    """Une las tablas de lotes disjuntos de prestadores, ordenadas por prestador"""
+    tablas = {}
+    for nombre in ['resumen', 'variaciones', 'lineas_base']:
+        tabla = pd.concat([p[nombre] for p in partes], ignore_index=True)
+        tabla = tabla.sort_values('ID', kind='mergesort').reset_index(drop=True)
+        tablas[nombre] = tabla
+    return tablas
+
+def procesar_en_memoria(ruta=RUTA_BASE):
+    """Camino en memoria: carga la base completa y calcula todo"""
+    df = leer_base(ruta)
+    tablas = _unir_tablas([calcular_tablas(df)])
+    return {'metricas': calcular_metricas_globales(df), **tablas}
+
+# ============================================
+# PROCESAMIENTO POR BLOQUES
+# ============================================
+
+def estimar_bytes_por_fila(ruta=RUTA_BASE, muestra=2000):
+    """Memoria por fila de la base tipada, estimada sobre una muestra"""
+    df = tipar_base(pd.read_csv(ruta, compression='gzip', encoding='utf-8', dtype=DTYPES_CSV, nrows=muestra))
+    return max(int(df.memory_usage(deep=True, index=False).sum() / max(len(df), 1)), 1)
+
+class MemoriaInsuficiente(MemoryError):
+    """Una cubeta no entra en la memoria maxima; memoria_minima_mb es la necesaria"""
+
+    def __init__(self, mensaje, memoria_minima_mb):
+        super().__init__(mensaje)
+        self.memoria_minima_mb = memoria_minima_mb
+
+def _memoria_minima_mb(filas, bytes_por_fila):
+    return int(np.ceil(filas * bytes_por_fila * FACTOR_TRABAJO / 1024 ** 2))
+
+def planificar_lotes(filas_por_cubeta, bytes_por_fila, memoria_max, filas_por_prestador=None):
+    """Agrupa las cubetas en lotes cuyo procesamiento entra en memoria_max bytes.
+
+    Si la cubeta mas grande no entra lanza MemoriaInsuficiente con la memoria
+    minima necesaria. Con filas_por_prestador el mensaje indica tambien el
+    minimo alcanzable con mas cubetas (un prestador nunca se divide).
+    """
+    capacidad = memoria_max // (bytes_por_fila * FACTOR_TRABAJO)
+
+    cubeta_max, filas_max = max(filas_por_cubeta.items(), key=lambda item: item[1], default=(None, 0))
+    if filas_max > capacidad:
+        minima = _memoria_minima_mb(filas_max, bytes_por_fila)
+        mensaje = (
+            f"La cubeta {cubeta_max} ({filas_max:,} filas) no entra en la memoria maxima de "
+            f"{memoria_max / 1024 ** 2:,.0f} MB: con esta cantidad de cubetas se necesitan "
+            f"al menos {minima:,} MB"
+        )
+        if filas_por_prestador:
+            prestador, filas = max(filas_por_prestador.items(), key=lambda item: item[1])
+            minima_prestador = _memoria_minima_mb(filas, bytes_por_fila)
+            if minima_prestador < minima:
+                mensaje += f"; con mas cubetas el minimo baja a {minima_prestador:,} MB"
+            mensaje += f" (el prestador {prestador} tiene {filas:,} filas y no se divide)"
+        raise MemoriaInsuficiente(mensaje, minima)
+
+    lotes, actual, filas_actual = [], [], 0
+    for cubeta, filas in sorted(filas_por_cubeta.items()):
+        if filas_actual + filas > capacidad and actual:
+            lotes.append(actual)
+            actual, filas_actual = [], 0
+        actual.append(cubeta)
+        filas_actual += filas
+
+    if actual:
+        lotes.append(actual)
+    return lotes
+
+def _cubetas(ids, n_cubetas):
+    # crc32 por prestador (estable entre procesos y corridas)
+    codigos, unicos = pd.factorize(ids.astype(str))
+    por_prestador = np.array([zlib.crc32(p.encode('utf-8')) % n_cubetas for p in unicos], dtype=np.int64)
+    return por_prestador[codigos]
+
+def derramar_bloques(ruta, filas_bloque, n_cubetas, dir_temporal):
+    """Lee la base por bloques, acumula las metricas globales y derrama filas por cubeta"""
+    parcial = metricas_globales_vacias()
+    filas_por_cubeta = {}
+    filas_por_prestador = pd.Series(dtype=np.int64)
+    inicio = 0
+
+    lector = pd.read_csv(ruta, compression='gzip', encoding='utf-8', dtype=DTYPES_CSV, chunksize=filas_bloque)
+    for n_bloque, bloque in enumerate(lector):
+        bloque = tipar_base(bloque)
+        bloque[COLUMNA_FILA] = np.arange(inicio, inicio + len(bloque), dtype=np.int64)
+        inicio += len(bloque)
+
+        parcial = combinar_metricas_globales(
+            parcial, acumular_metricas_globales(metricas_globales_vacias(), bloque)
+        )
+        filas_por_prestador = filas_por_prestador.add(bloque['ID'].astype(str).value_counts(), fill_value=0)
+
+        cubetas = _cubetas(bloque['ID'], n_cubetas)
+        for cubeta in np.unique(cubetas):
+            parte = bloque[cubetas == cubeta]
+            destino = os.path.join(dir_temporal, f'cubeta={cubeta:03d}')
+            os.makedirs(destino, exist_ok=True)
+            parte.to_parquet(os.path.join(destino, f'bloque_{n_bloque:06d}.parquet'), index=False)
+            filas_por_cubeta[int(cubeta)] = filas_por_cubeta.get(int(cubeta), 0) + len(parte)
+
+    return parcial, filas_por_cubeta, filas_por_prestador.astype(np.int64).to_dict()
+
+def leer_lote(cubetas, dir_temporal):
+    """Reconstruye las filas de un lote de cubetas, en el orden de la base y
+    con las metricas derivadas (sin compactar)"""
+    partes = []
+    for cubeta in cubetas:
+        origen = os.path.join(dir_temporal, f'cubeta={cubeta:03d}')
+        for archivo in sorted(os.listdir(origen)):
+            partes.append(pd.read_parquet(os.path.join(origen, archivo)))
+
+    df = pd.concat(partes, ignore_index=True)
+    df = df.sort_values(COLUMNA_FILA, kind='mergesort').drop(columns=COLUMNA_FILA).reset_index(drop=True)
+    return agregar_metricas_derivadas(df)
+
+def preparar_lotes(ruta=RUTA_BASE, memoria_max_mb=MEMORIA_MAX_MB, n_cubetas=N_CUBETAS, dir_temporal=DIR_TEMPORAL):
+    """Derrama la base en dir_temporal (que debe existir) y planifica los lotes.
+
+    Devuelve (parcial, lotes, plan): las metricas globales parciales, las
+    cubetas de cada lote (para leer_lote) y el resumen del plan.
+    """
+    memoria_max = int(memoria_max_mb * 1024 ** 2)
+    bytes_por_fila = estimar_bytes_por_fila(ruta)
+    filas_bloque = max(memoria_max // (bytes_por_fila * FACTOR_TRABAJO), 1000)
+
+    parcial, filas_por_cubeta, filas_por_prestador = derramar_bloques(ruta, filas_bloque, n_cubetas, dir_temporal)
+    lotes = planificar_lotes(filas_por_cubeta, bytes_por_fila, memoria_max, filas_por_prestador)
+
+    return parcial, lotes, {
+        'memoria_max_mb': memoria_max_mb,
+        'bytes_por_fila': bytes_por_fila,
+        'filas_bloque': int(filas_bloque),
+        'cubetas': len(filas_por_cubeta),
+        'lotes': len(lotes)
+    }
+
+def procesar_por_bloques(ruta=RUTA_BASE, memoria_max_mb=MEMORIA_MAX_MB, n_cubetas=N_CUBETAS,
+                         dir_temporal=DIR_TEMPORAL):
+    """Camino por bloques: mismos resultados que procesar_en_memoria con memoria acotada"""
+    shutil.rmtree(dir_temporal, ignore_errors=True)
+    os.makedirs(dir_temporal)
+    try:
+        parcial, lotes, plan = preparar_lotes(ruta, memoria_max_mb, n_cubetas, dir_temporal)
+        esquema = esquema_global(parcial)
+        partes = [
+            calcular_tablas(compactar_base(leer_lote(lote, dir_temporal), **esquema)[0])
+            for lote in lotes
+        ]
+    finally:
+        shutil.rmtree(dir_temporal, ignore_errors=True)
+
+    return {
+        'metricas': finalizar_metricas_globales(parcial),
+        **_unir_tablas(partes),
+        'plan': plan
+    }
+
+# ============================================
+# VERIFICACION Y CLI
+# ============================================
+
+def verificar_resultados(por_bloques, en_memoria):
+    """Compara exactamente los resultados de ambos caminos"""
+    assert por_bloques['metricas'] == en_memoria['metricas'], "Las metricas globales difieren"
+    for nombre in ['resumen', 'variaciones', 'lineas_base']:
+        pd.testing.assert_frame_equal(por_bloques[nombre], en_memoria[nombre], check_exact=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Procesa la base por bloques con memoria acotada")
+    parser.add_argument('--base', default=RUTA_BASE, help="Ruta de la base unificada")
+    parser.add_argument('--memoria-max', type=float, default=MEMORIA_MAX_MB, help="Memoria maxima de trabajo (MB)")
+    parser.add_argument('--cubetas', type=int, default=N_CUBETAS, help="Cubetas de derrame por prestador")
+    parser.add_argument('--temporal', default=DIR_TEMPORAL, help="Directorio temporal de derrame")
+    parser.add_argument('--salida', help="Directorio donde guardar los resultados")
+    parser.add_argument('--verificar', action='store_true', help="Compara con el camino en memoria")
+    args = parser.parse_args()
+
+    base_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    inicio = time.perf_counter()
+    try:
+        resultados = procesar_por_bloques(args.base, args.memoria_max, args.cubetas, args.temporal)
+    except MemoriaInsuficiente as e:
+        sys.exit(f"Error: {e}")
+    duracion = time.perf_counter() - inicio
+    pico_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    plan = resultados['plan']
+    print(f"Registros: {resultados['metricas']['registros']:,} | bloques de {plan['filas_bloque']:,} filas | "
+          f"lotes: {plan['lotes']} | tiempo: {duracion:.1f}s | "
+          f"memoria de trabajo pico: {pico_mb - base_mb:,.0f} MB (proceso: {pico_mb:,.0f} MB)")
+
+    if args.salida:
+        os.makedirs(args.salida, exist_ok=True)
+        for nombre in ['resumen', 'variaciones', 'lineas_base']:
+            resultados[nombre].to_parquet(os.path.join(args.salida, f'{nombre}.parquet'), index=False)
+        with open(os.path.join(args.salida, 'metricas.json'), 'w', encoding='utf-8') as f:
+            json.dump({'metricas': resultados['metricas'], 'plan': plan}, f, indent=2, ensure_ascii=False)
+
+    if args.verificar:
+        verificar_resultados(resultados, procesar_en_memoria(args.base))
+        print("Resultados identicos al camino en memoria")
+
+    # La memoria de los lotes se estima con FACTOR_TRABAJO: se controla contra la medida
+    if pico_mb - base_mb > args.memoria_max:
+        sys.exit(
+            f"Error: la memoria de trabajo pico ({pico_mb - base_mb:,.0f} MB) supero la memoria maxima "
+            f"({args.memoria_max:,.0f} MB); aumentar FACTOR_TRABAJO ({FACTOR_TRABAJO})"
+        )
+
+if __name__ == "__main__":
+    main()
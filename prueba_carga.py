@@ -0,0 +1,338 @@
+"""Prueba de carga con sesiones concurrentes de la app de auditoria.
+
+Levanta la app con `streamlit run` en un puerto local y simula N sesiones
+simultaneas con un cliente websocket headless que habla el protocolo de
+Streamlit. Cada sesion ejecuta flujos realistas (auditoria en la pestaña 1,
+dashboards de prestadores grandes en la pestaña 2 y analisis de variaciones
+en la pestaña 3). Se reportan percentiles de latencia, throughput y memoria
+del servidor por nivel de concurrencia.
+
+Se usa un servidor real y no AppTest porque AppTest comparte estado global
+del runtime entre instancias y no admite ejecuciones concurrentes.
+
+Uso:
+
+    python prueba_carga.py --concurrencia 1 2 4 8 --iteraciones 3
+    python prueba_carga.py --url http://servidor:8501 --concurrencia 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+
+import numpy as np
+from tornado.websocket import websocket_connect
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+RUTA_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app_auditoria_comparativa.py')
+RUTA_LANZADOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'iniciar_app.py')
+
+PRESTADORES_GRANDES = ['P5', 'P147', 'P32']
+
+# ============================================
+# SERVIDOR
+# ============================================
+
+def iniciar_servidor(puerto, timeout=120, lanzador=False):
+    """Levanta la app y espera a que responda.
+
+    Por defecto usa streamlit run; con lanzador usa iniciar_app.py, que
+    precalienta los datos antes de levantar el servidor.
+    """
+    comando = [sys.executable, RUTA_LANZADOR] if lanzador else [sys.executable, '-m', 'streamlit', 'run', RUTA_APP]
+    proceso = subprocess.Popen(
+        comando + [
+            '--server.headless=true',
+            f'--server.port={puerto}',
+            '--browser.gatherUsageStats=false'
+        ],
+        cwd=os.path.dirname(RUTA_APP),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+    inicio = time.perf_counter()
+    while time.perf_counter() - inicio < timeout:
+        try:
+            with urllib.request.urlopen(f'http://localhost:{puerto}/_stcore/health', timeout=1) as r:
+                if r.status == 200:
+                    return proceso
+        except OSError:
+            time.sleep(0.2)
+
+    proceso.terminate()
+    raise RuntimeError(f"El servidor no respondio en {timeout}s")
+
+def memoria_proceso_mb(pid):
+    """Memoria residente de un proceso en MB (None si no se puede medir)"""
+    if pid is None:
+        return None
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            paginas = int(f.read().split()[1])
+        return paginas * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError):
+        return None
+
+# ============================================
+# CLIENTE DE SESION
+# ============================================
+
+class SesionStreamlit:
+    """Sesion headless contra un servidor Streamlit.
+
+    Replica lo que hace el navegador: envia reruns con el estado de los
+    widgets y espera el mensaje de fin de script.
+    """
+
+    def __init__(self, url, timeout):
+        self.url = url.rstrip('/').replace('http', 'ws', 1) + '/_stcore/stream'
+        self.timeout = timeout
+        self.widgets = {}
+        self.estados = {}
+        self._mensajes = {}
+        self.errores = 0
+
+    async def conectar(self):
+        self.ws = await websocket_connect(self.url, max_message_size=512 * 1024 ** 2)
+
+    def cerrar(self):
+        self.ws.close()
+
+    async def ejecutar(self, disparadores=()):
+        """Ejecuta el script y devuelve la latencia hasta que termina"""
+        estados = dict(self.estados)
+        for etiqueta in disparadores:
+            estado = WidgetState(id=self.widget(etiqueta).id, trigger_value=True)
+            estados[estado.id] = estado
+
+        msg = BackMsg()
+        msg.rerun_script.query_string = ''
+        msg.rerun_script.page_script_hash = ''
+        msg.rerun_script.widget_states.widgets.extend(estados.values())
+
+        inicio = time.perf_counter()
+        await self.ws.write_message(msg.SerializeToString(), binary=True)
+        await asyncio.wait_for(self._esperar_fin(), self.timeout)
+        return time.perf_counter() - inicio
+
+    async def _esperar_fin(self):
+        widgets = {}
+        while True:
+            datos = await self.ws.read_message()
+            if datos is None:
+                raise ConnectionError("El servidor cerro la conexion")
+
+            msg = ForwardMsg()
+            msg.ParseFromString(datos)
+            if msg.WhichOneof('type') == 'ref_hash':
+                # Los mensajes grandes ya enviados llegan como referencia al original
+                msg = self._mensajes[msg.ref_hash]
+            elif msg.metadata.cacheable:
+                self._mensajes[msg.hash] = msg
+            tipo = msg.WhichOneof('type')
+
+            if tipo == 'delta' and msg.delta.WhichOneof('type') == 'new_element':
+                elemento = msg.delta.new_element
+                tipo_elemento = elemento.WhichOneof('type')
+                if tipo_elemento == 'exception':
+                    self.errores += 1
+                proto = getattr(elemento, tipo_elemento)
+                if hasattr(proto, 'id') and hasattr(proto, 'label'):
+                    # Se guardan todos los widgets de cada etiqueta para detectar etiquetas repetidas
+                    widgets.setdefault(proto.label, {})[proto.id] = proto
+            elif tipo == 'script_finished':
+                # Los ids cambian si cambian las opciones: vale solo lo que dibujo esta ejecucion
+                self.widgets = widgets
+                return
+
+    def widget(self, etiqueta):
+        """Widget con esa etiqueta (falla si la etiqueta no identifica a un unico widget)"""
+        widgets = self.widgets.get(etiqueta, {})
+        if len(widgets) != 1:
+            raise ValueError(f"La etiqueta {etiqueta!r} corresponde a {len(widgets)} widgets")
+        return next(iter(widgets.values()))
+
+    def seleccionar(self, etiqueta, opcion):
+        proto = self.widget(etiqueta)
+        self.estados[proto.id] = WidgetState(id=proto.id, int_value=list(proto.options).index(opcion))
+
+    def escribir_numero(self, etiqueta, valor):
+        proto = self.widget(etiqueta)
+        self.estados[proto.id] = WidgetState(id=proto.id, double_value=valor)
+
+# ============================================
+# FLUJOS DE USUARIO
+# ============================================
+
+async def flujo_auditoria(sesion, rng):
+    """Auditoria de factura en la pestaña 1"""
+    sesion.seleccionar("PRESTADOR", "P1")
+    sesion.seleccionar("PRESTACION", "Anteojos")
+    sesion.escribir_numero("IMPORTE CM (EN PESOS)", float(rng.choice([300000, 900000, 1500000])))
+    return await sesion.ejecutar(["REALIZAR AUDITORIA"])
+
+async def flujo_dashboard(sesion, rng):
+    """Dashboard temporal de un prestador grande en la pestaña 2"""
+    sesion.seleccionar("SELECCIONE PRESTADOR PARA ANALIZAR", rng.choice(PRESTADORES_GRANDES))
+    return await sesion.ejecutar(["GENERAR DASHBOARD"])
+
+async def flujo_variaciones(sesion, rng):
+    """Analisis de variaciones de un prestador grande en la pestaña 3"""
+    sesion.seleccionar("SELECCIONE PRESTADOR", rng.choice(PRESTADORES_GRANDES))
+    return await sesion.ejecutar(["ANALIZAR VARIACIONES"])
+
+FLUJOS = {
+    'auditoria': flujo_auditoria,
+    'dashboard': flujo_dashboard,
+    'variaciones': flujo_variaciones
+}
+
+# ============================================
+# MEDICION
+# ============================================
+
+async def ejecutar_sesion(url, id_sesion, iteraciones, flujos, timeout, semilla):
+    """Ejecuta una sesion completa y devuelve las mediciones de cada paso"""
+    rng = random.Random(semilla + id_sesion)
+    sesion = SesionStreamlit(url, timeout)
+    mediciones = []
+
+    await sesion.conectar()
+    try:
+        mediciones.append(('carga_inicial', await sesion.ejecutar(), True))
+
+        for _ in range(iteraciones):
+            for nombre in rng.sample(flujos, len(flujos)):
+                errores_previos = sesion.errores
+                try:
+                    latencia = await FLUJOS[nombre](sesion, rng)
+                    mediciones.append((nombre, latencia, sesion.errores == errores_previos))
+                except asyncio.TimeoutError:
+                    mediciones.append((nombre, float(timeout), False))
+    finally:
+        sesion.cerrar()
+
+    return mediciones
+
+async def monitorear_memoria(pid, muestras, intervalo=0.2):
+    """Muestrea la memoria del servidor hasta ser cancelado"""
+    while True:
+        memoria = memoria_proceso_mb(pid)
+        if memoria is not None:
+            muestras.append(memoria)
+        await asyncio.sleep(intervalo)
+
+def percentiles(latencias):
+    """Resume una lista de latencias en segundos"""
+    valores = np.asarray(latencias)
+    return {
+        'n': int(len(valores)),
+        'p50': float(np.percentile(valores, 50)),
+        'p90': float(np.percentile(valores, 90)),
+        'p95': float(np.percentile(valores, 95)),
+        'p99': float(np.percentile(valores, 99)),
+        'max': float(valores.max())
+    }
+
+async def ejecutar_nivel(url, pid, concurrencia, iteraciones, flujos, timeout, semilla):
+    """Ejecuta un nivel de concurrencia y resume sus resultados"""
+    muestras = []
+    monitor = asyncio.create_task(monitorear_memoria(pid, muestras))
+
+    inicio = time.perf_counter()
+    sesiones = await asyncio.gather(*[
+        ejecutar_sesion(url, i, iteraciones, flujos, timeout, semilla)
+        for i in range(concurrencia)
+    ])
+    duracion = time.perf_counter() - inicio
+    monitor.cancel()
+
+    mediciones = [m for sesion in sesiones for m in sesion]
+    interacciones = [m for m in mediciones if m[0] != 'carga_inicial']
+
+    return {
+        'concurrencia': concurrencia,
+        'duracion_s': duracion,
+        'throughput_ops_s': len(interacciones) / duracion,
+        'errores': sum(1 for m in mediciones if not m[2]),
+        'memoria_pico_mb': max(muestras) if muestras else None,
+        'latencias': {
+            nombre: percentiles([m[1] for m in mediciones if m[0] == nombre])
+            for nombre in ['carga_inicial'] + flujos
+        },
+        'latencia_total': percentiles([m[1] for m in interacciones])
+    }
+
+# ============================================
+# REPORTE
+# ============================================
+
+def imprimir_reporte(resultados):
+    """Imprime una tabla de resultados por nivel de concurrencia"""
+    print(f"{'Conc.':>5} {'Paso':<14} {'N':>4} {'p50':>7} {'p90':>7} {'p95':>7} {'p99':>7} {'max':>7}")
+    for nivel in resultados:
+        filas = list(nivel['latencias'].items()) + [('TOTAL', nivel['latencia_total'])]
+        for nombre, p in filas:
+            print(f"{nivel['concurrencia']:>5} {nombre:<14} {p['n']:>4} "
+                  f"{p['p50']:>7.2f} {p['p90']:>7.2f} {p['p95']:>7.2f} {p['p99']:>7.2f} {p['max']:>7.2f}")
+        memoria = nivel['memoria_pico_mb']
+        memoria = f"{memoria:,.0f} MB" if memoria is not None else "n/d"
+        print(f"      throughput: {nivel['throughput_ops_s']:.2f} ops/s | "
+              f"memoria pico servidor: {memoria} | errores: {nivel['errores']}")
+        print()
+
+async def ejecutar_prueba(url, pid, args):
+    # Sesion de calentamiento para que el primer nivel no mida la carga en frio
+    await ejecutar_sesion(url, -1, 0, args.flujos, args.timeout, args.semilla)
+
+    resultados = []
+    for n in args.concurrencia:
+        resultados.append(await ejecutar_nivel(url, pid, n, args.iteraciones, args.flujos, args.timeout, args.semilla))
+    return resultados
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de la app de auditoria")
+    parser.add_argument('--concurrencia', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help="Niveles de sesiones simultaneas")
+    parser.add_argument('--iteraciones', type=int, default=3, help="Repeticiones de los flujos por sesion")
+    parser.add_argument('--flujos', nargs='+', choices=list(FLUJOS), default=list(FLUJOS),
+                        help="Flujos a simular")
+    parser.add_argument('--url', help="Servidor existente (por defecto se levanta uno local)")
+    parser.add_argument('--pid', type=int, help="PID del servidor existente, para medir su memoria")
+    parser.add_argument('--puerto', type=int, default=8599, help="Puerto del servidor local")
+    parser.add_argument('--timeout', type=float, default=300, help="Timeout por ejecucion del script (s)")
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--salida', help="Archivo JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    servidor = None
+    if args.url:
+        url, pid = args.url, args.pid
+    else:
+        servidor = iniciar_servidor(args.puerto)
+        url, pid = f'http://localhost:{args.puerto}', servidor.pid
+
+    try:
+        resultados = asyncio.run(ejecutar_prueba(url, pid, args))
+    finally:
+        if servidor is not None:
+            servidor.terminate()
+            servidor.wait()
+
+    imprimir_reporte(resultados)
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2)
+
+if __name__ == "__main__":
+    main()
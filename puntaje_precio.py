@@ -0,0 +1,144 @@
+"""Puntaje de precio unitario de facturas.
+
+El precio unitario facturado (importe / cantidad) se compara contra la
+distribucion historica de PU del prestador para el mismo Cod prestacion y
+Tipo Clase CM. Si el prestador tiene poca historia para esa combinacion se
+usa la distribucion de pares (todos los prestadores con el mismo codigo y
+tipo).
+
+Solo cuentan los registros de meses anteriores al mes liquidado (el mismo
+corte que el historico de la auditoria): auditar un mes pasado no usa
+precios que todavia no se conocian.
+
+Los PU de cada clave se precalculan una vez por version de datos, ordenados
+por mes y contiguos en un arreglo, con offsets por grupo y un diccionario de
+clave a grupo. Cada puntaje es una busqueda en el diccionario, un
+searchsorted sobre los meses del grupo y los estadisticos del prefijo.
+"""
+
+import numpy as np
+import pandas as pd
+
+from motor_auditoria import clasificar_anomalia
+
+COLUMNAS_PU = ['ID', 'Prestacion', 'Cod prestacion', 'Tipo Clase CM', 'MesFecha', 'PU']
+
+CLAVE_PRESTADOR = ['ID', 'Cod prestacion', 'Tipo Clase CM']
+CLAVE_PARES = ['Cod prestacion', 'Tipo Clase CM']
+
+# Historia minima para usar la distribucion propia del prestador
+MIN_REGISTROS_PRESTADOR = 6
+MIN_REGISTROS_PARES = 2
+
+class DistribucionesAgrupadas:
+    """Valores ordenados por clave y por mes, con offsets por grupo"""
+
+    def __init__(self, tabla, columnas_clave, columna_valor, columna_mes='MesFecha'):
+        tabla = tabla.sort_values(columnas_clave + [columna_mes], kind='mergesort')
+        claves = tabla[columnas_clave]
+        self.valores = tabla[columna_valor].to_numpy(dtype=float)
+        self.meses = tabla[columna_mes].to_numpy(dtype='datetime64[ns]')
+
+        cambio = np.ones(len(tabla), dtype=bool)
+        if len(tabla):
+            cambio[1:] = (claves.iloc[1:].to_numpy() != claves.iloc[:-1].to_numpy()).any(axis=1)
+        self.inicios = np.flatnonzero(cambio)
+        self.n = np.diff(np.append(self.inicios, len(tabla)))
+
+        filas_inicio = claves.iloc[self.inicios].itertuples(index=False, name=None)
+        self.grupos = {clave: i for i, clave in enumerate(filas_inicio)}
+
+    def grupo(self, clave):
+        return self.grupos.get(clave)
+
+    def anteriores(self, g, fecha=None):
+        """Valores del grupo con mes anterior a fecha (todos si no hay fecha), ordenados"""
+        inicio, fin = self.inicios[g], self.inicios[g] + self.n[g]
+        if fecha is not None:
+            corte = np.datetime64(pd.Timestamp(fecha), 'ns')
+            fin = inicio + np.searchsorted(self.meses[inicio:fin], corte, side='left')
+        return np.sort(self.valores[inicio:fin])
+
+class PuntajePrecioUnitario:
+    """Distribuciones de PU por prestador y por pares, indexadas por clave"""
+
+    def __init__(self, df):
+        validos = (
+            df['PU'].gt(0)
+            & df['ID'].notna()
+            & df['Cod prestacion'].notna()
+            & df['Tipo Clase CM'].notna()
+        )
+        tabla = df.loc[validos, COLUMNAS_PU].copy()
+        for col in ['ID', 'Prestacion', 'Cod prestacion', 'Tipo Clase CM']:
+            tabla[col] = tabla[col].astype(str)
+
+        self.prestador = DistribucionesAgrupadas(tabla, CLAVE_PRESTADOR, 'PU')
+        self.pares = DistribucionesAgrupadas(tabla, CLAVE_PARES, 'PU')
+
+        # Codigo mas frecuente de cada prestacion, por prestador y global
+        frecuencias = tabla.groupby(['ID', 'Prestacion', 'Cod prestacion']).size().sort_values(ascending=False, kind='mergesort')
+        por_prestador = frecuencias.reset_index().drop_duplicates(['ID', 'Prestacion'])
+        self._codigo_prestador = dict(zip(zip(por_prestador['ID'], por_prestador['Prestacion']), por_prestador['Cod prestacion']))
+        globales = frecuencias.groupby(['Prestacion', 'Cod prestacion']).sum().sort_values(ascending=False, kind='mergesort')
+        globales = globales.reset_index().drop_duplicates('Prestacion')
+        self._codigo_global = dict(zip(globales['Prestacion'], globales['Cod prestacion']))
+
+    def codigo_prestacion(self, prestador, prestacion):
+        """Cod prestacion de una prestacion (el del prestador si lo factura)"""
+        clave = (str(prestador), str(prestacion))
+        return self._codigo_prestador.get(clave, self._codigo_global.get(str(prestacion)))
+
+    def puntuar(self, prestador, prestacion, tipo_clase, importe, cantidad=1, mes_liquidado=None):
+        """Puntaje del precio unitario facturado.
+
+        Las distribuciones usan solo meses anteriores a mes_liquidado (toda la
+        historia si es None). Devuelve None si no hay historia de PU para el
+        codigo y tipo. La cantidad debe ser positiva.
+        """
+        if not cantidad > 0:
+            raise ValueError(f"La cantidad debe ser positiva: {cantidad}")
+
+        cod = self.codigo_prestacion(prestador, prestacion)
+        if cod is None:
+            return None
+
+        g = self.prestador.grupo((str(prestador), cod, str(tipo_clase)))
+        valores = self.prestador.anteriores(g, mes_liquidado) if g is not None else np.empty(0)
+        referencia = 'prestador'
+
+        if len(valores) < MIN_REGISTROS_PRESTADOR:
+            g = self.pares.grupo((cod, str(tipo_clase)))
+            valores = self.pares.anteriores(g, mes_liquidado) if g is not None else np.empty(0)
+            referencia = 'pares'
+            if len(valores) < MIN_REGISTROS_PARES:
+                return None
+
+        precio_unitario = float(importe) / float(cantidad)
+        promedio = float(valores.mean())
+        std = float(valores.std(ddof=1))
+
+        z_score = (precio_unitario - promedio) / std if std > 0 else 0.0
+        dif_pct = (precio_unitario - promedio) / promedio * 100 if promedio > 0 else 0.0
+        clasificacion, _, _ = clasificar_anomalia(z_score)
+
+        # Cuantiles con interpolacion lineal (mismo criterio que pandas)
+        p10, mediana, p90 = np.quantile(valores, [0.10, 0.5, 0.90])
+
+        return {
+            'precio_unitario': precio_unitario,
+            'cantidad': float(cantidad),
+            'cod_prestacion': cod,
+            'tipo_clase': str(tipo_clase),
+            'referencia': referencia,
+            'n_registros': len(valores),
+            'promedio': promedio,
+            'mediana': float(mediana),
+            'std': std,
+            'p10': float(p10),
+            'p90': float(p90),
+            'percentil': float(np.searchsorted(valores, precio_unitario, side='right') / len(valores) * 100),
+            'z_score': float(z_score),
+            'dif_pct': float(dif_pct),
+            'clasificacion': clasificacion
+        }
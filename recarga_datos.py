@@ -0,0 +1,191 @@
+"""Recarga de la base en segundo plano con intercambio atomico.
+
+Un hilo vigila la firma del archivo de la base. Cuando cambia (y se mantiene
+estable entre dos revisiones, para no leer un archivo a medio copiar) genera
+las particiones de la nueva version y construye sus indices derivados.
+Recien entonces reemplaza la version activa, con una sola asignacion.
+
+Cada ejecucion de la app toma la version activa al comenzar y la usa hasta
+terminar, de modo que las consultas en curso terminan sobre la version
+anterior. Se conservan en disco la version activa y la anterior.
+"""
+
+import threading
+import time
+from datetime import datetime
+
+from motor_auditoria import RUTA_BASE
+from almacenamiento import (
+    DIR_PARTICIONES,
+    firma_archivo,
+    dir_version,
+    asegurar_particiones,
+    cargar_particiones,
+    leer_manifiesto_base,
+    limpiar_versiones
+)
+from indice_similitud import IndiceSimilitud, COLUMNAS_CASO
+from puntaje_precio import PuntajePrecioUnitario, COLUMNAS_PU
+from duplicados import DetectorDuplicados, columnas_deteccion
+from modelo_estacional import modelo_de_version, COLUMNAS_MODELO
+from perfiles_prestadores import PerfilesPrestadores, COLUMNAS_PERFIL
+
+INTERVALO_REVISION = 10.0
+
+# Indices derivados que se construyen para cada version de la base, a partir
+# de su directorio y del de la version anterior (None en la primera carga)
+CONSTRUCTORES_INDICES = {
+    'similitud': lambda directorio, dir_anterior: IndiceSimilitud(
+        cargar_particiones(columnas=COLUMNAS_CASO, dir_version_base=directorio)
+    ),
+    'puntaje_pu': lambda directorio, dir_anterior: PuntajePrecioUnitario(
+        cargar_particiones(columnas=COLUMNAS_PU, dir_version_base=directorio)
+    ),
+    'duplicados': lambda directorio, dir_anterior: DetectorDuplicados(
+        cargar_particiones(
+            columnas=columnas_deteccion(leer_manifiesto_base(directorio)['columnas']),
+            dir_version_base=directorio
+        )
+    ),
+    'estacional': lambda directorio, dir_anterior: modelo_de_version(
+        directorio,
+        lambda: cargar_particiones(columnas=COLUMNAS_MODELO, dir_version_base=directorio),
+        dir_anterior
+    ),
+    'perfiles': lambda directorio, dir_anterior: PerfilesPrestadores(
+        cargar_particiones(columnas=COLUMNAS_PERFIL, dir_version_base=directorio)
+    )
+}
+
+_gestor = None
+_bloqueo_gestor = threading.Lock()
+
+class VersionDatos:
+    """Una version de la base: manifiesto, directorio e indices derivados"""
+
+    def __init__(self, version, directorio, manifiesto, constructores, segundos_carga, dir_anterior=None):
+        self.version = version
+        self.directorio = directorio
+        self.dir_anterior = dir_anterior
+        self.manifiesto = manifiesto
+        self.cargada = datetime.now()
+        self.segundos_carga = segundos_carga
+        self._constructores = constructores
+        self._indices = {}
+        self._bloqueo = threading.Lock()
+
+    def indice(self, nombre):
+        """Indice derivado de esta version (se construye si todavia no existe)"""
+        indice = self._indices.get(nombre)
+        if indice is None:
+            with self._bloqueo:
+                indice = self._indices.get(nombre)
+                if indice is None:
+                    indice = self._constructores[nombre](self.directorio, self.dir_anterior)
+                    self._indices[nombre] = indice
+        return indice
+
+    def lista(self, nombre):
+        """Indica si el indice ya esta construido (sin esperarlo ni construirlo)"""
+        return nombre in self._indices
+
+    def construir_indices(self):
+        for nombre in self._constructores:
+            self.indice(nombre)
+
+class GestorDatos:
+    """Version activa de la base y vigilancia del archivo de origen.
+
+    constructores es un diccionario nombre -> funcion(directorio, dir_anterior)
+    con los indices derivados que se construyen para cada version.
+    """
+
+    def __init__(self, constructores=CONSTRUCTORES_INDICES, ruta_base=RUTA_BASE, dir_particiones=DIR_PARTICIONES,
+                 intervalo=INTERVALO_REVISION, construir_indices=False):
+        self.ruta_base = ruta_base
+        self.dir_particiones = dir_particiones
+        self.intervalo = intervalo
+        self.constructores = constructores
+
+        self.recargando = False
+        self.error = None
+
+        self._activa = self._cargar()
+        limpiar_versiones([self._activa.version], dir_particiones)
+
+        if construir_indices:
+            self._activa.construir_indices()
+        else:
+            # Los indices de la primera version se construyen sin bloquear el arranque
+            threading.Thread(target=self._activa.construir_indices, daemon=True).start()
+        self._hilo = threading.Thread(target=self._vigilar, daemon=True)
+        self._hilo.start()
+
+    @property
+    def activa(self):
+        return self._activa
+
+    def _cargar(self, dir_anterior=None):
+        inicio = time.perf_counter()
+        manifiesto = asegurar_particiones(self.ruta_base, self.dir_particiones)
+        version = manifiesto['firma_origen']
+        return VersionDatos(
+            version,
+            dir_version(version, self.dir_particiones),
+            manifiesto,
+            self.constructores,
+            time.perf_counter() - inicio,
+            dir_anterior
+        )
+
+    def _vigilar(self):
+        pendiente = None
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                firma = firma_archivo(self.ruta_base)
+            except OSError:
+                continue
+
+            if firma == self._activa.version:
+                pendiente = None
+                continue
+
+            # Se espera a que la firma se repita para no leer una copia incompleta
+            if firma != pendiente:
+                pendiente = firma
+                continue
+
+            self.recargar()
+            pendiente = None
+
+    def recargar(self):
+        """Construye la version actual de la base y la activa"""
+        self.recargando = True
+        try:
+            inicio = time.perf_counter()
+            nueva = self._cargar(self._activa.directorio)
+            nueva.construir_indices()
+            nueva.segundos_carga = time.perf_counter() - inicio
+
+            anterior = self._activa
+            self._activa = nueva
+            limpiar_versiones([nueva.version, anterior.version], self.dir_particiones)
+            self.error = None
+        except Exception as e:
+            self.error = f"{datetime.now():%d/%m/%Y %H:%M} - {e}"
+        finally:
+            self.recargando = False
+
+def obtener_gestor(construir_indices=False):
+    """Gestor de la base compartido por todo el proceso.
+
+    Lo crea el lanzador antes de aceptar sesiones (con los indices ya
+    construidos) o, si la app se inicio con streamlit run, la primera sesion.
+    """
+    global _gestor
+    if _gestor is None:
+        with _bloqueo_gestor:
+            if _gestor is None:
+                _gestor = GestorDatos(construir_indices=construir_indices)
+    return _gestor
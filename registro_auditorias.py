@@ -0,0 +1,243 @@
+"""Registro persistente de auditorias.
+
+Guarda cada auditoria de factura (entradas, version de datos y resultado)
+en un archivo SQLite embebido. Las escrituras se acumulan en memoria y se
+vuelcan en lotes desde un hilo de fondo. Las consultas repetidas con las
+mismas entradas y la misma version de datos se sirven desde el registro
+sin recalcular.
+"""
+
+import atexit
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+RUTA_REGISTRO = 'auditorias.sqlite'
+
+# Incrementar al cambiar el calculo de las auditorias: los resultados
+# registrados con otra version no se reutilizan
+VERSION_CALCULO = 2
+
+# Resultados recientes que se mantienen en memoria
+MAX_MEMO = 10000
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS auditorias (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    registrado TEXT NOT NULL,
+    prestador TEXT NOT NULL,
+    prestacion TEXT NOT NULL,
+    fecha_auditoria TEXT NOT NULL,
+    mes TEXT NOT NULL,
+    importe REAL NOT NULL,
+    tipo_clase TEXT,
+    nomenclador TEXT,
+    cantidad INTEGER,
+    version_datos TEXT NOT NULL,
+    version_calculo INTEGER NOT NULL DEFAULT 0,
+    clasificacion TEXT NOT NULL,
+    z_score REAL,
+    dif_pct REAL,
+    desde_registro INTEGER NOT NULL DEFAULT 0,
+    resultado TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_auditorias_consulta
+    ON auditorias (prestador, prestacion, fecha_auditoria, importe, version_datos);
+CREATE INDEX IF NOT EXISTS idx_auditorias_clasificacion_mes
+    ON auditorias (clasificacion, mes);
+CREATE INDEX IF NOT EXISTS idx_auditorias_prestador_mes
+    ON auditorias (prestador, mes);
+"""
+
+COLUMNAS = [
+    'registrado', 'prestador', 'prestacion', 'fecha_auditoria', 'mes', 'importe',
+    'tipo_clase', 'nomenclador', 'cantidad', 'version_datos', 'version_calculo', 'clasificacion',
+    'z_score', 'dif_pct', 'desde_registro', 'resultado'
+]
+
+# Columnas de listar (las decisiones, sin el resultado completo)
+COLUMNAS_LISTADO = [
+    'registrado', 'prestador', 'prestacion', 'mes', 'importe', 'clasificacion', 'z_score', 'dif_pct',
+    'tipo_clase', 'cantidad', 'version_datos', 'desde_registro'
+]
+
+def _serializar(resultado):
+    """Convierte el resultado de una auditoria a JSON"""
+    def convertir(valor):
+        if isinstance(valor, np.ndarray):
+            return valor.tolist()
+        if isinstance(valor, np.generic):
+            return valor.item()
+        raise TypeError(f"Tipo no serializable: {type(valor)}")
+    return json.dumps(resultado, default=convertir)
+
+def _deserializar(texto):
+    """Reconstruye el resultado de una auditoria desde JSON"""
+    resultado = json.loads(texto)
+    resultado['stats']['datos'] = np.asarray(resultado['stats']['datos'], dtype=float)
+    return resultado
+
+class RegistroAuditorias:
+    """Registro de auditorias sobre SQLite con escritura en lotes"""
+
+    def __init__(self, ruta=RUTA_REGISTRO, tamano_lote=50, intervalo_volcado=2.0):
+        self.ruta = ruta
+        self.tamano_lote = tamano_lote
+        self.intervalo_volcado = intervalo_volcado
+
+        self._pendientes = []
+        self._memo = OrderedDict()
+        self._bloqueo = threading.Lock()
+        self._bloqueo_escritura = threading.Lock()
+        self._hay_lote = threading.Event()
+
+        with self._conectar() as conexion:
+            conexion.execute('PRAGMA journal_mode=WAL')
+            # Registros anteriores a version_calculo: quedan con 0 y no se reutilizan
+            columnas = [f[1] for f in conexion.execute("PRAGMA table_info(auditorias)")]
+            if columnas and 'version_calculo' not in columnas:
+                conexion.execute("ALTER TABLE auditorias ADD COLUMN version_calculo INTEGER NOT NULL DEFAULT 0")
+            conexion.executescript(ESQUEMA)
+
+        self._hilo = threading.Thread(target=self._volcar_periodicamente, daemon=True)
+        self._hilo.start()
+        atexit.register(self.volcar)
+
+    @contextmanager
+    def _conectar(self):
+        conexion = sqlite3.connect(self.ruta, timeout=30)
+        try:
+            with conexion:
+                yield conexion
+        finally:
+            conexion.close()
+
+    def _recordar(self, clave, resultado):
+        self._memo[clave] = resultado
+        self._memo.move_to_end(clave)
+        if len(self._memo) > MAX_MEMO:
+            self._memo.popitem(last=False)
+
+    @staticmethod
+    def _clave(prestador, prestacion, fecha_auditoria, importe, version_datos, tipo_clase, cantidad):
+        return (
+            str(prestador), str(prestacion), str(fecha_auditoria), float(importe), str(version_datos),
+            tipo_clase, cantidad, VERSION_CALCULO
+        )
+
+    # ============================================
+    # ESCRITURA
+    # ============================================
+
+    def registrar(self, prestador, prestacion, fecha_auditoria, importe, version_datos, resultado,
+                  tipo_clase=None, nomenclador=None, cantidad=None, desde_registro=False):
+        """Encola una auditoria para su escritura en el proximo lote"""
+        clave = self._clave(prestador, prestacion, fecha_auditoria, importe, version_datos, tipo_clase, cantidad)
+        fila = (
+            datetime.now().isoformat(timespec='seconds'),
+            clave[0], clave[1], clave[2], pd.Timestamp(fecha_auditoria).strftime('%Y-%m'), clave[3],
+            tipo_clase, nomenclador, cantidad, clave[4], VERSION_CALCULO,
+            resultado['clasificacion'], resultado['z_score'], resultado['dif_pct'],
+            int(desde_registro), _serializar(resultado)
+        )
+
+        with self._bloqueo:
+            self._recordar(clave, resultado)
+            self._pendientes.append(fila)
+            if len(self._pendientes) >= self.tamano_lote:
+                self._hay_lote.set()
+
+    def volcar(self):
+        """Escribe en SQLite las auditorias pendientes"""
+        with self._bloqueo_escritura:
+            with self._bloqueo:
+                lote, self._pendientes = self._pendientes, []
+            if not lote:
+                return
+            with self._conectar() as conexion:
+                conexion.executemany(
+                    f"INSERT INTO auditorias ({', '.join(COLUMNAS)}) VALUES ({', '.join('?' * len(COLUMNAS))})",
+                    lote
+                )
+
+    def _volcar_periodicamente(self):
+        while True:
+            self._hay_lote.wait(self.intervalo_volcado)
+            self._hay_lote.clear()
+            self.volcar()
+
+    # ============================================
+    # LECTURA
+    # ============================================
+
+    def buscar(self, prestador, prestacion, fecha_auditoria, importe, version_datos, tipo_clase=None, cantidad=None):
+        """Devuelve el resultado de una auditoria identica ya registrada (o None)"""
+        clave = self._clave(prestador, prestacion, fecha_auditoria, importe, version_datos, tipo_clase, cantidad)
+
+        with self._bloqueo:
+            if clave in self._memo:
+                self._memo.move_to_end(clave)
+                return self._memo[clave]
+
+        with self._conectar() as conexion:
+            fila = conexion.execute(
+                "SELECT resultado FROM auditorias "
+                "WHERE prestador = ? AND prestacion = ? AND fecha_auditoria = ? "
+                "AND importe = ? AND version_datos = ? AND tipo_clase IS ? AND cantidad IS ? "
+                "AND version_calculo = ? ORDER BY id DESC LIMIT 1",
+                clave
+            ).fetchone()
+
+        if fila is None:
+            return None
+
+        resultado = _deserializar(fila[0])
+        with self._bloqueo:
+            self._recordar(clave, resultado)
+        return resultado
+
+    def _pendientes_listado(self):
+        """Auditorias todavia no volcadas, de la mas reciente a la mas antigua"""
+        with self._bloqueo:
+            pendientes = list(self._pendientes)
+        return pd.DataFrame(pendientes[::-1], columns=COLUMNAS)[COLUMNAS_LISTADO]
+
+    def listar(self, clasificacion=None, mes=None, prestador=None, limite=1000):
+        """Lista las decisiones registradas, filtrando por clasificacion, mes y prestador.
+
+        Incluye las auditorias que todavia esperan su lote sin forzar el volcado.
+        """
+        pendientes = self._pendientes_listado()
+
+        condiciones, parametros = [], []
+        for columna, valor in [('clasificacion', clasificacion), ('mes', mes), ('prestador', prestador)]:
+            if valor:
+                condiciones.append(f"{columna} = ?")
+                parametros.append(valor)
+                pendientes = pendientes[pendientes[columna] == valor]
+
+        consulta = f"SELECT {', '.join(COLUMNAS_LISTADO)} FROM auditorias"
+        if condiciones:
+            consulta += " WHERE " + " AND ".join(condiciones)
+        consulta += " ORDER BY id DESC LIMIT ?"
+        parametros.append(limite)
+
+        with self._conectar() as conexion:
+            registradas = pd.read_sql_query(consulta, conexion, params=parametros)
+
+        if pendientes.empty:
+            return registradas
+        return pd.concat([pendientes, registradas], ignore_index=True).head(limite)
+
+    def meses(self):
+        """Meses con auditorias registradas, del mas reciente al mas antiguo"""
+        with self._conectar() as conexion:
+            meses = {f[0] for f in conexion.execute("SELECT DISTINCT mes FROM auditorias")}
+        meses.update(self._pendientes_listado()['mes'])
+        return sorted(meses, reverse=True)
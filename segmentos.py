@@ -0,0 +1,233 @@
+"""Reducciones por segmentos sobre arreglos ordenados.
+
+Un segmento es un tramo contiguo de filas con la misma clave, por ejemplo
+una serie (ID, Prestacion) ordenada por mes. Los segmentos se describen con
+los offsets de su primera fila y cada reduccion se resuelve con NumPy sobre
+el arreglo completo (reduceat, cumsum, searchsorted), sin trabajo por grupo
+en Python.
+
+Se siguen los criterios de pandas groupby, de modo que los resultados son
+identicos: las reducciones omiten NaN (salvo primero/ultimo, que son
+posicionales), las sumas son compensadas (Kahan), la varianza se acumula con
+Welford, std usa ddof=1 y los cuantiles interpolan linealmente. Las dos
+acumulaciones secuenciales recorren la posicion dentro del segmento
+vectorizando sobre todos los segmentos a la vez, asi que el numero de pasos
+en Python es el largo del segmento mas largo.
+"""
+
+import numpy as np
+import pandas as pd
+
+class Segmentos:
+    """Particion de un arreglo en segmentos contiguos no vacios"""
+
+    def __init__(self, inicios, n_filas):
+        self.inicios = np.asarray(inicios, dtype=np.int64)
+        self.n_filas = int(n_filas)
+        self.finales = np.append(self.inicios[1:], self.n_filas if len(self.inicios) else []).astype(np.int64)
+        self.largos = self.finales - self.inicios
+
+    @classmethod
+    def desde_claves(cls, *claves):
+        """Segmentos de arreglos de claves ya ordenados: uno nuevo cada vez que cambia alguna clave"""
+        n_filas = len(claves[0])
+        cambio = np.zeros(n_filas, dtype=bool)
+        if n_filas:
+            cambio[0] = True
+            for clave in claves:
+                clave = np.asarray(clave)
+                cambio[1:] |= clave[1:] != clave[:-1]
+        return cls(np.flatnonzero(cambio), n_filas)
+
+    def __len__(self):
+        return len(self.inicios)
+
+    @property
+    def ids(self):
+        """Numero de segmento de cada fila"""
+        return np.repeat(np.arange(len(self)), self.largos)
+
+    def difundir(self, valores):
+        """Repite un valor por segmento en todas sus filas (como groupby.transform)"""
+        return np.repeat(np.asarray(valores), self.largos)
+
+    def filtrar(self, mascara):
+        """Segmentos de las filas donde mascara es verdadera (los vacios se descartan)"""
+        return Segmentos.desde_claves(self.ids[np.asarray(mascara, dtype=bool)])
+
+def agrupar(df, columnas):
+    """Ordena df por las claves de columnas y devuelve (df_ordenado, segmentos).
+
+    El orden de los segmentos es el de groupby(sort=True) y dentro de cada
+    segmento se conserva el orden original de las filas. Las filas con
+    alguna clave nula se descartan, igual que en groupby.
+    """
+    codigos = []
+    for columna in columnas:
+        serie = df[columna]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            codigos.append(serie.cat.codes.to_numpy())
+        else:
+            codigos.append(pd.factorize(serie, sort=True)[0])
+
+    validos = np.logical_and.reduce([c >= 0 for c in codigos])
+    codigos = [c[validos] for c in codigos]
+    orden = np.lexsort(codigos[::-1])
+
+    ordenado = df[validos].iloc[orden]
+    return ordenado, Segmentos.desde_claves(*[c[orden] for c in codigos])
+
+# ============================================
+# REDUCCIONES
+# ============================================
+
+def _sin_nan(valores):
+    valores = np.asarray(valores, dtype=float)
+    validos = ~np.isnan(valores)
+    return np.where(validos, valores, 0.0), validos
+
+def conteo(seg, valores=None):
+    """Cantidad de valores no nulos por segmento (o de filas si no se pasan valores)"""
+    if valores is None:
+        return seg.largos.copy()
+    _, validos = _sin_nan(valores)
+    return np.add.reduceat(validos.astype(np.int64), seg.inicios) if len(seg) else np.empty(0, dtype=np.int64)
+
+def _por_posicion(seg, valores, validos):
+    """Recorre los segmentos por posicion.
+
+    En el paso j entrega los numeros de segmento que tienen fila j, el valor
+    de esa fila y si es valido. Los segmentos se ordenan por largo
+    decreciente para que los que siguen activos sean siempre un prefijo.
+    """
+    orden = np.argsort(-seg.largos, kind='stable')
+    inicios = seg.inicios[orden]
+    largos_negativos = -seg.largos[orden]
+    for j in range(int(seg.largos.max()) if len(seg) else 0):
+        activos = np.searchsorted(largos_negativos, -j, side='left')
+        filas = inicios[:activos] + j
+        yield orden[:activos], valores[filas], validos[filas]
+
+def suma(seg, valores):
+    """Suma compensada (Kahan) por segmento"""
+    limpios, validos = _sin_nan(valores)
+    total = np.zeros(len(seg))
+    compensacion = np.zeros(len(seg))
+    for ids, valor, valido in _por_posicion(seg, limpios, validos):
+        y = valor - compensacion[ids]
+        t = total[ids] + y
+        nueva = t - total[ids] - y
+        # Con valores infinitos la compensacion es NaN y se descarta
+        nueva[np.isnan(nueva)] = 0.0
+        compensacion[ids] = np.where(valido, nueva, compensacion[ids])
+        total[ids] = np.where(valido, t, total[ids])
+    return total
+
+def media(seg, valores):
+    n = conteo(seg, valores)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(n > 0, suma(seg, valores) / n, np.nan)
+
+def desvio(seg, valores):
+    """Desvio estandar muestral (ddof=1) por segmento"""
+    limpios, validos = _sin_nan(valores)
+    n = np.zeros(len(seg))
+    promedio = np.zeros(len(seg))
+    m2 = np.zeros(len(seg))
+    for ids, valor, valido in _por_posicion(seg, limpios, validos):
+        n_nuevo = n[ids] + valido
+        anterior = promedio[ids]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            actual = np.where(valido, anterior + (valor - anterior) / n_nuevo, anterior)
+        m2[ids] += np.where(valido, (valor - actual) * (valor - anterior), 0.0)
+        promedio[ids] = actual
+        n[ids] = n_nuevo
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(n > 1, np.sqrt(m2 / (n - 1)), np.nan)
+
+def minimo(seg, valores):
+    if not len(seg):
+        return np.empty(0)
+    return np.fmin.reduceat(np.asarray(valores, dtype=float), seg.inicios)
+
+def maximo(seg, valores):
+    if not len(seg):
+        return np.empty(0)
+    return np.fmax.reduceat(np.asarray(valores, dtype=float), seg.inicios)
+
+def primero(seg, valores):
+    """Valor de la primera fila de cada segmento"""
+    return np.asarray(valores)[seg.inicios]
+
+def ultimo(seg, valores):
+    """Valor de la ultima fila de cada segmento"""
+    return np.asarray(valores)[seg.finales - 1]
+
+def _posicion_valida(seg, valores, reduccion, relleno):
+    _, validos = _sin_nan(valores)
+    posiciones = np.where(validos, np.arange(seg.n_filas), relleno)
+    return reduccion.reduceat(posiciones, seg.inicios)
+
+def primero_valido(seg, valores):
+    """Primer valor no nulo de cada segmento (como groupby.first)"""
+    if not len(seg):
+        return np.empty(0)
+    valores = np.asarray(valores, dtype=float)
+    posicion = _posicion_valida(seg, valores, np.minimum, seg.n_filas)
+    return np.where(posicion < seg.n_filas, valores[np.minimum(posicion, seg.n_filas - 1)], np.nan)
+
+def ultimo_valido(seg, valores):
+    """Ultimo valor no nulo de cada segmento (como groupby.last)"""
+    if not len(seg):
+        return np.empty(0)
+    valores = np.asarray(valores, dtype=float)
+    posicion = _posicion_valida(seg, valores, np.maximum, -1)
+    return np.where(posicion >= 0, valores[np.maximum(posicion, 0)], np.nan)
+
+def variacion_pct(seg, valores):
+    """Variacion porcentual de cada fila respecto de la anterior del mismo segmento.
+
+    La primera fila de cada segmento queda en NaN. Los nulos no se rellenan:
+    se espera que valores contenga solo registros validos.
+    """
+    valores = np.asarray(valores, dtype=float)
+    resultado = np.full(len(valores), np.nan)
+    if len(valores) > 1:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            resultado[1:] = (valores[1:] / valores[:-1] - 1) * 100
+    resultado[seg.inicios] = np.nan
+    return resultado
+
+def _ordenados(seg, valores):
+    """Valores no nulos ordenados dentro de cada segmento, con sus offsets y conteos"""
+    valores = np.asarray(valores, dtype=float)
+    _, validos = _sin_nan(valores)
+    ids = seg.ids[validos]
+    valores = valores[validos]
+
+    ordenados = valores[np.lexsort((valores, ids))]
+    n = np.bincount(ids, minlength=len(seg))
+    inicios = np.cumsum(n) - n
+    return ordenados, inicios, n
+
+def _en_posicion(ordenados, inicios, n, posicion):
+    # Las posiciones de segmentos sin valores se apuntan a 0 y se descartan despues
+    return ordenados[np.where(n > 0, inicios + posicion, 0)] if len(ordenados) else np.full(len(n), np.nan)
+
+def cuantil(seg, valores, q):
+    """Cuantil q por segmento con interpolacion lineal, omitiendo nulos"""
+    ordenados, inicios, n = _ordenados(seg, valores)
+
+    posicion = (n - 1) * q
+    abajo = np.floor(posicion).astype(np.int64)
+    inferior = _en_posicion(ordenados, inicios, n, abajo)
+    superior = _en_posicion(ordenados, inicios, n, np.ceil(posicion).astype(np.int64))
+    return np.where(n > 0, inferior + (superior - inferior) * (posicion - abajo), np.nan)
+
+def mediana(seg, valores):
+    """Mediana por segmento (promedio de los dos centrales si la cantidad es par)"""
+    ordenados, inicios, n = _ordenados(seg, valores)
+
+    inferior = _en_posicion(ordenados, inicios, n, np.maximum(n - 1, 0) // 2)
+    superior = _en_posicion(ordenados, inicios, n, n // 2)
+    return np.where(n > 0, (inferior + superior) / 2, np.nan)